@@ -0,0 +1,25 @@
+import logging
+
+import azure.functions as func
+
+from shared_code import accounts
+from shared_code.cache import task_list_cache
+from shared_code.search import title_index
+
+logger = logging.getLogger(__name__)
+
+
+async def main(timer: func.TimerRequest) -> None:
+    if timer.past_due:
+        logger.info("Cierre de bajas atrasado: se corre ahora")
+    # Completa las bajas que DELETE /user/profile dejó marcadas (o que se cortaron)
+    try:
+        result = await accounts.resume_pending()
+    except Exception:
+        logger.exception("Error completando bajas de cuentas")
+        raise
+    for user_id in result["users"]:
+        task_list_cache.invalidate(user_id)
+        title_index.invalidate(user_id)
+    if result["failed"]:
+        raise RuntimeError("%d account deletions could not be completed" % result["failed"])
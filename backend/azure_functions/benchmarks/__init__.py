@@ -0,0 +1,5 @@
+"""
+Benchmarks de carga de las funciones HTTP contra el store en memoria.
+
+Ver ``benchmarks/run.py``.
+"""
@@ -0,0 +1,186 @@
+"""
+Medición de RU por escritura y por consulta según la política de indexación.
+
+Crea dos contenedores temporales de tareas en la base configurada (COSMOS_*,
+sirve el emulador): uno con la política por defecto (indexa todo) y otro con
+``indexing.TASKS_INDEXING_POLICY``. Corre la misma carga en ambos (altas,
+PUT, PATCH, borrados lógicos, point reads y las consultas de tasks_get y
+tasks_stats) y compara el RU promedio de cada operación leyendo
+``x-ms-request-charge``. Al terminar borra los contenedores (``--keep`` los deja).
+
+Uso (desde backend/azure_functions)::
+
+    python -m benchmarks.ru
+    python -m benchmarks.ru --tasks 2000 --output ru.json
+
+Las consultas del contenedor por defecto usan el ORDER BY de un solo campo
+(como antes de los índices compuestos); las del indexado, el ORDER BY alineado
+con ``indexing.TASKS_COMPOSITE_INDEXES``.
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import uuid
+from collections import defaultdict
+
+from azure.cosmos import CosmosClient, PartitionKey
+
+from shared_code import db, indexing, metrics, queries, storage, tombstones
+
+logger = logging.getLogger("benchmarks.ru")
+
+STATUSES = ("pending", "in_progress", "done", "blocked")
+WORDS = ("compras", "informe", "llamar", "deploy", "revisar", "factura")
+
+
+def _queries(user_id):
+    """(nombre, kwargs de store.query, tamaño de página) de las consultas de la app."""
+    return [
+        ("query_list", queries.build_tasks_query(user_id), None),
+        ("query_status", queries.build_tasks_query(user_id, status="done"), None),
+        (
+            "query_status_by_ts",
+            queries.build_tasks_query(user_id, status="done", order_by=("_ts", "DESC")),
+            100,
+        ),
+        ("query_page_by_ts", queries.build_tasks_query(user_id, order_by=("_ts", "DESC")), 100),
+        ("query_title_prefix", queries.build_tasks_query(user_id, title_prefix="Inf"), None),
+        ("query_sync", queries.build_sync_query(user_id, 1), None),
+        (
+            "query_stats",
+            {"where": [tombstones.LIVE_FILTER], "order_by": None, "fields": ["status", "_ts"]},
+            None,
+        ),
+    ]
+
+
+class _Meter:
+    def __init__(self):
+        self.charges = defaultdict(list)
+        self._pending = 0.0
+
+    def hook(self, headers, *_):
+        self._pending += float(headers.get(metrics.REQUEST_CHARGE_HEADER, 0) or 0)
+
+    def record(self, operation):
+        self.charges[operation].append(self._pending)
+        self._pending = 0.0
+
+    def summary(self):
+        return {
+            op: round(sum(values) / len(values), 2) for op, values in self.charges.items() if values
+        }
+
+
+def run_workload(container, composite_indexes, tasks: int, rng) -> dict:
+    meter = _Meter()
+    user_id = "ru-" + uuid.uuid4().hex[:8]
+    ids = []
+    for n in range(tasks):
+        task = {
+            "id": str(uuid.uuid4()),
+            "title": "%s %d" % (rng.choice(WORDS).capitalize(), n),
+            "status": rng.choice(STATUSES),
+            "userId": user_id,
+        }
+        container.create_item(task, response_hook=meter.hook)
+        meter.record("create_item")
+        ids.append(task["id"])
+
+    sample = rng.sample(ids, min(len(ids), max(1, tasks // 10)))
+    for task_id in sample:
+        doc = container.read_item(task_id, partition_key=user_id, response_hook=meter.hook)
+        meter.record("read_item")
+        doc["title"] = doc["title"] + " (editada)"
+        container.upsert_item(doc, response_hook=meter.hook)
+        meter.record("upsert_item")
+        container.patch_item(
+            task_id, partition_key=user_id,
+            patch_operations=[{"op": "set", "path": "/status", "value": rng.choice(STATUSES)}],
+            response_hook=meter.hook,
+        )
+        meter.record("patch_item")
+    for task_id in sample[: len(sample) // 2]:
+        container.patch_item(
+            task_id, partition_key=user_id,
+            patch_operations=tombstones.tombstone_operations(),
+            filter_predicate=tombstones.LIVE_PREDICATE,
+            response_hook=meter.hook,
+        )
+        meter.record("delete_tombstone")
+
+    for name, spec, page_size in _queries(user_id):
+        query, params = storage.build_sql(composite_indexes=composite_indexes, **spec)
+        pages = container.query_items(
+            query=query, parameters=params, partition_key=user_id,
+            max_item_count=page_size, response_hook=meter.hook,
+        ).by_page()
+        for page in pages:
+            list(page)
+            if page_size:
+                break  # tasks_get paginado: una página por request
+        meter.record(name)
+    return meter.summary()
+
+
+def _create(database, name, indexing_policy=None):
+    kwargs = {"indexing_policy": indexing_policy} if indexing_policy else {}
+    return database.create_container(
+        id=name, partition_key=PartitionKey(path="/userId"), default_ttl=-1, **kwargs
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=500, help="tareas sembradas por contenedor")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="archivo JSON del reporte")
+    parser.add_argument("--keep", action="store_true", help="no borrar los contenedores temporales")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    client = CosmosClient(
+        db.COSMOS_URI, credential=db.COSMOS_KEY, connection_verify=db.COSMOS_VERIFY,
+        connection_timeout=30,
+    )
+    database = client.create_database_if_not_exists(id=db.DATABASE_NAME)
+    suffix = uuid.uuid4().hex[:6]
+    variants = [
+        ("default", "ru-default-" + suffix, None, ()),
+        ("indexed", "ru-indexed-" + suffix, indexing.TASKS_INDEXING_POLICY, indexing.TASKS_COMPOSITE_INDEXES),
+    ]
+
+    results = {}
+    try:
+        for label, name, policy, composite_indexes in variants:
+            logger.info("Midiendo política %s (%s, %d tareas) ...", label, name, args.tasks)
+            container = _create(database, name, policy)
+            results[label] = run_workload(container, composite_indexes, args.tasks, random.Random(args.seed))
+    except Exception:
+        logger.exception("No fue posible completar la medición")
+        return 1
+    finally:
+        if not args.keep:
+            for _, name, _, _ in variants:
+                try:
+                    database.delete_container(name)
+                except Exception:
+                    pass
+
+    before, after = results["default"], results["indexed"]
+    print("%-20s %10s %10s %9s" % ("operación", "default", "indexada", "ahorro"))
+    for operation in before:
+        saving = (before[operation] - after[operation]) / before[operation] if before[operation] else 0.0
+        print("%-20s %10.2f %10.2f %8.1f%%" % (operation, before[operation], after[operation], saving * 100))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fh:
+            json.dump({"tasks": args.tasks, "ru": results}, fh, indent=2)
+        logger.info("Reporte escrito en %s", args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,525 @@
+"""
+Suite de carga de las funciones HTTP.
+
+Llama al ``main(req)`` de cada función con ``func.HttpRequest`` sintéticos
+contra el store en memoria (STORAGE_BACKEND=memory), así que mide el costo de
+CPU de los handlers y de shared_code sin red ni RU.
+
+Uso (desde backend/azure_functions)::
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --scenarios login_burst,write_storm --scale 0.2
+    python -m benchmarks.run --output bench-new.json --compare bench-base.json
+
+Cada escenario corre en un subproceso propio (cachés, pools y stores limpios;
+el pico de RSS es el del escenario). El reporte JSON lleva, por escenario:
+cantidad de requests, status obtenidos, throughput (req/s), latencias
+p50/p95/p99/max (ms), memoria residente inicial y pico (MB), y el desglose por
+fase de ``shared_code.metrics``. Con ``--compare`` se imprimen las diferencias
+contra otro reporte y el proceso termina con código 1 si algún p95 o
+throughput empeora más que ``--threshold``.
+"""
+import argparse
+import asyncio
+import datetime
+import importlib
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+
+# Antes de importar shared_code: los módulos leen la configuración al importarse
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("JWT_SECRET", "benchmark-only-secret-" + "x" * 32)
+os.environ.setdefault("BCRYPT_ROUNDS", "10")
+# Los escenarios simulan muchos clientes desde un mismo proceso
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+import azure.functions as func  # noqa: E402
+import jwt  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+logger = logging.getLogger("benchmarks")
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "benchmark-password"
+STATUSES = ("pending", "in_progress", "done")
+
+
+# ---------------------------------------------------------------------------
+# Requests sintéticos
+# ---------------------------------------------------------------------------
+
+
+def make_token(user_id: str, email: str) -> str:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    claims = {"sub": user_id, "email": email, "exp": now + datetime.timedelta(hours=1)}
+    return jwt.encode(claims, os.environ["JWT_SECRET"], algorithm="HS256")
+
+
+def make_request(method, url, body=None, params=None, route=None, token=None, headers=None,
+                 raw_body=None):
+    headers = dict(headers or {})
+    if token:
+        headers["Authorization"] = "Bearer " + token
+    if raw_body is not None:
+        payload = raw_body
+    else:
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+    return func.HttpRequest(
+        method=method,
+        url=url,
+        headers=headers,
+        params=params or {},
+        route_params=route or {},
+        body=payload,
+    )
+
+
+def handler(name):
+    return importlib.import_module(name).main
+
+
+async def seed_user(users_store, index: int, hashed_password: str):
+    from shared_code import users
+
+    email = "bench-%d@example.com" % index
+    doc = {
+        "id": users.user_doc_id(email),
+        "userId": str(uuid.uuid4()),
+        "email": email,
+        "password": hashed_password,
+        "name": "Bench %d" % index,
+    }
+    await users_store.create_item(doc)
+    return doc
+
+
+async def seed_tasks(tasks_store, user_id: str, count: int, rng):
+    ids = []
+    for n in range(count):
+        task = {
+            "id": str(uuid.uuid4()),
+            "title": "Tarea %d %s" % (n, rng.choice(("compras", "informe", "llamar", "deploy"))),
+            "status": rng.choice(STATUSES),
+            "userId": user_id,
+        }
+        await tasks_store.create_item(task)
+        ids.append(task["id"])
+    return ids
+
+
+# ---------------------------------------------------------------------------
+# Escenarios: async (args, rng) -> lista de (handler, request)
+# ---------------------------------------------------------------------------
+
+
+async def login_burst(args, rng):
+    """Ráfaga de logins de usuarios existentes (bcrypt + point read)."""
+    from shared_code import passwords, storage
+
+    users_store, _ = await storage.get_stores()
+    hashed = await passwords.hash_password(PASSWORD)
+    accounts = [await seed_user(users_store, i, hashed) for i in range(50)]
+    login = handler("user_login")
+    calls = []
+    for _ in range(args.requests(200)):
+        account = rng.choice(accounts)
+        body = {"email": account["email"], "password": PASSWORD}
+        calls.append((login, make_request("POST", "/api/user/login", body=body)))
+    return calls
+
+
+async def refresh_burst(args, rng):
+    """POST /user/refresh con refresh tokens válidos (firma + point read, sin bcrypt)."""
+    from shared_code import sessions, storage
+
+    users_store, _ = await storage.get_stores()
+    refresh_tokens = []
+    for i in range(200):
+        account = await seed_user(users_store, i, "-")
+        for _ in range(sessions.MAX_SESSIONS):
+            account = await users_store.read_item(item=account["id"], partition_key=account["email"])
+            refresh_tokens.append(await sessions.create_session(users_store, account))
+    rng.shuffle(refresh_tokens)
+    refresh = handler("user_refresh")
+    # Cada refresh token se canjea una sola vez (rotación)
+    return [
+        (refresh, make_request("POST", "/api/user/refresh", body={"refreshToken": token}))
+        for token in refresh_tokens[: args.requests(2000)]
+    ]
+
+
+def _dashboard(task_count, default_requests, params=None, cached=False, archived=False):
+    async def scenario(args, rng):
+        from shared_code import archive, storage
+        from shared_code.cache import task_list_cache
+
+        users_store, tasks_store = await storage.get_stores()
+        account = await seed_user(users_store, 0, "-")
+        await seed_tasks(tasks_store, account["userId"], task_count, rng)
+        if archived:
+            # Todas las completadas ya vencidas: el timer las pasa al archivo
+            await archive.archive_due_tasks(
+                now=time.time() + (archive.ARCHIVE_AFTER_DAYS + 1) * 86400, max_tasks=task_count
+            )
+        token = make_token(account["userId"], account["email"])
+        tasks_get = handler("tasks_get")
+        headers = {"Accept-Encoding": "gzip"}
+
+        if cached:
+            # El cliente ya tiene el listado: revalida con If-None-Match
+            first = await tasks_get(
+                make_request("GET", "/api/tasks", params=params, token=token, headers=headers)
+            )
+            headers["If-None-Match"] = first.headers["ETag"]
+        else:
+            # Sin caché de listados: cada request consulta y serializa
+            task_list_cache.max_users = 0
+
+        return [
+            (tasks_get, make_request("GET", "/api/tasks", params=params, token=token, headers=headers))
+            for _ in range(args.requests(default_requests))
+        ]
+
+    scenario.__doc__ = "GET /tasks de un usuario con %d tareas%s%s." % (
+        task_count,
+        " (%s)" % "&".join("%s=%s" % kv for kv in sorted(params.items())) if params else "",
+        ", revalidando con If-None-Match" if cached else ", sin caché",
+    ) + (" Las completadas ya se archivaron." if archived else "")
+    return scenario
+
+
+async def stats_read_50k(args, rng):
+    """GET /tasks/stats de un usuario con 50000 tareas (resumen ya calculado)."""
+    from shared_code import storage, task_stats
+
+    users_store, tasks_store = await storage.get_stores()
+    account = await seed_user(users_store, 0, "-")
+    await seed_tasks(tasks_store, account["userId"], 50000, rng)
+    await task_stats.refresh_user(account["userId"])
+    token = make_token(account["userId"], account["email"])
+    stats = handler("tasks_stats")
+    return [
+        (stats, make_request("GET", "/api/tasks/stats", token=token))
+        for _ in range(args.requests(5000))
+    ]
+
+
+async def search_50k(args, rng):
+    """GET /tasks/search de un usuario con 50000 tareas (índice ya construido)."""
+    from shared_code import storage
+
+    users_store, tasks_store = await storage.get_stores()
+    account = await seed_user(users_store, 0, "-")
+    await seed_tasks(tasks_store, account["userId"], 50000, rng)
+    token = make_token(account["userId"], account["email"])
+    search = handler("tasks_search")
+    # La primera búsqueda construye el índice; no se mide
+    await search(make_request("GET", "/api/tasks/search", params={"q": "tarea"}, token=token))
+    return [
+        # Prefijos numéricos: pocas decenas de resultados sobre 50000 tareas
+        (search, make_request("GET", "/api/tasks/search", params={"q": "tarea %d" % rng.randrange(100, 5000)}, token=token))
+        for _ in range(args.requests(5000))
+    ]
+
+
+async def export_50k(args, rng):
+    """GET /tasks/export (primer tramo NDJSON, gzip) de un usuario con 50000 tareas."""
+    from shared_code import storage
+
+    users_store, tasks_store = await storage.get_stores()
+    account = await seed_user(users_store, 0, "-")
+    await seed_tasks(tasks_store, account["userId"], 50000, rng)
+    token = make_token(account["userId"], account["email"])
+    export = handler("tasks_export")
+    headers = {"Accept-Encoding": "gzip"}
+    return [
+        (export, make_request("GET", "/api/tasks/export", token=token, headers=headers))
+        for _ in range(args.requests(10))
+    ]
+
+
+async def import_storm(args, rng):
+    """POST /tasks/import de 5000 líneas NDJSON, de 20 usuarios concurrentes."""
+    from shared_code import storage
+
+    users_store, _ = await storage.get_stores()
+    tokens = []
+    for i in range(20):
+        account = await seed_user(users_store, i, "-")
+        tokens.append(make_token(account["userId"], account["email"]))
+
+    importer = handler("tasks_import")
+    calls = []
+    for n in range(args.requests(40)):
+        body = b"\n".join(
+            json.dumps({"title": "Importada %d-%d" % (n, i), "status": rng.choice(STATUSES)}).encode()
+            for i in range(5000)
+        )
+        calls.append((importer, make_request("POST", "/api/tasks/import", raw_body=body, token=rng.choice(tokens))))
+    return calls
+
+
+async def write_storm(args, rng):
+    """Altas, PUT, PATCH y DELETE mezclados de 100 usuarios concurrentes."""
+    from shared_code import storage
+
+    users_store, tasks_store = await storage.get_stores()
+    accounts = []
+    for i in range(100):
+        account = await seed_user(users_store, i, "-")
+        token = make_token(account["userId"], account["email"])
+        ids = await seed_tasks(tasks_store, account["userId"], 20, rng)
+        accounts.append((token, ids))
+
+    post, put, delete = handler("tasks_post"), handler("tasks_put"), handler("tasks_delete")
+    calls = []
+    for _ in range(args.requests(2000)):
+        token, ids = rng.choice(accounts)
+        roll = rng.random()
+        if roll < 0.4 or len(ids) < 2:
+            body = {"title": "Nueva %d" % rng.randrange(10 ** 6), "status": "pending"}
+            calls.append((post, make_request("POST", "/api/tasks", body=body, token=token)))
+        elif roll < 0.7:
+            route = {"id": rng.choice(ids)}
+            body = {"status": rng.choice(STATUSES)}
+            calls.append((put, make_request("PATCH", "/api/tasks/x", body=body, route=route, token=token)))
+        elif roll < 0.85:
+            route = {"id": rng.choice(ids)}
+            body = {"title": "Editada %d" % rng.randrange(10 ** 6), "status": rng.choice(STATUSES)}
+            calls.append((put, make_request("PUT", "/api/tasks/x", body=body, route=route, token=token)))
+        else:
+            # Cada id se borra una sola vez y deja de usarse
+            route = {"id": ids.pop(rng.randrange(len(ids)))}
+            calls.append((delete, make_request("DELETE", "/api/tasks/x", route=route, token=token)))
+    return calls
+
+
+async def batch_storm(args, rng):
+    """POST /tasks/batch con 100 altas cada uno, de 50 usuarios concurrentes."""
+    from shared_code import storage
+
+    users_store, _ = await storage.get_stores()
+    tokens = []
+    for i in range(50):
+        account = await seed_user(users_store, i, "-")
+        tokens.append(make_token(account["userId"], account["email"]))
+
+    batch = handler("tasks_batch")
+    calls = []
+    for _ in range(args.requests(200)):
+        operations = [
+            {"op": "create", "title": "Lote %d" % n, "status": "pending"} for n in range(100)
+        ]
+        body = {"operations": operations}
+        calls.append((batch, make_request("POST", "/api/tasks/batch", body=body, token=rng.choice(tokens))))
+    return calls
+
+
+SCENARIOS = {
+    "login_burst": login_burst,
+    "refresh_burst": refresh_burst,
+    "dashboard_read_10": _dashboard(10, 2000),
+    "dashboard_read_1k": _dashboard(1000, 500),
+    "dashboard_read_50k": _dashboard(50000, 20),
+    "dashboard_read_50k_archived": _dashboard(50000, 20, archived=True),
+    "dashboard_page_50k": _dashboard(50000, 500, params={"limit": "100", "orderBy": "-_ts"}),
+    "dashboard_revalidate_1k": _dashboard(1000, 5000, cached=True),
+    "stats_read_50k": stats_read_50k,
+    "search_50k": search_50k,
+    "export_50k": export_50k,
+    "import_storm": import_storm,
+    "write_storm": write_storm,
+    "batch_storm": batch_storm,
+}
+
+
+# ---------------------------------------------------------------------------
+# Ejecución
+# ---------------------------------------------------------------------------
+
+
+def _rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(peak / divisor, 1)
+
+
+def _percentiles(latencies):
+    from shared_code.metrics import _percentile
+
+    values = sorted(latencies)
+    return {
+        "p50": round(_percentile(values, 50), 3),
+        "p95": round(_percentile(values, 95), 3),
+        "p99": round(_percentile(values, 99), 3),
+        "max": round(values[-1], 3) if values else 0.0,
+        "mean": round(sum(values) / len(values), 3) if values else 0.0,
+    }
+
+
+async def _drive(calls, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = Counter()
+
+    async def one(main, req):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await main(req)
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[str(response.status_code)] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(main, req) for main, req in calls))
+    return latencies, statuses, time.perf_counter() - started
+
+
+async def run_scenario(name: str, args) -> dict:
+    from shared_code import metrics
+
+    rng = random.Random(args.seed)
+    rss_before = _rss_mb()
+    calls = await SCENARIOS[name](args, rng)
+    metrics.reset()
+    latencies, statuses, elapsed = await _drive(calls, args.concurrency)
+    return {
+        "description": SCENARIOS[name].__doc__,
+        "requests": len(calls),
+        "concurrency": args.concurrency,
+        "statuses": dict(sorted(statuses.items())),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(calls) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": _percentiles(latencies),
+        "rss_start_mb": rss_before,
+        "peak_rss_mb": _rss_mb(),
+        "phases": metrics.snapshot(),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _run_isolated(name: str, args) -> dict:
+    command = [
+        sys.executable, "-m", "benchmarks.run", "--worker", name,
+        "--scale", str(args.scale), "--concurrency", str(args.concurrency), "--seed", str(args.seed),
+    ]
+    completed = subprocess.run(command, cwd=BASE_DIR, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        return {"error": "scenario failed (exit code %d)" % completed.returncode}
+    return json.loads(completed.stdout)
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list:
+    """Imprime las diferencias contra ``baseline``; devuelve las regresiones."""
+    regressions = []
+    for name, result in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base or "error" in base or "error" in result:
+            continue
+        p95, base_p95 = result["latency_ms"]["p95"], base["latency_ms"]["p95"]
+        rps, base_rps = result["throughput_rps"], base["throughput_rps"]
+        p95_delta = (p95 - base_p95) / base_p95 if base_p95 else 0.0
+        rps_delta = (rps - base_rps) / base_rps if base_rps else 0.0
+        print(
+            "%-26s p95 %9.3f ms (%+6.1f%%)  throughput %9.1f req/s (%+6.1f%%)"
+            % (name, p95, p95_delta * 100, rps, rps_delta * 100)
+        )
+        if p95_delta > threshold or -rps_delta > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="lista separada por comas")
+    parser.add_argument("--output", default="bench.json", help="archivo JSON del reporte")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplica la cantidad de requests")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--compare", help="reporte previo contra el cual comparar")
+    parser.add_argument("--threshold", type=float, default=0.10, help="regresión tolerada (0.10 = 10%%)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.requests = lambda default: max(1, int(default * args.scale))
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.worker:
+        logging.basicConfig(level=logging.ERROR)
+        sys.path.insert(0, BASE_DIR)
+        json.dump(asyncio.run(run_scenario(args.worker, args)), sys.stdout)
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        logger.error("Escenarios desconocidos: %s", ", ".join(unknown))
+        return 2
+
+    report = {
+        "commit": _git_commit(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "storage_backend": os.environ["STORAGE_BACKEND"],
+            "bcrypt_rounds": int(os.environ["BCRYPT_ROUNDS"]),
+            "tasks_partition_key": os.getenv("TASKS_PARTITION_KEY", "userId"),
+            "concurrency": args.concurrency,
+            "scale": args.scale,
+            "seed": args.seed,
+        },
+        "scenarios": {},
+    }
+    for name in names:
+        logger.info("Corriendo %s ...", name)
+        result = report["scenarios"][name] = _run_isolated(name, args)
+        if "error" not in result:
+            logger.info(
+                "  %d requests, %.1f req/s, p50 %.3f ms, p95 %.3f ms, pico RSS %s MB, status %s",
+                result["requests"], result["throughput_rps"], result["latency_ms"]["p50"],
+                result["latency_ms"]["p95"], result["peak_rss_mb"], result["statuses"],
+            )
+
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2, sort_keys=True)
+    logger.info("Reporte escrito en %s", args.output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            regressions = compare(report, json.load(fh), args.threshold)
+        if regressions:
+            logger.error("Regresiones: %s", ", ".join(regressions))
+            return 1
+    failed = [name for name, result in report["scenarios"].items() if "error" in result]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
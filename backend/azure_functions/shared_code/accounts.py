@@ -0,0 +1,261 @@
+"""
+Baja de cuentas: borra el usuario y purga su partición /userId de tareas.
+
+Orden (cada paso es idempotente, así un corte a mitad se retoma repitiendo
+``DELETE /user/profile``, con el timer ``accounts_resume`` o con la
+herramienta de abajo):
+
+1. Marca el documento de usuario con ``deletionRequestedAt`` y cierra sus
+   sesiones: desde ahí el login y el refresh se rechazan.
+2. Purga la partición de tareas: primero con el borrado por partition key de
+   Cosmos (si la cuenta lo tiene habilitado) y después barriendo lo que quede
+   con transactional batches de deletes, con concurrencia acotada. Lo mismo
+   con la partición del archivo (ver shared_code.archive).
+3. Purga la partición del usuario en ``taskStats``: el resumen, sus estados
+   por tarea (ver shared_code.task_stats) y el mapa de buckets (ver
+   shared_code.sharding).
+4. Borra el documento de usuario. Va último: mientras exista, la baja se
+   puede retomar y nunca quedan tareas huérfanas sin dueño.
+
+Los access tokens siguen firmados hasta que vencen, así que los handlers que
+escriben tareas consultan :func:`is_active` (cacheado ACCOUNT_ACTIVE_TTL_SECONDS
+por instancia). Los pasos 3 y 4 esperan a que venza ese cache y vuelven a
+barrer las tareas: lo que otra instancia haya alcanzado a escribir con el
+cache viejo no queda huérfano. El ``DELETE`` HTTP no espera: si el cache
+todavía no venció responde 202 con la cuenta marcada, y la baja la termina
+el timer ``accounts_resume`` (ACCOUNT_RESUME_SCHEDULE) o la herramienta.
+
+Retomar bajas interrumpidas (recorre los usuarios marcados)::
+
+    cd backend/azure_functions
+    python -m shared_code.accounts --resume
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+from azure.cosmos import exceptions
+
+from shared_code import db, sessions, storage, users
+from shared_code.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+DELETION_FIELD = "deletionRequestedAt"
+PURGE_PAGE_SIZE = int(os.getenv("ACCOUNT_PURGE_PAGE_SIZE", "1000"))
+# Batches de delete en vuelo a la vez por cuenta
+PURGE_CONCURRENCY = int(os.getenv("ACCOUNT_PURGE_CONCURRENCY", "8"))
+# Operaciones por transactional batch (límite de Cosmos DB)
+PURGE_BATCH_SIZE = 100
+# Códigos con los que Cosmos (o un store) dice que el borrado por partition key
+# no existe: desde ahí se usan sólo batches en todo el proceso
+_PARTITION_DELETE_UNSUPPORTED = {405, 501}
+# Rechazos que pueden ser de ese request (clave, permisos, partición): se
+# barre con batches esta vez, sin apagar el camino rápido para las demás
+_PARTITION_DELETE_FALLBACK = {400, 403, 404}
+
+# Cuánto confía cada instancia en que una cuenta sigue vigente sin releerla
+ACTIVE_TTL_SECONDS = float(os.getenv("ACCOUNT_ACTIVE_TTL_SECONDS", "5"))
+_active_accounts = TTLCache(int(os.getenv("ACCOUNT_ACTIVE_MAX_USERS", "10000")))
+
+_partition_delete_supported = os.getenv("ACCOUNT_PURGE_PARTITION_DELETE", "true").lower() == "true"
+
+
+def is_pending_deletion(user_doc: dict) -> bool:
+    return bool(user_doc and user_doc.get(DELETION_FIELD))
+
+
+async def is_active(users_store, user: dict) -> bool:
+    """
+    True si la cuenta del token existe, es la misma (el email pudo volver a
+    registrarse) y no tiene la baja pendiente.
+    """
+    user_id = user["sub"]
+    if _active_accounts.get(user_id):
+        return True
+    try:
+        doc = await users.read_account(users_store, user["email"], user_id)
+    except exceptions.CosmosResourceNotFoundError:
+        return False
+    active = users.account_id(doc) == user_id and not is_pending_deletion(doc)
+    if active:
+        _active_accounts.put(user_id, True, time.time() + ACTIVE_TTL_SECONDS)
+    return active
+
+
+async def mark_for_deletion(users_store, user_doc: dict) -> dict:
+    """Paso 1: marca la cuenta y revoca todas sus sesiones."""
+    _active_accounts.pop(users.account_id(user_doc))
+    if is_pending_deletion(user_doc):
+        return user_doc
+    return await users_store.patch_item(
+        item=user_doc["id"],
+        partition_key=user_doc["email"],
+        patch_operations=[
+            {"op": "set", "path": "/" + DELETION_FIELD, "value": int(time.time())},
+            {"op": "set", "path": "/" + sessions.SESSIONS_FIELD, "value": []},
+        ],
+    )
+
+
+def _feature_disabled(err) -> bool:
+    """La cuenta no tiene habilitado el borrado por partition key."""
+    if err.status_code in _PARTITION_DELETE_UNSUPPORTED:
+        return True
+    message = (err.message or "").lower()
+    return "partition" in message and ("not enabled" in message or "disabled" in message)
+
+
+async def _delete_partition(tasks_store, user_id: str) -> bool:
+    """Borrado por partition key del lado de Cosmos. False si no está disponible."""
+    global _partition_delete_supported
+    delete_partition = getattr(tasks_store, "delete_all_items_by_partition_key", None)
+    if not _partition_delete_supported or delete_partition is None:
+        return False
+    try:
+        await delete_partition(user_id)
+        return True
+    except exceptions.CosmosHttpResponseError as err:
+        if _feature_disabled(err):
+            _partition_delete_supported = False
+            logger.info(
+                "Borrado por partition key no disponible (%s); se purga con batches", err.status_code
+            )
+            return False
+        if err.status_code in _PARTITION_DELETE_FALLBACK:
+            logger.warning(
+                "Borrado por partition key rechazado para %s (%s); se purga con batches",
+                user_id, err.status_code,
+            )
+            return False
+        raise
+
+
+async def _delete_chunk(tasks_store, user_id: str, ids) -> int:
+    try:
+        await tasks_store.execute_item_batch(
+            batch_operations=[("delete", (task_id,)) for task_id in ids],
+            partition_key=user_id,
+        )
+        return len(ids)
+    except exceptions.CosmosBatchOperationError:
+        # Algún id ya no existe (TTL de una lápida, borrado en paralelo): uno por uno
+        deleted = 0
+        for task_id in ids:
+            try:
+                await tasks_store.delete_item(item=task_id, partition_key=user_id)
+                deleted += 1
+            except exceptions.CosmosResourceNotFoundError:
+                pass
+        return deleted
+
+
+async def purge_tasks(tasks_store, user_id: str) -> int:
+    """
+    Pasos 2 y 3: deja vacía la partición ``user_id`` de ``tasks_store``
+    (tareas, archivo o resúmenes). Devuelve cuántos documentos borró el barrido.
+    """
+    if await _delete_partition(tasks_store, user_id):
+        # Cosmos termina de liberar la partición en segundo plano, pero lo borrado
+        # ya no aparece en consultas: el barrido de abajo sólo ve lo que quedó
+        logger.info("Borrado por partition key iniciado para %s", user_id)
+
+    semaphore = asyncio.Semaphore(PURGE_CONCURRENCY)
+
+    async def bounded(ids):
+        async with semaphore:
+            return await _delete_chunk(tasks_store, user_id, ids)
+
+    deleted = 0
+    while True:
+        # Siempre la primera página: lo ya borrado deja de aparecer
+        page = await tasks_store.query(user_id, fields=["id"], limit=PURGE_PAGE_SIZE)
+        ids = [item["id"] for item in page.items]
+        if not ids:
+            return deleted
+        chunks = [ids[i:i + PURGE_BATCH_SIZE] for i in range(0, len(ids), PURGE_BATCH_SIZE)]
+        deleted += sum(await asyncio.gather(*(bounded(chunk) for chunk in chunks)))
+
+
+async def delete_account(users_store, tasks_store, stats_store, archive_store, user_doc: dict,
+                         wait: bool = True) -> dict:
+    """
+    Pasos 1 a 4. Devuelve {"purged": tareas (activas y archivadas) borradas
+    por el barrido, "completed": si se llegó al paso 4}. Con ``wait=False``
+    no espera a que venza el cache de :func:`is_active`: si falta, la cuenta
+    queda marcada y con las tareas purgadas, y la baja se completa al retomarla.
+    """
+    user_doc = await mark_for_deletion(users_store, user_doc)
+    user_id = users.account_id(user_doc)
+
+    purged = await purge_tasks(tasks_store, user_id)
+    purged += await purge_tasks(archive_store, user_id)
+    # +1: deletionRequestedAt está en segundos enteros
+    pending = user_doc[DELETION_FIELD] + 1 + ACTIVE_TTL_SECONDS - time.time()
+    if pending > 0:
+        if not wait:
+            logger.info("Baja de %s marcada; se completa cuando venza el cache de cuentas", user_id)
+            return {"purged": purged, "completed": False}
+        # Otras instancias pueden creer vigente la cuenta hasta que venza su cache
+        await asyncio.sleep(pending)
+        purged += await purge_tasks(tasks_store, user_id)
+    # Resumen, estados por tarea y mapa de buckets comparten la partición del usuario
+    await purge_tasks(stats_store, user_id)
+    await storage.shard_map.delete(user_id)
+    try:
+        await users_store.delete_item(item=user_doc["id"], partition_key=user_doc["email"])
+    except exceptions.CosmosResourceNotFoundError:
+        pass
+    logger.info("Cuenta %s eliminada (%s tareas purgadas)", user_id, purged)
+    return {"purged": purged, "completed": True}
+
+
+async def find_pending(users_store) -> list:
+    """Usuarios con la baja pendiente (consulta entre particiones, sólo mantenimiento)."""
+    found, continuation = [], None
+    while True:
+        page = await users_store.query(
+            None, where=[(DELETION_FIELD, ">=", 0)], limit=PURGE_PAGE_SIZE, continuation=continuation,
+        )
+        found.extend(page.items)
+        continuation = page.continuation_token
+        if not continuation:
+            return found
+
+
+async def resume_pending() -> dict:
+    """Completa las bajas pendientes. Devuelve {"resumed", "failed", "users"}."""
+    result = {"resumed": 0, "failed": 0, "users": []}
+    users_store, tasks_store = await storage.get_stores()
+    stats_store = await storage.get_stats_store()
+    archive_store = await storage.get_archive_store()
+    # Primero se juntan los usuarios: borrar durante el paginado movería los offsets
+    pending = await find_pending(users_store)
+    logger.info("%s cuentas con la baja pendiente", len(pending))
+    for doc in pending:
+        try:
+            await delete_account(users_store, tasks_store, stats_store, archive_store, doc)
+            result["resumed"] += 1
+            result["users"].append(users.account_id(doc))
+        except Exception:
+            result["failed"] += 1
+            logger.exception("No se pudo completar la baja de %s", doc.get("email"))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Retoma bajas de cuentas interrumpidas")
+    parser.add_argument("--resume", action="store_true", required=True)
+    parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    result = db.run(resume_pending())
+    logger.info("Bajas retomadas: %s", {k: v for k, v in result.items() if k != "users"})
+    return 1 if result["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Archivado de tareas completadas.
+
+Las tareas en ``done`` sin cambios hace más de TASKS_ARCHIVE_AFTER_DAYS se
+mudan al contenedor ARCHIVE_CONTAINER, así las particiones de tareas quedan
+con lo activo y ``GET /tasks`` no vuelve a leerlas. ``GET /tasks?archived=true``
+consulta el archivo.
+
+El timer ``tasks_archive`` corre :func:`archive_due_tasks`, que por cada
+usuario y en batches de hasta 100:
+
+1. Hace upsert de la copia en el archivo (sin propiedades de sistema, con
+   ``archivedAt`` y ``completedAt`` = último ``_ts``).
+2. Convierte la tarea en lápida (``deletedAt`` + ``ttl``, ver
+   shared_code.tombstones) con un predicado sobre su ``_etag``: si alguien la
+   editó entre la lectura y el patch, no se archiva y se descarta la copia.
+
+La lápida hace que la sincronización incremental y el change feed (resúmenes
+de ``tasks_stats``, que cuentan sólo tareas activas) vean la tarea salir.
+Un corte entre los pasos deja la tarea en los dos contenedores; la siguiente
+corrida la vuelve a copiar (upsert) y completa el paso 2.
+
+Corrida manual (Cosmos o STORAGE_BACKEND local)::
+
+    cd backend/azure_functions
+    python -m shared_code.archive
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+
+from azure.cosmos import exceptions
+
+from shared_code import db, storage, tombstones
+from shared_code.serializers import strip_system_properties
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("TASKS_ARCHIVE_AFTER_DAYS", "30"))
+# Tope de tareas por corrida del timer (la siguiente corrida sigue)
+ARCHIVE_MAX_PER_RUN = int(os.getenv("TASKS_ARCHIVE_MAX_PER_RUN", "5000"))
+ARCHIVE_PAGE_SIZE = int(os.getenv("TASKS_ARCHIVE_PAGE_SIZE", "500"))
+# Batches en vuelo a la vez
+ARCHIVE_CONCURRENCY = int(os.getenv("TASKS_ARCHIVE_CONCURRENCY", "4"))
+# Operaciones por transactional batch (límite de Cosmos DB)
+ARCHIVE_BATCH_SIZE = 100
+
+ARCHIVED_FIELD = "archivedAt"
+ARCHIVED_STATUS = "done"
+
+
+def cutoff(now: float = None) -> int:
+    """``_ts`` a partir del cual una tarea completada todavía no se archiva."""
+    return int((now or time.time()) - ARCHIVE_AFTER_DAYS * 24 * 3600)
+
+
+def build_due_query(before: int) -> dict:
+    """Tareas vivas completadas sin cambios desde ``before`` (todas las particiones)."""
+    return {
+        "where": [
+            ("status", "=", ARCHIVED_STATUS),
+            tombstones.LIVE_FILTER,
+            ("_ts", "<", before),
+        ],
+        "order_by": None,
+        "fields": None,
+    }
+
+
+def archived_copy(task: dict, now: int) -> dict:
+    doc = strip_system_properties(task)
+    doc.pop("ttl", None)
+    doc["completedAt"] = task.get("_ts")
+    doc[ARCHIVED_FIELD] = now
+    return doc
+
+
+def _unchanged_predicate(task: dict) -> str:
+    return "%s AND c._etag = '%s'" % (tombstones.LIVE_PREDICATE, task["_etag"])
+
+
+def _tombstone_operations(now: int) -> list:
+    return tombstones.tombstone_operations(now) + [
+        {"op": "set", "path": "/" + ARCHIVED_FIELD, "value": now}
+    ]
+
+
+async def _archive_one(tasks_store, archive_store, task: dict, now: int) -> bool:
+    user_id = task["userId"]
+    try:
+        await tasks_store.patch_item(
+            item=task["id"],
+            partition_key=user_id,
+            patch_operations=_tombstone_operations(now),
+            filter_predicate=_unchanged_predicate(task),
+        )
+        return True
+    except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceNotFoundError):
+        # Editada o borrada después de leerla: sigue activa, la copia sobra
+        try:
+            await archive_store.delete_item(item=task["id"], partition_key=user_id)
+        except exceptions.CosmosResourceNotFoundError:
+            pass
+        return False
+
+
+async def archive_chunk(tasks_store, archive_store, user_id: str, chunk, now: int) -> int:
+    """Archiva un batch de tareas de ``user_id``. Devuelve cuántas salieron de tasks."""
+    await archive_store.execute_item_batch(
+        batch_operations=[("upsert", (archived_copy(task, now),)) for task in chunk],
+        partition_key=user_id,
+    )
+    try:
+        await tasks_store.execute_item_batch(
+            batch_operations=[
+                ("patch", (task["id"], _tombstone_operations(now)),
+                 {"filter_predicate": _unchanged_predicate(task)})
+                for task in chunk
+            ],
+            partition_key=user_id,
+        )
+        return len(chunk)
+    except exceptions.CosmosBatchOperationError:
+        # Alguna cambió en el medio: una por una para archivar el resto
+        results = [await _archive_one(tasks_store, archive_store, task, now) for task in chunk]
+        return sum(results)
+
+
+async def archive_due_tasks(now: float = None, max_tasks: int = None) -> dict:
+    """Una corrida del archivado. Devuelve {"archived", "skipped", "users"}."""
+    now = int(now or time.time())
+    max_tasks = ARCHIVE_MAX_PER_RUN if max_tasks is None else max_tasks
+    _, tasks_store = await storage.get_stores()
+    archive_store = await storage.get_archive_store()
+    spec = build_due_query(cutoff(now))
+    semaphore = asyncio.Semaphore(ARCHIVE_CONCURRENCY)
+
+    async def bounded(user_id, chunk):
+        async with semaphore:
+            return await archive_chunk(tasks_store, archive_store, user_id, chunk, now)
+
+    # Primero se juntan los candidatos y después se escribe: una consulta entre
+    # particiones puede traer páginas vacías, y escribir en medio del paginado
+    # movería los offsets de los backends locales
+    due, continuation = [], None
+    while len(due) < max_tasks:
+        page = await tasks_store.query(
+            None, limit=min(ARCHIVE_PAGE_SIZE, max_tasks - len(due)),
+            continuation=continuation, **spec
+        )
+        due.extend(page.items)
+        continuation = page.continuation_token
+        if not continuation:
+            break
+
+    by_user = defaultdict(list)
+    for task in due:
+        by_user[task["userId"]].append(task)
+    jobs = [
+        (user_id, tasks[i:i + ARCHIVE_BATCH_SIZE])
+        for user_id, tasks in by_user.items()
+        for i in range(0, len(tasks), ARCHIVE_BATCH_SIZE)
+    ]
+    archived = sum(await asyncio.gather(*(bounded(user_id, chunk) for user_id, chunk in jobs)))
+    result = {"archived": archived, "skipped": len(due) - archived, "users": sorted(by_user)}
+    logger.info(
+        "Archivado: %d tareas de %d usuarios (%d omitidas por cambios)",
+        result["archived"], len(result["users"]), result["skipped"],
+    )
+    return result
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    try:
+        result = db.run(archive_due_tasks())
+    except Exception:
+        logger.exception("No fue posible completar el archivado")
+        return 1
+    logger.info("Resultado: %s", {k: v for k, v in result.items() if k != "users"})
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,186 @@
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_USERS = int(os.getenv("TASKS_CACHE_MAX_USERS", "1000"))
+CACHE_MAX_VARIANTS = int(os.getenv("TASKS_CACHE_MAX_VARIANTS", "8"))
+# La caché es por instancia: el TTL acota cuánto puede quedar obsoleta una
+# instancia cuando la escritura la atendió otra.
+CACHE_TTL_SECONDS = float(os.getenv("TASKS_CACHE_TTL_SECONDS", "30"))
+
+
+def compute_etag(body) -> str:
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return '"%s"' % hashlib.sha1(body).hexdigest()
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    """Evalúa un header If-None-Match (lista, comodín y etags débiles)."""
+    if not if_none_match or not etag:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class TaskListCache:
+    """
+    Caché LRU en memoria de listados de tareas serializados, por usuario.
+
+    Cada usuario guarda hasta ``max_variants`` respuestas (una por combinación
+    de parámetros de consulta). Las escrituras invalidan al usuario completo.
+
+    Cada invalidación sube la generación del usuario. Un listado que empezó a
+    leer antes de una escritura puede terminar después de su ``invalidate``:
+    el handler lee la generación antes de consultar y ``put`` descarta el
+    listado si cambió, así no queda cacheado algo previo a la escritura.
+    """
+
+    def __init__(self, max_users=CACHE_MAX_USERS, max_variants=CACHE_MAX_VARIANTS, ttl=CACHE_TTL_SECONDS):
+        self.max_users = max_users
+        self.max_variants = max_variants
+        self.ttl = ttl
+        self._users = OrderedDict()  # user_id -> OrderedDict(variant -> (etag, body, meta, expires))
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+        # user_id -> generación de su última invalidación (LRU acotado); los
+        # usuarios desalojados o nunca invalidados valen _base_generation
+        self._generations = OrderedDict()
+        self._counter = itertools.count(1)
+        self._base_generation = 0
+
+    def generation(self, user_id) -> int:
+        """Generación vigente de ``user_id``; pasarla a ``put`` al terminar de leer."""
+        with self._lock:
+            return self._generations.get(user_id, self._base_generation)
+
+    def get(self, user_id, variant):
+        """Devuelve (etag, body, meta) o None si no hay entrada vigente."""
+        now = time.monotonic()
+        with self._lock:
+            variants = self._users.get(user_id)
+            entry = variants.get(variant) if variants is not None else None
+            if entry is None or entry[3] <= now:
+                if entry is not None:
+                    del variants[variant]
+                self.misses += 1
+                return None
+            self._users.move_to_end(user_id)
+            variants.move_to_end(variant)
+            self.hits += 1
+            return entry[0], entry[1], entry[2]
+
+    def put(self, user_id, variant, body, meta=None, generation=None) -> str:
+        """
+        Guarda el cuerpo ya serializado (y metadatos, p. ej. headers). Devuelve
+        el ETag. Con ``generation`` no guarda nada si hubo una invalidación después.
+        """
+        etag = compute_etag(body)
+        if self.max_users <= 0:
+            return etag
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            if generation is not None and generation != self._generations.get(
+                user_id, self._base_generation
+            ):
+                logger.debug("Caché de tareas: listado de %s obsoleto, no se guarda", user_id)
+                return etag
+            variants = self._users.get(user_id)
+            if variants is None:
+                variants = self._users[user_id] = OrderedDict()
+            variants[variant] = (etag, body, meta, expires)
+            variants.move_to_end(variant)
+            self._users.move_to_end(user_id)
+            while len(variants) > self.max_variants:
+                variants.popitem(last=False)
+            while len(self._users) > self.max_users:
+                evicted, _ = self._users.popitem(last=False)
+                logger.debug("Caché de tareas: usuario %s desalojado (LRU)", evicted)
+        return etag
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+            self._generations[user_id] = next(self._counter)
+            self._generations.move_to_end(user_id)
+            while len(self._generations) > max(self.max_users, 1):
+                # Un desalojado vuelve a la base, que sube: las lecturas en vuelo
+                # de ese usuario tampoco se guardan
+                _, evicted = self._generations.popitem(last=False)
+                self._base_generation = max(self._base_generation, evicted)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._generations.clear()
+            self._base_generation = next(self._counter)
+            self.hits = self.misses = 0
+
+
+task_list_cache = TaskListCache()
+
+
+class TTLCache:
+    """
+    Caché LRU acotada donde cada entrada tiene su propio vencimiento
+    (epoch en segundos, ``time.time()``). Lleva contadores de hits/misses.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, expires_at: float):
+        if self.max_entries <= 0 or expires_at <= time.time():
+            return
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def request_variant(req) -> str:
+    """Clave estable para los parámetros de consulta de un listado."""
+    return "&".join("%s=%s" % (k, v) for k, v in sorted(req.params.items()))
@@ -1,8 +1,14 @@
+import asyncio
+import atexit
 import logging
 import os
+import threading
 import time
 
-from azure.cosmos import CosmosClient, PartitionKey, exceptions
+from azure.cosmos import CosmosClient
+from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+
+from shared_code import metrics, resilience
 
 COSMOS_URI = os.getenv("COSMOS_URI", "https://127.0.0.1:8081")
 COSMOS_KEY = os.getenv("COSMOS_KEY")
@@ -11,80 +17,356 @@ COSMOS_VERIFY = os.getenv("COSMOS_VERIFY", "true").lower() == "true"
 DATABASE_NAME = os.getenv("COSMOS_DB_NAME", "todoapp")
 USER_CONTAINER = os.getenv("COSMOS_USERS_CONTAINER", "users")
 TASK_CONTAINER = os.getenv("COSMOS_TASKS_CONTAINER", "tasks")
+# Resúmenes por usuario mantenidos desde el change feed de tareas
+STATS_CONTAINER = os.getenv("COSMOS_STATS_CONTAINER", "taskStats")
+LEASES_CONTAINER = os.getenv("COSMOS_LEASES_CONTAINER", "leases")
+# Tareas completadas que el timer tasks_archive saca del contenedor de tareas
+ARCHIVE_CONTAINER = os.getenv("COSMOS_ARCHIVE_CONTAINER", "tasksArchive")
+
+# "async" usa azure.cosmos.aio; "sync" ejecuta el cliente síncrono en el thread pool.
+# Ambos modos exponen la misma interfaz awaitable a los handlers.
+COSMOS_CLIENT_MODE = os.getenv("COSMOS_CLIENT_MODE", "async").strip().lower()
+
+# Reintentos internos del SDK acotados: los reintentos con jitter y el manejo
+# de 429 los hace resilience.GuardedContainer, y un corte no debe retener el
+# hilo del request durante minutos.
+SDK_RETRY_TOTAL = int(os.getenv("COSMOS_SDK_RETRY_TOTAL", "2"))
+SDK_RETRY_BACKOFF_MAX = int(os.getenv("COSMOS_SDK_RETRY_BACKOFF_MAX", "2"))
 
 _client = _db = _users = _tasks = None
+_aclient = _adb = _ausers = _atasks = None
+_lock = threading.Lock()
+# Lock del cliente async y loop en el que se creó: se crean dentro del loop
+# que los usa (un asyncio.Lock de import queda atado al primer loop en < 3.10)
+_async_lock = _async_loop = None
 logger = logging.getLogger(__name__)
 
+# Métrica de arranque en frío: milisegundos que tardó la inicialización del cliente
+cold_start_ms = {"sync": None, "async": None}
+
+
+def _record_cold_start(mode: str, started: float):
+    elapsed = (time.perf_counter() - started) * 1000
+    cold_start_ms[mode] = elapsed
+    logger.info("cosmos_cold_start_ms=%.2f mode=%s", elapsed, mode)
+
+
+def _retry_kwargs() -> dict:
+    return {
+        "retry_total": SDK_RETRY_TOTAL,
+        "retry_backoff_max": SDK_RETRY_BACKOFF_MAX,
+        "retry_throttle_total": 1,
+        "retry_throttle_backoff_max": SDK_RETRY_BACKOFF_MAX,
+    }
+
+
+def _probe():
+    """Sonda del breaker: un cliente síncrono propio lee la cuenta de la base."""
+    # Se cierra al salir: un breaker abierto sondea seguido y no debe dejar sesiones
+    with CosmosClient(
+        COSMOS_URI,
+        credential=COSMOS_KEY,
+        connection_verify=COSMOS_VERIFY,
+        connection_timeout=5,
+        retry_total=0,
+    ) as client:
+        client.get_database_client(DATABASE_NAME).read()
+
+
+# Compartido por todos los requests del worker (ver shared_code.resilience)
+breaker = resilience.CircuitBreaker("cosmos", probe=_probe)
+
 
 def _connect_once():
     """
-    Hace la conexión y crea DB/contenedores si no existen.
-    Se llama sólo cuando aún no hay conexión (lazy init).
+    Crea el cliente y obtiene los proxies de DB/contenedores.
+    No hace llamadas de control-plane: la DB y los contenedores se crean con
+    ``python -m shared_code.provision`` (o la plantilla Bicep), no en el request.
     """
     client = CosmosClient(
         COSMOS_URI,
         credential=COSMOS_KEY,
         connection_verify=COSMOS_VERIFY,
         connection_timeout=30,  # Timeout de conexión de 30 segundos
+        **_retry_kwargs(),
     )
-    db = client.create_database_if_not_exists(id=DATABASE_NAME)
-
-    # Unique Key Policy para asegurar unicidad de /email
-    unique_key_policy = {"uniqueKeys": [{"paths": ["/email"]}]}
+    db = client.get_database_client(DATABASE_NAME)
+    users = db.get_container_client(USER_CONTAINER)
+    tasks = db.get_container_client(TASK_CONTAINER)
+    return client, db, users, tasks
 
-    users = db.create_container_if_not_exists(
-        id=USER_CONTAINER,
-        partition_key=PartitionKey(path="/email"),
-        unique_key_policy=unique_key_policy,
-    )
 
-    tasks = db.create_container_if_not_exists(
-        id=TASK_CONTAINER, partition_key=PartitionKey(path="/userId")
+async def _connect_once_async():
+    """
+    Equivalente a _connect_once con el cliente de azure.cosmos.aio.
+    El cliente se abre (``__aenter__``): lee la cuenta, descubre regiones y
+    crea la sesión; sin eso no se guardan los session tokens y se pierde
+    read-your-writes con consistencia Session.
+    """
+    client = AsyncCosmosClient(
+        COSMOS_URI,
+        credential=COSMOS_KEY,
+        connection_verify=COSMOS_VERIFY,
+        connection_timeout=30,
+        **_retry_kwargs(),
     )
+    try:
+        await client.__aenter__()
+    except BaseException:
+        await _close_quietly(client)
+        raise
+    db = client.get_database_client(DATABASE_NAME)
+    users = db.get_container_client(USER_CONTAINER)
+    tasks = db.get_container_client(TASK_CONTAINER)
     return client, db, users, tasks
 
 
-def get_containers(max_retries: int = 10, base_delay: float = 1.5):
+def get_containers():
     """
     Devuelve (db, users_container, tasks_container).
-    Reintenta con backoff si Cosmos todavía está calentando (503).
+    Sin reintentos bloqueantes: si el breaker está abierto falla al instante
+    (CircuitOpenError) y la reconexión la prueba la sonda de fondo.
+    La inicialización usa double-checked locking: un solo cliente por worker.
     """
     global _client, _db, _users, _tasks
     if _client is not None:
         return _db, _users, _tasks
 
-    last_err = None
-    logger.info(
-        "Intentando conectar a Cosmos DB (retries=%s, delay=%ss)",
-        max_retries,
-        base_delay,
-    )
-    for i in range(max_retries):
-        try:
-            _client, _db, _users, _tasks = _connect_once()
-            logger.info("Conectado a Cosmos DB correctamente")
+    breaker.check()
+    with _lock:
+        if _client is not None:
             return _db, _users, _tasks
-        except exceptions.CosmosHttpResponseError as e:
-            wait_time = base_delay * (2**i)
-            logger.warning(
-                "Fallo al conectar a Cosmos DB (intento %s/%s). Reintentando en %.2f s. Detalle: %s",
-                i + 1,
-                max_retries,
-                wait_time,
-                e,
-                exc_info=True,
-            )
-            last_err = e
-            time.sleep(wait_time)
-        except Exception as e:
-            wait_time = base_delay * (2**i)
-            logger.exception(
-                "Error inesperado al conectar a Cosmos DB (intento %s/%s)",
-                i + 1,
-                max_retries,
-            )
-            last_err = e
-            time.sleep(wait_time)
-
-    logger.error("No fue posible conectar a Cosmos DB tras todos los reintentos")
-    raise last_err
+
+        started = time.perf_counter()
+        try:
+            client, db, users, tasks = _connect_once()
+        except Exception:
+            breaker.record_failure()
+            logger.exception("No fue posible crear el cliente de Cosmos DB")
+            raise
+        # Se publica _client al final: otro hilo nunca ve un estado a medias
+        _db, _users, _tasks = db, users, tasks
+        _client = client
+        logger.info("Conectado a Cosmos DB correctamente")
+        _record_cold_start("sync", started)
+        return _db, _users, _tasks
+
+
+async def _close_quietly(client):
+    try:
+        await client.close()
+    except Exception:
+        logger.debug("Error al cerrar el cliente async de Cosmos DB", exc_info=True)
+
+
+def _get_async_lock():
+    global _async_lock
+    if _async_lock is None:
+        _async_lock = asyncio.Lock()
+    return _async_lock
+
+
+async def _get_async_client_containers():
+    global _aclient, _adb, _ausers, _atasks, _async_loop
+    if _aclient is not None:
+        return _adb, _ausers, _atasks
+
+    breaker.check()
+    async with _get_async_lock():
+        if _aclient is not None:
+            return _adb, _ausers, _atasks
+
+        started = time.perf_counter()
+        try:
+            client, db, users, tasks = await _connect_once_async()
+        except Exception:
+            breaker.record_failure()
+            logger.exception("No fue posible crear el cliente async de Cosmos DB")
+            raise
+        _adb, _ausers, _atasks = db, users, tasks
+        _aclient, _async_loop = client, asyncio.get_running_loop()
+        logger.info("Conectado a Cosmos DB correctamente (async)")
+        _record_cold_start("async", started)
+        return _adb, _ausers, _atasks
+
+
+async def close_async():
+    """
+    Cierra el cliente async y descarta los contenedores cacheados; la próxima
+    llamada a get_containers_async() vuelve a conectar.
+    """
+    global _aclient, _adb, _ausers, _atasks, _async_lock, _async_loop, _wrapped_containers
+    client = _aclient
+    _aclient = _adb = _ausers = _atasks = None
+    _async_lock = _async_loop = None
+    if COSMOS_CLIENT_MODE != "sync":
+        _wrapped_containers = None
+        _extra_containers.clear()
+    if client is not None:
+        await _close_quietly(client)
+
+
+def run(coro):
+    """``asyncio.run`` para los CLIs: cierra el cliente async en el mismo loop al terminar."""
+    async def _main():
+        try:
+            return await coro
+        finally:
+            await close_async()
+
+    return asyncio.run(_main())
+
+
+def _close_at_exit():
+    # Al apagar el worker: el loop del cliente ya no corre pero sigue abierto
+    loop = _async_loop
+    if _aclient is None or loop is None or loop.is_closed() or loop.is_running():
+        return
+    try:
+        loop.run_until_complete(close_async())
+    except Exception:
+        logger.debug("No se pudo cerrar el cliente async al salir", exc_info=True)
+
+
+atexit.register(_close_at_exit)
+
+
+def _wrap(container):
+    return metrics.InstrumentedContainer(resilience.GuardedContainer(container, breaker))
+
+
+_wrapped_containers = None
+
+
+async def get_containers_async():
+    """
+    Versión awaitable de get_containers() usada por los handlers async.
+
+    Según COSMOS_CLIENT_MODE devuelve contenedores de azure.cosmos.aio o los
+    síncronos envueltos en SyncContainerAdapter, con la misma interfaz.
+    En ambos casos van envueltos en metrics.InstrumentedContainer y
+    resilience.GuardedContainer (breaker + reintentos con jitter).
+    """
+    global _wrapped_containers
+    if _wrapped_containers is not None:
+        return _wrapped_containers
+
+    with metrics.phase("connect"):
+        if COSMOS_CLIENT_MODE == "sync":
+            db, users, tasks = await asyncio.to_thread(get_containers)
+            users, tasks = SyncContainerAdapter(users), SyncContainerAdapter(tasks)
+        else:
+            db, users, tasks = await _get_async_client_containers()
+        _wrapped_containers = (db, _wrap(users), _wrap(tasks))
+    return _wrapped_containers
+
+
+_extra_containers = {}
+
+
+async def get_container_async(container_name: str):
+    """
+    Contenedor adicional de la misma base (p. ej. STATS_CONTAINER), con la
+    misma envoltura que los de get_containers_async().
+    """
+    container = _extra_containers.get(container_name)
+    if container is not None:
+        return container
+
+    database, _, _ = await get_containers_async()
+    proxy = database.get_container_client(container_name)
+    if COSMOS_CLIENT_MODE == "sync":
+        proxy = SyncContainerAdapter(proxy)
+    return _extra_containers.setdefault(container_name, _wrap(proxy))
+
+
+_SENTINEL = object()
+
+
+class _AsyncPageAdapter:
+    """Itera en el thread pool las páginas de un pager síncrono de Cosmos."""
+
+    def __init__(self, pager):
+        self._pager = pager
+
+    @property
+    def continuation_token(self):
+        return self._pager.continuation_token
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        page = await asyncio.to_thread(next, self._pager, _SENTINEL)
+        if page is _SENTINEL:
+            raise StopAsyncIteration
+        # La página ya viene descargada: iterarla no hace I/O
+        return _AsyncListIter(list(page))
+
+
+class _AsyncListIter:
+    def __init__(self, items):
+        self._iterator = iter(items)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class _AsyncPagedAdapter:
+    def __init__(self, paged):
+        self._paged = paged
+
+    def __aiter__(self):
+        # Se itera por páginas para no saltar al thread pool en cada item
+        return self._iter_items()
+
+    async def _iter_items(self):
+        async for page in self.by_page():
+            async for item in page:
+                yield item
+
+    def by_page(self, continuation_token=None):
+        return _AsyncPageAdapter(self._paged.by_page(continuation_token))
+
+
+class SyncContainerAdapter:
+    """
+    Envuelve un ContainerProxy síncrono con la interfaz de azure.cosmos.aio:
+    los métodos son awaitables (se ejecutan en el thread pool) y las
+    consultas devuelven iterables async.
+    """
+
+    def __init__(self, container):
+        self._container = container
+
+    @property
+    def id(self):
+        return self._container.id
+
+    def query_items(self, *args, **kwargs):
+        if kwargs.get("partition_key") is None:
+            # aio consulta todas las particiones si no hay partition key; el síncrono lo pide explícito
+            kwargs.pop("partition_key", None)
+            kwargs["enable_cross_partition_query"] = True
+        return _AsyncPagedAdapter(self._container.query_items(*args, **kwargs))
+
+    def __getattr__(self, name):
+        attr = getattr(self._container, name)
+        if not callable(attr):
+            return attr
+
+        async def _call(*args, **kwargs):
+            return await asyncio.to_thread(attr, *args, **kwargs)
+
+        return _call
+
+
+async def collect(async_iterable) -> list:
+    """Materializa un iterable async (p. ej. query_items) en una lista."""
+    return [item async for item in async_iterable]
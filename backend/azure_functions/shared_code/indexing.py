@@ -0,0 +1,65 @@
+"""
+Políticas de indexación de los contenedores de Cosmos DB.
+
+La política por defecto indexa todas las rutas de cada documento y cada
+escritura paga RU por todas ellas. Acá se indexan sólo las rutas que
+consultan los handlers (``/*`` excluido) y se agregan índices compuestos para
+los listados ordenados por ``_ts`` (con o sin filtro de ``status``).
+
+``provision.py`` y la plantilla Bicep aplican estas mismas políticas;
+``benchmarks/ru.py`` mide el RU por escritura y por consulta contra la
+política por defecto.
+"""
+
+# Índices compuestos de tareas: (campo, orden). Un índice sirve también para
+# el orden exactamente inverso, así que alcanza con uno por combinación.
+TASKS_COMPOSITE_INDEXES = [
+    [("userId", "ascending"), ("status", "ascending"), ("_ts", "ascending")],
+    [("userId", "ascending"), ("_ts", "ascending")],
+]
+
+
+def _policy(paths, composite_indexes=()):
+    policy = {
+        "indexingMode": "consistent",
+        "automatic": True,
+        "includedPaths": [{"path": "/%s/?" % path} for path in paths],
+        "excludedPaths": [{"path": "/*"}],
+    }
+    if composite_indexes:
+        policy["compositeIndexes"] = [
+            [{"path": "/" + field, "order": order} for field, order in index]
+            for index in composite_indexes
+        ]
+    return policy
+
+
+# users: la búsqueda legacy por email y las bajas pendientes (el resto son point reads)
+USERS_INDEXING_POLICY = _policy(["email", "deletionRequestedAt"])
+# tasks: filtros de tasks_get (status, prefijo de title, lápidas, since) y orderBy
+TASKS_INDEXING_POLICY = _policy(
+    ["userId", "status", "title", "deletedAt", "_ts"], TASKS_COMPOSITE_INDEXES
+)
+# tasksArchive: los mismos listados que tasks (?archived=true), sin lápidas
+ARCHIVE_INDEXING_POLICY = _policy(["userId", "status", "title", "_ts"], TASKS_COMPOSITE_INDEXES)
+# taskStats: sólo point reads y upserts por id
+STATS_INDEXING_POLICY = _policy([])
+
+
+def composite_order_by(where, order_by, composite_indexes=TASKS_COMPOSITE_INDEXES):
+    """
+    Expande ``order_by`` para que coincida con un índice compuesto.
+
+    Cosmos sólo usa un índice compuesto para ``WHERE a = x ORDER BY b`` si el
+    ORDER BY empieza por los campos filtrados por igualdad (``ORDER BY a, b``).
+    Como esos campos son constantes en el resultado, agregarlos no cambia el
+    orden. Devuelve la lista de (campo, dirección) a usar.
+    """
+    field, direction = order_by
+    equal = {f for f, op, _ in where or () if op == "="}
+    best = []
+    for index in composite_indexes:
+        prefix = [f for f, _ in index[:-1]]
+        if index[-1][0] == field and set(prefix) <= equal and len(prefix) > len(best):
+            best = prefix
+    return [(f, direction) for f in best] + [(field, direction)]
@@ -0,0 +1,296 @@
+"""
+Instrumentación por request: tiempos por fase, RU de Cosmos e histogramas
+en proceso (p50/p95/p99).
+
+Uso en un handler::
+
+    @metrics.instrumented("tasks_get")
+    async def main(req): ...
+
+Las fases ``auth``, ``connect``, ``cosmos`` y ``serialize`` se registran solas
+desde shared_code; ``parse`` se marca en el handler con ``metrics.phase``.
+Al terminar cada request se emite una línea ``request_metrics {...}`` (JSON)
+y se alimentan los histogramas, que se vuelcan con ``dump()`` o, si
+``METRICS_DUMP_PATH`` está definido, al salir del proceso.
+"""
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import azure.functions as func
+
+from shared_code import resilience
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_DUMP_PATH = os.getenv("METRICS_DUMP_PATH", "").strip()
+# Muestras guardadas por histograma (ventana deslizante)
+HISTOGRAM_WINDOW = int(os.getenv("METRICS_HISTOGRAM_WINDOW", "10000"))
+
+REQUEST_CHARGE_HEADER = "x-ms-request-charge"
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+
+
+def _percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class Histogram:
+    """Ventana de las últimas N muestras; percentiles calculados al consultar."""
+
+    def __init__(self, window: int = HISTOGRAM_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, value: float):
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+            self.total += value
+
+    def summary(self) -> dict:
+        with self._lock:
+            values = sorted(self._samples)
+            count, total = self.count, self.total
+        return {
+            "count": count,
+            "sum": round(total, 3),
+            "p50": round(_percentile(values, 50), 3),
+            "p95": round(_percentile(values, 95), 3),
+            "p99": round(_percentile(values, 99), 3),
+            "max": round(values[-1], 3) if values else 0.0,
+        }
+
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def histogram(name: str) -> Histogram:
+    hist = _histograms.get(name)
+    if hist is None:
+        with _histograms_lock:
+            hist = _histograms.setdefault(name, Histogram())
+    return hist
+
+
+def snapshot() -> dict:
+    """Resumen de todos los histogramas: {nombre: {count, sum, p50, p95, p99, max}}."""
+    with _histograms_lock:
+        items = list(_histograms.items())
+    return {name: hist.summary() for name, hist in sorted(items)}
+
+
+def reset():
+    with _histograms_lock:
+        _histograms.clear()
+
+
+def dump(path: str = None) -> dict:
+    """Escribe el snapshot en JSON (por defecto en METRICS_DUMP_PATH) y lo devuelve."""
+    data = snapshot()
+    path = path or METRICS_DUMP_PATH
+    if path:
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, indent=2, sort_keys=True)
+    return data
+
+
+if METRICS_DUMP_PATH:
+    atexit.register(dump)
+
+
+class RequestMetrics:
+    def __init__(self, function_name: str):
+        self.function_name = function_name
+        self.phases = {}
+        self.request_charge = 0.0
+        self.cosmos_calls = 0
+
+    def add_phase(self, name: str, elapsed_ms: float):
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed_ms
+
+    def add_charge(self, headers):
+        try:
+            charge = float((headers or {}).get(REQUEST_CHARGE_HEADER, 0) or 0)
+        except (TypeError, ValueError):
+            return
+        self.request_charge += charge
+
+
+def current():
+    """RequestMetrics del request en curso (o None fuera de un handler instrumentado)."""
+    return _current.get()
+
+
+@contextmanager
+def phase(name: str):
+    """Acumula el tiempo del bloque en la fase ``name`` del request en curso."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_phase(name, (time.perf_counter() - started) * 1000)
+
+
+def record_charge(headers, *_):
+    """response_hook de Cosmos: suma el RU de la respuesta al request en curso."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.cosmos_calls += 1
+        metrics.add_charge(headers)
+
+
+def _finish(metrics: RequestMetrics, status_code, elapsed_ms: float):
+    name = metrics.function_name
+    histogram(name + ".total_ms").record(elapsed_ms)
+    for phase_name, value in metrics.phases.items():
+        histogram("%s.%s_ms" % (name, phase_name)).record(value)
+    histogram(name + ".ru").record(metrics.request_charge)
+
+    logger.info(
+        "request_metrics %s",
+        json.dumps(
+            {
+                "function": name,
+                "status": status_code,
+                "total_ms": round(elapsed_ms, 3),
+                "phases_ms": {k: round(v, 3) for k, v in metrics.phases.items()},
+                "ru": round(metrics.request_charge, 2),
+                "cosmos_calls": metrics.cosmos_calls,
+            },
+            sort_keys=True,
+        ),
+    )
+
+
+async def _fail_fast(function_name, handler, args, kwargs):
+    """
+    Corre el handler; si el breaker de Cosmos se abre a mitad del request
+    (``CircuitOpenError`` de GuardedContainer) responde 503 con ``Retry-After``.
+    """
+    try:
+        return await handler(*args, **kwargs)
+    except resilience.CircuitOpenError as err:
+        logger.warning("Cosmos DB no disponible durante %s; se responde 503", function_name)
+        return func.HttpResponse(
+            json.dumps({"error": "Could not connect to database"}),
+            status_code=503,
+            mimetype="application/json",
+            headers=resilience.retry_after_headers(err),
+        )
+
+
+def instrumented(function_name: str):
+    """
+    Decorador para ``main``: mide el request completo y emite sus métricas.
+    Aun con las métricas apagadas traduce ``CircuitOpenError`` a 503.
+    """
+
+    def decorator(handler):
+        if not METRICS_ENABLED:
+            @functools.wraps(handler)
+            async def guarded(*args, **kwargs):
+                return await _fail_fast(function_name, handler, args, kwargs)
+
+            return guarded
+
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            metrics = RequestMetrics(function_name)
+            token = _current.set(metrics)
+            started = time.perf_counter()
+            status_code = 500
+            try:
+                response = await _fail_fast(function_name, handler, args, kwargs)
+                status_code = getattr(response, "status_code", None)
+                return response
+            finally:
+                _finish(metrics, status_code, (time.perf_counter() - started) * 1000)
+                _current.reset(token)
+
+        return wrapper
+
+    return decorator
+
+
+class _TimedAsyncIterator:
+    """Itera un resultado de Cosmos contando el tiempo de cada paso en la fase indicada."""
+
+    def __init__(self, iterator, phase_name):
+        self._iterator = iterator
+        self._phase_name = phase_name
+
+    @property
+    def continuation_token(self):
+        return self._iterator.continuation_token
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        with phase(self._phase_name):
+            return await self._iterator.__anext__()
+
+
+class _InstrumentedPaged:
+    def __init__(self, paged, phase_name):
+        self._paged = paged
+        self._phase_name = phase_name
+
+    def __aiter__(self):
+        return _TimedAsyncIterator(self._paged.__aiter__(), self._phase_name)
+
+    def by_page(self, continuation_token=None):
+        return _TimedAsyncIterator(self._paged.by_page(continuation_token), self._phase_name)
+
+
+class InstrumentedContainer:
+    """
+    Proxy de un contenedor async (aio o SyncContainerAdapter) que mide cada
+    llamada como fase ``cosmos`` (o ``phase_name``) y captura el RU vía
+    ``response_hook``.
+    """
+
+    def __init__(self, container, phase_name: str = "cosmos"):
+        self._container = container
+        self._phase_name = phase_name
+
+    @property
+    def id(self):
+        return self._container.id
+
+    def query_items(self, *args, **kwargs):
+        kwargs.setdefault("response_hook", record_charge)
+        return _InstrumentedPaged(self._container.query_items(*args, **kwargs), self._phase_name)
+
+    def __getattr__(self, name):
+        attr = getattr(self._container, name)
+        if not inspect.iscoroutinefunction(attr):
+            return attr
+
+        async def _call(*args, **kwargs):
+            kwargs.setdefault("response_hook", record_charge)
+            with phase(self._phase_name):
+                return await attr(*args, **kwargs)
+
+        return _call
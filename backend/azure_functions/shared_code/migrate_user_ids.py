@@ -0,0 +1,76 @@
+"""
+Reescribe los usuarios existentes con el id determinístico de
+shared_code.users.user_doc_id(email), conservando su id original en
+``userId`` (el ``sub`` de los JWT y la partition key de sus tareas).
+
+    cd backend/azure_functions
+    python -m shared_code.migrate_user_ids [--dry-run]
+
+Cada usuario se migra con un transactional batch en su partición /email
+(delete del documento viejo + create del nuevo), así la unique key de
+/email nunca ve dos documentos y un fallo no deja el usuario a medias.
+
+Cuando termina sin fallas (``failed`` = 0) ya no quedan documentos legacy:
+poner ``USERS_LEGACY_LOOKUP=false`` para que login, registro y la lectura de
+perfil no hagan la búsqueda legacy por cada email inexistente.
+"""
+import argparse
+import logging
+import sys
+
+from azure.cosmos import exceptions
+
+from shared_code import db
+from shared_code.serializers import strip_system_properties
+from shared_code.users import normalize_email, user_doc_id
+
+logger = logging.getLogger(__name__)
+
+
+def migrate(users_container, dry_run: bool = False) -> dict:
+    stats = {"scanned": 0, "migrated": 0, "skipped": 0, "failed": 0}
+    for doc in users_container.query_items(
+        query="SELECT * FROM c", enable_cross_partition_query=True
+    ):
+        stats["scanned"] += 1
+        email = normalize_email(doc.get("email"))
+        new_id = user_doc_id(email)
+        if not email or doc["id"] == new_id:
+            stats["skipped"] += 1
+            continue
+
+        new_doc = strip_system_properties(doc)
+        new_doc["userId"] = doc.get("userId") or doc["id"]
+        new_doc["id"] = new_id
+        if dry_run:
+            logger.info("[dry-run] %s: %s -> %s", email, doc["id"], new_id)
+            stats["migrated"] += 1
+            continue
+
+        try:
+            users_container.execute_item_batch(
+                batch_operations=[("delete", (doc["id"],)), ("create", (new_doc,))],
+                partition_key=doc["email"],
+            )
+            stats["migrated"] += 1
+            logger.info("Usuario %s migrado a %s", email, new_id)
+        except exceptions.CosmosHttpResponseError:
+            stats["failed"] += 1
+            logger.exception("No se pudo migrar el usuario %s", email)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migra usuarios a ids determinísticos")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    _, users_container, _ = db.get_containers()
+    stats = migrate(users_container, dry_run=args.dry_run)
+    logger.info("Migración terminada: %s", stats)
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
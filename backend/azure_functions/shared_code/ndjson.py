@@ -0,0 +1,93 @@
+"""
+NDJSON (un documento JSON por línea) para export/import de tareas.
+
+El modelo de programación de Functions que usa el proyecto (function.json)
+entrega y devuelve cuerpos completos en memoria, así que "streaming" acá
+significa no materializar nunca la lista de documentos: el export serializa
+y comprime página por página a medida que llegan de Cosmos, y el import
+recorre el cuerpo línea por línea sin decodificarlo entero.
+"""
+import zlib
+
+from shared_code import responses
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+class NdjsonWriter:
+    """Acumula líneas NDJSON comprimiendo de forma incremental (gzip / brotli)."""
+
+    def __init__(self, encoding=None):
+        self.encoding = encoding
+        self.lines = 0
+        self._chunks = []
+        if encoding == "br":
+            self._compressor = responses.brotli.Compressor(quality=responses.BROTLI_QUALITY)
+            self._compress, self._flush = self._compressor.process, self._compressor.finish
+        elif encoding == "gzip":
+            # wbits=31: formato gzip (cabecera + CRC), igual que gzip.compress
+            self._compressor = zlib.compressobj(responses.GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._compress, self._flush = self._compressor.compress, self._compressor.flush
+        else:
+            self._compress = self._flush = None
+
+    def write(self, doc):
+        line = responses.dumps(doc) + b"\n"
+        self._chunks.append(self._compress(line) if self._compress else line)
+        self.lines += 1
+
+    def getvalue(self) -> bytes:
+        if self._flush:
+            self._chunks.append(self._flush())
+            self._flush = None
+        return b"".join(self._chunks)
+
+
+class BodyTooLarge(ValueError):
+    """El cuerpo (ya descomprimido) supera el tope permitido."""
+
+
+def decode_body(body: bytes, content_encoding=None, max_bytes: int = None) -> bytes:
+    """
+    Descomprime un cuerpo de import enviado con Content-Encoding: gzip.
+    Con ``max_bytes`` corta apenas la salida supera el tope (BodyTooLarge): unos
+    KB comprimidos pueden expandirse a GB. Un gzip inválido lanza OSError o EOFError.
+    """
+    if (content_encoding or "").strip().lower() != "gzip":
+        if max_bytes is not None and len(body) > max_bytes:
+            raise BodyTooLarge(max_bytes)
+        return body
+
+    chunks, size, data = [], 0, body
+    # Un gzip puede traer varios miembros concatenados (como gzip.decompress)
+    while data:
+        decompressor = zlib.decompressobj(wbits=31)
+        limit = 0 if max_bytes is None else max_bytes - size + 1
+        try:
+            chunk = decompressor.decompress(data, limit)
+        except zlib.error as err:
+            raise OSError("Invalid gzip body") from err
+        size += len(chunk)
+        if max_bytes is not None and (size > max_bytes or decompressor.unconsumed_tail):
+            raise BodyTooLarge(max_bytes)
+        if not decompressor.eof:
+            raise EOFError("Truncated gzip body")
+        chunks.append(chunk)
+        data = decompressor.unused_data
+    return b"".join(chunks)
+
+
+def iter_lines(body: bytes):
+    """(número de línea desde 1, bytes) de cada línea no vacía, sin copiar el cuerpo entero."""
+    start = 0
+    number = 0
+    size = len(body)
+    while start < size:
+        end = body.find(b"\n", start)
+        if end == -1:
+            end = size
+        number += 1
+        line = body[start:end].strip()
+        if line:
+            yield number, line
+        start = end + 1
@@ -0,0 +1,98 @@
+import asyncio
+import hmac
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bcrypt
+
+from shared_code import metrics
+
+logger = logging.getLogger(__name__)
+
+# Coste de bcrypt para hashes nuevos; los hashes con coste menor se rehashean en el login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# "thread" (bcrypt libera el GIL) o "process"
+HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread").strip().lower()
+HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Operaciones en curso + en cola a partir de las cuales se responde 503
+HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "16"))
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+class HashingBusyError(RuntimeError):
+    """El pool de hashing está saturado; el caller debe responder 503."""
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                if HASH_EXECUTOR == "process":
+                    _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+                else:
+                    _executor = ThreadPoolExecutor(
+                        max_workers=HASH_WORKERS, thread_name_prefix="bcrypt"
+                    )
+    return _executor
+
+
+def _hashpw(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _checkpw(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+async def _run(fn, *args):
+    global _pending
+    with _pending_lock:
+        if _pending >= HASH_MAX_PENDING:
+            raise HashingBusyError("password hashing pool is saturated")
+        _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        with metrics.phase("hash"):
+            return await loop.run_in_executor(_get_executor(), fn, *args)
+    finally:
+        with _pending_lock:
+            _pending -= 1
+
+
+async def hash_password(plain_password: str) -> str:
+    hashed = await _run(_hashpw, plain_password.encode("utf-8"), BCRYPT_ROUNDS)
+    return hashed.decode("utf-8")
+
+
+async def verify_password(plain_password: str, stored_hash: str) -> bool:
+    # Compatibilidad: si lo almacenado parece bcrypt, verifica bcrypt; si no, compara texto (legacy).
+    if stored_hash and stored_hash.startswith("$2"):
+        try:
+            return await _run(
+                _checkpw, plain_password.encode("utf-8"), stored_hash.encode("utf-8")
+            )
+        except HashingBusyError:
+            raise
+        except Exception:
+            return False
+    # Legacy fallback (no recomendado, sólo para transición)
+    if not stored_hash:
+        return False
+    return hmac.compare_digest(plain_password.encode("utf-8"), stored_hash.encode("utf-8"))
+
+
+def needs_rehash(stored_hash: str) -> bool:
+    """True si el hash es texto plano legacy o usa un coste menor al configurado."""
+    if not stored_hash or not stored_hash.startswith("$2"):
+        return True
+    try:
+        return int(stored_hash.split("$")[2]) < BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
@@ -0,0 +1,171 @@
+"""
+Aprovisiona la base de datos y los contenedores de Cosmos DB.
+
+Se ejecuta una sola vez por entorno (fuera del camino de los requests):
+
+    cd backend/azure_functions
+    python -m shared_code.provision
+
+En Azure la plantilla Bicep ya crea los mismos recursos. Si un contenedor ya
+existe con otra política de indexación o sin el TTL de la definición, se
+reemplaza (Cosmos reindexa en segundo plano, sin cortar lecturas ni escrituras).
+"""
+import logging
+import sys
+
+from azure.cosmos import CosmosClient, PartitionKey
+
+from shared_code import db, indexing, sharding
+
+logger = logging.getLogger(__name__)
+
+CONTAINER_DEFINITIONS = [
+    {
+        "id": db.USER_CONTAINER,
+        "partition_key": "/email",
+        # Unique Key Policy para asegurar unicidad de /email
+        "unique_key_policy": {"uniqueKeys": [{"paths": ["/email"]}]},
+        "indexing_policy": indexing.USERS_INDEXING_POLICY,
+    },
+    {
+        "id": db.TASK_CONTAINER,
+        # "/userId", o ["/userId", "/bucket"] con TASKS_PARTITION_KEY=hierarchical
+        "partition_key": sharding.PARTITION_PATHS,
+        # TTL habilitado sin valor por defecto: sólo vencen las lápidas (campo ttl)
+        "default_ttl": -1,
+        "indexing_policy": indexing.TASKS_INDEXING_POLICY,
+    },
+    {
+        # Un documento de resumen por usuario (id = userId)
+        "id": db.STATS_CONTAINER,
+        "partition_key": "/userId",
+        "indexing_policy": indexing.STATS_INDEXING_POLICY,
+    },
+    {
+        # Tareas archivadas (shared_code.archive); mismas consultas que tasks
+        "id": db.ARCHIVE_CONTAINER,
+        "partition_key": sharding.PARTITION_PATHS,
+        "indexing_policy": indexing.ARCHIVE_INDEXING_POLICY,
+    },
+    {
+        # Leases del trigger de change feed (tasks_stats_feed); el host consulta
+        # este contenedor, así que conserva la política por defecto
+        "id": db.LEASES_CONTAINER,
+        "partition_key": "/id",
+    },
+]
+
+
+def _policy_key(policy):
+    """Partes comparables de una política (Cosmos agrega rutas y campos propios)."""
+    return (
+        policy.get("indexingMode", "consistent").lower(),
+        sorted(p["path"] for p in policy.get("includedPaths", [])),
+        sorted(p["path"] for p in policy.get("excludedPaths", []) if p["path"] != '/"_etag"/?'),
+        sorted(
+            [(p["path"], p.get("order", "ascending").lower()) for p in index]
+            for index in policy.get("compositeIndexes", [])
+        ),
+    )
+
+
+def _partition_key(definition):
+    path = definition["partition_key"]
+    if isinstance(path, list):
+        # Jerárquica (subparticionado): las consultas por prefijo usan el primer nivel
+        return PartitionKey(path=path, kind="MultiHash")
+    return PartitionKey(path=path)
+
+
+def _replace_container(database, container, properties, **changes):
+    """
+    Reemplaza un contenedor con sus propiedades actuales (partition key,
+    unique keys, TTL...) y sólo ``changes`` distintos. ``replace_container``
+    del SDK arma el cuerpo de cero y no tiene parámetro para la unique key
+    policy: con él, reemplazar ``users`` mandaría un cuerpo sin la de /email.
+    """
+    body = {k: v for k, v in properties.items() if not k.startswith("_")}
+    body.update(changes)
+    return database.client_connection.ReplaceContainer(
+        container.container_link, collection=body, options={}
+    )
+
+
+def _pending_changes(definition, properties) -> dict:
+    """Propiedades de un contenedor existente que no coinciden con su definición."""
+    changes = {}
+    if "indexing_policy" in definition and _policy_key(
+        properties.get("indexingPolicy", {})
+    ) != _policy_key(definition["indexing_policy"]):
+        logger.warning(
+            "El contenedor %s tiene otra política de indexación: se reemplaza "
+            "(la reindexación corre en segundo plano y consume RU)",
+            definition["id"],
+        )
+        changes["indexingPolicy"] = definition["indexing_policy"]
+    if "default_ttl" in definition and properties.get("defaultTtl") != definition["default_ttl"]:
+        # create_container_if_not_exists no modifica contenedores ya existentes;
+        # sin TTL las lápidas no expiran y los cursores viejos nunca dan 410
+        logger.warning(
+            "El contenedor %s tiene TTL %s: se habilita con %s",
+            definition["id"], properties.get("defaultTtl"), definition["default_ttl"],
+        )
+        changes["defaultTtl"] = definition["default_ttl"]
+    return changes
+
+
+def provision(client=None):
+    """Crea la DB y los contenedores si no existen. Devuelve el DatabaseProxy."""
+    client = client or CosmosClient(
+        db.COSMOS_URI,
+        credential=db.COSMOS_KEY,
+        connection_verify=db.COSMOS_VERIFY,
+        connection_timeout=30,
+    )
+    database = client.create_database_if_not_exists(id=db.DATABASE_NAME)
+    for definition in CONTAINER_DEFINITIONS:
+        kwargs = {}
+        if "unique_key_policy" in definition:
+            kwargs["unique_key_policy"] = definition["unique_key_policy"]
+        if "default_ttl" in definition:
+            kwargs["default_ttl"] = definition["default_ttl"]
+        if "indexing_policy" in definition:
+            kwargs["indexing_policy"] = definition["indexing_policy"]
+        container = database.create_container_if_not_exists(
+            id=definition["id"],
+            partition_key=_partition_key(definition),
+            **kwargs,
+        )
+        properties = container.read()
+        expected_paths = definition["partition_key"]
+        if isinstance(expected_paths, str):
+            expected_paths = [expected_paths]
+        if properties.get("partitionKey", {}).get("paths") != expected_paths:
+            # La partition key de un contenedor no se puede cambiar: hay que copiarlo
+            logger.error(
+                "El contenedor %s tiene partition key %s y se esperaba %s: usar otro nombre "
+                "y copiar los datos con python -m shared_code.rekey copy",
+                definition["id"], properties.get("partitionKey", {}).get("paths"), expected_paths,
+            )
+            continue
+        changes = _pending_changes(definition, properties)
+        if changes:
+            # Un solo reemplazo: cada uno parte de las propiedades leídas
+            _replace_container(database, container, properties, **changes)
+        logger.info("Contenedor %s listo", definition["id"])
+    return database
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    try:
+        provision()
+    except Exception:
+        logger.exception("No fue posible aprovisionar Cosmos DB")
+        return 1
+    logger.info("Base de datos %s aprovisionada", db.DATABASE_NAME)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
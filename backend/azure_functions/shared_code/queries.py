@@ -0,0 +1,126 @@
+import logging
+
+from shared_code import tombstones
+
+logger = logging.getLogger(__name__)
+
+TASK_STATUSES = {"pending", "in_progress", "done", "blocked"}
+NEW_TASK_STATUSES = {"pending", "in_progress"}
+
+# Campos por los que se permite ordenar (nunca se interpola input del cliente)
+ORDERABLE_FIELDS = {"title", "status", "_ts"}
+# Campos que se pueden pedir con ``fields=`` (proyección explícita en el SELECT)
+PROJECTABLE_FIELDS = {"id", "title", "status", "userId", "_ts", "_etag"}
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class QueryParamError(ValueError):
+    """Parámetro de consulta inválido; el mensaje se devuelve tal cual al cliente."""
+
+
+def parse_limit(raw):
+    """Convierte ``limit`` a entero acotado. ``None`` significa sin paginar."""
+    if raw in (None, ""):
+        return None
+    try:
+        limit = int(raw)
+    except (TypeError, ValueError):
+        raise QueryParamError("limit must be an integer")
+    if limit < 1:
+        raise QueryParamError("limit must be greater than 0")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def parse_order_by(raw):
+    """Interpreta ``orderBy``: ``campo`` (asc) o ``-campo`` (desc)."""
+    if not raw:
+        return None
+    direction = "ASC"
+    field = raw.strip()
+    if field.startswith("-"):
+        direction = "DESC"
+        field = field[1:]
+    if field not in ORDERABLE_FIELDS:
+        raise QueryParamError(
+            "orderBy must be one of: " + ", ".join(sorted(ORDERABLE_FIELDS))
+        )
+    return field, direction
+
+
+def parse_fields(raw):
+    """Interpreta ``fields=id,title``. ``None`` significa todos los campos."""
+    if not raw:
+        return None
+    fields = []
+    for field in raw.split(","):
+        field = field.strip()
+        if not field or field in fields:
+            continue
+        if field not in PROJECTABLE_FIELDS:
+            raise QueryParamError(
+                "fields must be a subset of: " + ", ".join(sorted(PROJECTABLE_FIELDS))
+            )
+        fields.append(field)
+    return fields or None
+
+
+def build_tasks_query(user_id, status=None, title_prefix=None, order_by=None, fields=None,
+                      archived=False):
+    """
+    Construye la consulta de tareas de un usuario con filtros server-side.
+    Con ``fields`` se proyectan sólo esos campos en vez de ``SELECT *``.
+    ``archived`` es para el contenedor de archivo, que no tiene lápidas.
+    Devuelve los kwargs de ``store.query`` (ver shared_code.storage).
+    """
+    where = [("userId", "=", user_id)]
+    if not archived:
+        # Las tareas borradas quedan como lápidas hasta que vence su TTL
+        where.append(tombstones.LIVE_FILTER)
+
+    if status:
+        if status not in TASK_STATUSES:
+            raise QueryParamError(
+                "status must be one of: " + ", ".join(sorted(TASK_STATUSES))
+            )
+        where.append(("status", "=", status))
+
+    if title_prefix:
+        where.append(("title", "istartswith", title_prefix))
+
+    return {"where": where, "order_by": order_by, "fields": fields}
+
+
+class CursorExpiredError(QueryParamError):
+    """El cursor es anterior al TTL de las lápidas: hace falta una sincronización completa."""
+
+
+def parse_since(raw, oldest_valid=None):
+    """
+    Interpreta ``since`` (cursor de sincronización, un ``_ts`` de Cosmos).
+    ``None`` significa que no es una sincronización incremental; ``0`` es la inicial.
+    """
+    if raw in (None, ""):
+        return None
+    try:
+        cursor = int(raw)
+    except (TypeError, ValueError):
+        raise QueryParamError("since must be a cursor returned by a previous sync")
+    if cursor < 0:
+        raise QueryParamError("since must be a cursor returned by a previous sync")
+    if cursor and oldest_valid is not None and cursor < oldest_valid:
+        raise CursorExpiredError("cursor expired, a full sync (since=0) is required")
+    return cursor
+
+
+def build_sync_query(user_id, since):
+    """
+    Tareas (vivas y lápidas) modificadas desde ``since``, en orden de ``_ts``.
+    Se usa ``>=``: ``_ts`` tiene resolución de segundos y con ``>`` se perderían
+    cambios del mismo segundo que el cursor; el cliente descarta repetidos por id.
+    """
+    where = [("userId", "=", user_id)]
+    if since:
+        where.append(("_ts", ">=", since))
+    return {"where": where, "order_by": ("_ts", "ASC"), "fields": None}
@@ -0,0 +1,294 @@
+"""
+Rate limiting con token bucket, aplicado a cada handler con ``@limited``::
+
+    @metrics.instrumented("tasks_get")
+    @ratelimit.limited("api")
+    async def main(req): ...
+
+Políticas (``RATE_LIMIT_<POLÍTICA>`` = ``capacidad/segundos``: la capacidad
+es la ráfaga máxima y se recarga completa en esos segundos):
+
+- ``api``: rutas autenticadas, por ``sub`` del JWT (por IP si no hay token).
+- ``login``: por IP del cliente (ver :func:`client_ip`) y, además, por email.
+- ``register``: por IP del cliente.
+
+Excedido el límite se responde 429 con ``Retry-After`` antes de tocar Cosmos
+o bcrypt. El estado vive en un backend intercambiable (RATE_LIMIT_BACKEND):
+
+- ``memory`` (por defecto): por instancia del worker.
+- ``sqlite``: archivo compartido por los procesos de una máquina
+  (RATE_LIMIT_SQLITE_PATH); sirve de stand-in local de un backend compartido.
+- ``paquete.modulo:fabrica``: cualquier ``RateLimitBackend`` propio
+  (p. ej. uno sobre Redis) para compartir el límite entre instancias.
+
+Si el backend falla el request pasa (fail-open) y queda registrado.
+"""
+import functools
+import importlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import azure.functions as func
+
+from shared_code import users
+from shared_code.utils import get_user_from_token
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").strip()
+RATE_LIMIT_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", "ratelimit.sqlite3")
+# Cantidad máxima de claves en memoria (LRU); una clave desalojada vuelve con el bucket lleno
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# IP del cliente: header que pone la plataforma (p. ej. X-Azure-ClientIP detrás
+# de Front Door) o, si no se configura, el salto de X-Forwarded-For que agregó
+# el proxy de confianza más externo. Los saltos a la izquierda los escribe el
+# cliente y no sirven de clave.
+RATE_LIMIT_CLIENT_IP_HEADER = os.getenv("RATE_LIMIT_CLIENT_IP_HEADER", "").strip()
+RATE_LIMIT_TRUSTED_PROXIES = max(int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "1")), 1)
+
+DEFAULT_POLICIES = {
+    "api": "120/60",
+    "login": "10/60",
+    "login_email": "5/300",
+    "register": "5/300",
+}
+
+
+def _parse_policy(name: str, raw: str):
+    try:
+        capacity, seconds = raw.split("/")
+        capacity, seconds = float(capacity), float(seconds)
+        if capacity <= 0 or seconds <= 0:
+            raise ValueError
+    except ValueError:
+        logger.error("RATE_LIMIT_%s inválido (%r); se usa %s", name.upper(), raw, DEFAULT_POLICIES[name])
+        return _parse_policy(name, DEFAULT_POLICIES[name])
+    return capacity, capacity / seconds
+
+
+# nombre -> (capacidad, tokens por segundo)
+POLICIES = {
+    name: _parse_policy(name, os.getenv("RATE_LIMIT_" + name.upper(), default))
+    for name, default in DEFAULT_POLICIES.items()
+}
+
+
+class RateLimitBackend:
+    """
+    Interfaz de almacenamiento de buckets. ``take`` consume ``cost`` tokens de
+    ``key`` y devuelve (permitido, segundos hasta que habría tokens suficientes).
+    """
+
+    async def take(self, key: str, capacity: float, rate: float, cost: float = 1.0):
+        raise NotImplementedError
+
+    def reset(self):
+        """Vacía el estado (benchmarks y pruebas locales)."""
+
+
+def _refill(tokens, updated, now, capacity, rate):
+    return min(capacity, tokens + max(0.0, now - updated) * rate)
+
+
+def _consume(tokens, capacity, rate, cost):
+    """Devuelve (permitido, tokens restantes, retry_after)."""
+    if tokens >= cost:
+        return True, tokens - cost, 0.0
+    return False, tokens, (cost - tokens) / rate
+
+
+class MemoryBackend(RateLimitBackend):
+    """Buckets en un dict LRU del proceso; cada instancia limita por su cuenta."""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    async def take(self, key, capacity, rate, cost=1.0):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = _refill(tokens, updated, now, capacity, rate)
+            allowed, tokens, retry_after = _consume(tokens, capacity, rate, cost)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SqliteBackend(RateLimitBackend):
+    """
+    Buckets en un archivo SQLite compartido por los procesos de la máquina.
+    Cada ``take`` es una transacción ``BEGIN IMMEDIATE`` (lectura + escritura atómica).
+    """
+
+    def __init__(self, path: str = RATE_LIMIT_SQLITE_PATH):
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    async def take(self, key, capacity, rate, cost=1.0):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated FROM buckets WHERE key=?", (key,)
+                ).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                tokens = _refill(tokens, updated, now, capacity, rate)
+                allowed, tokens, retry_after = _consume(tokens, capacity, rate, cost)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return allowed, retry_after
+
+    def reset(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM buckets")
+
+
+def _build_backend(name: str) -> RateLimitBackend:
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SqliteBackend()
+    if ":" in name:
+        module_name, factory_name = name.split(":", 1)
+        return getattr(importlib.import_module(module_name), factory_name)()
+    raise RuntimeError("Unknown RATE_LIMIT_BACKEND: %s" % name)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> RateLimitBackend:
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _build_backend(RATE_LIMIT_BACKEND)
+    return _backend
+
+
+def set_backend(backend: RateLimitBackend):
+    """Reemplaza el backend (p. ej. uno compartido creado por la aplicación)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def client_ip(req) -> str:
+    """
+    IP del cliente vista por el proxy de confianza, sin puerto. Sólo se
+    confía en lo que agrega la plataforma: sin ese dato todos los requests
+    comparten la clave "unknown" (un header que manda el cliente le daría un
+    bucket nuevo en cada request).
+    """
+    if RATE_LIMIT_CLIENT_IP_HEADER:
+        ip = (req.headers.get(RATE_LIMIT_CLIENT_IP_HEADER) or "").strip()
+    else:
+        hops = [hop.strip() for hop in (req.headers.get("X-Forwarded-For") or "").split(",")]
+        hops = [hop for hop in hops if hop]
+        # Cada proxy agrega a la derecha la IP que le habló; con menos saltos
+        # que proxies de confianza el header no pasó por ellos
+        ip = hops[-RATE_LIMIT_TRUSTED_PROXIES] if len(hops) >= RATE_LIMIT_TRUSTED_PROXIES else ""
+    if not ip:
+        return "unknown"
+    if ip.startswith("["):
+        # IPv6 con puerto: [::1]:443
+        return ip[1:].split("]")[0]
+    if ip.count(":") == 1:
+        ip = ip.split(":")[0]
+    return ip
+
+
+def _keys(policy: str, req):
+    """Lista de (política, clave) que deben tener tokens para atender el request."""
+    if policy == "api":
+        try:
+            user = get_user_from_token(req)
+        except RuntimeError:
+            user = None
+        if user and user.get("sub"):
+            return [("api", "api:sub:" + user["sub"])]
+        return [("api", "api:ip:" + client_ip(req))]
+
+    keys = [(policy, "%s:ip:%s" % (policy, client_ip(req)))]
+    if policy == "login":
+        try:
+            body = req.get_json()
+        except ValueError:
+            body = None
+        email = users.normalize_email(body.get("email")) if isinstance(body, dict) else ""
+        if email:
+            keys.append(("login_email", "login:email:" + email))
+    return keys
+
+
+def _too_many_requests(retry_after: float) -> func.HttpResponse:
+    return func.HttpResponse(
+        json.dumps({"error": "Too many requests"}),
+        status_code=429,
+        mimetype="application/json",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+async def check(policy: str, req):
+    """None si el request puede seguir; si no, la respuesta 429 a devolver."""
+    backend = get_backend()
+    for name, key in _keys(policy, req):
+        capacity, rate = POLICIES[name]
+        try:
+            allowed, retry_after = await backend.take(key, capacity, rate)
+        except Exception:
+            logger.warning("Rate limiter no disponible; se deja pasar %s", key, exc_info=True)
+            continue
+        if not allowed:
+            logger.warning("Rate limit excedido: %s (reintentar en %.1fs)", key, retry_after)
+            return _too_many_requests(retry_after)
+    return None
+
+
+def limited(policy: str):
+    """Decorador para ``main``: aplica la política antes de ejecutar el handler."""
+    if policy not in ("api", "login", "register"):
+        raise ValueError("Unknown rate limit policy: %s" % policy)
+
+    def decorator(handler):
+        if not RATE_LIMIT_ENABLED:
+            return handler
+
+        @functools.wraps(handler)
+        async def wrapper(req, *args, **kwargs):
+            rejected = await check(policy, req)
+            if rejected is not None:
+                return rejected
+            return await handler(req, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,301 @@
+"""
+Re-particionado de tareas en línea (ver shared_code.sharding).
+
+Dos comandos, los dos se pueden cortar y repetir:
+
+``rebucket``: cambia la cantidad de buckets de un usuario dentro de un
+contenedor que ya es jerárquico (tareas y archivo)::
+
+    cd backend/azure_functions
+    python -m shared_code.rekey rebucket --user <userId> --buckets 16
+
+1. Guarda el mapa con ``buckets`` nuevo y ``previousBuckets`` = el actual, y
+   espera TASKS_SHARD_MAP_TTL_SECONDS para que todas las instancias lo vean
+   (desde ahí buscan cada tarea en los dos buckets y crean en el nuevo).
+2. Mueve cada tarea fuera de lugar: copia en el bucket nuevo (create) y
+   borrado del viejo con el ``_etag`` leído. Si la tarea cambió en el medio
+   el borrado da 412 y se vuelve a copiar.
+3. Cuando ya no queda nada fuera de lugar, quita ``previousBuckets``.
+
+``copy``: pasa las tareas de un contenedor existente (p. ej. ``tasks`` con
+``/userId``) al contenedor configurado, que ya tiene la partition key nueva.
+Cosmos no permite cambiar la partition key de un contenedor, así que se lee
+el change feed del origen y se escribe en el destino con el bucket que toque;
+``--follow`` sigue copiando hasta que se apaga, mientras la app todavía
+escribe en el origen::
+
+    TASKS_PARTITION_KEY=hierarchical COSMOS_TASKS_CONTAINER=tasksV2 \\
+        python -m shared_code.rekey copy --source tasks --target tasks \\
+        --state rekey-tasks.json --follow
+
+Cada copia lleva ``migratedTs`` (el ``_ts`` de origen): una versión vieja del
+feed nunca pisa una más nueva, y lo que ya escribió la app en el destino (sin
+``migratedTs``) no se toca. El change feed no trae los borrados físicos: las
+bajas de cuentas hechas durante la copia se completan después con
+``python -m shared_code.accounts --resume``.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+from shared_code import db, sharding, storage
+from shared_code.serializers import strip_system_properties
+
+logger = logging.getLogger(__name__)
+
+REKEY_PAGE_SIZE = int(os.getenv("TASKS_REKEY_PAGE_SIZE", "1000"))
+# Mudanzas / copias en vuelo a la vez
+REKEY_CONCURRENCY = int(os.getenv("TASKS_REKEY_CONCURRENCY", "8"))
+# Pasadas de rebucket antes de rendirse (cada una vuelve a buscar lo fuera de lugar)
+REKEY_MAX_PASSES = 5
+# Reintentos de una mudanza cuando la tarea cambia entre la copia y el borrado
+MOVE_ATTEMPTS = 5
+
+MIGRATED_FIELD = "migratedTs"
+
+
+async def _misplaced(raw, user_id: str, buckets: int):
+    """(id, bucket actual) de las tareas de ``user_id`` que no están en su bucket."""
+    found, continuation = [], None
+    while True:
+        page = await raw.query(
+            [user_id], fields=["id", sharding.BUCKET_FIELD],
+            limit=REKEY_PAGE_SIZE, continuation=continuation,
+        )
+        for item in page.items:
+            bucket = item.get(sharding.BUCKET_FIELD, 0)
+            if bucket != sharding.bucket_of(item["id"], buckets):
+                found.append((item["id"], bucket))
+        continuation = page.continuation_token
+        if not continuation:
+            return found
+
+
+async def move_task(raw, user_id: str, task_id: str, source: int, target: int) -> bool:
+    """Mueve una tarea de bucket. False si ya no estaba en ``source``."""
+    source_key = sharding.full_key(user_id, source)
+    written_etag = None  # _etag de la copia que escribió esta mudanza
+    for _ in range(MOVE_ATTEMPTS):
+        try:
+            doc = await raw.read_item(item=task_id, partition_key=source_key)
+        except exceptions.CosmosResourceNotFoundError:
+            return False
+
+        body = sharding.copy_for_bucket(doc, target)
+        try:
+            if written_etag is None:
+                written = await raw.create_item(body)
+            else:
+                written = await raw.upsert_item(
+                    body, etag=written_etag, match_condition=MatchConditions.IfNotModified
+                )
+            written_etag = written.get("_etag")
+        except (exceptions.CosmosResourceExistsError, exceptions.CosmosAccessConditionFailedError):
+            # Ya hay una copia en el destino que no es nuestra (o que la app editó):
+            # las escrituras van primero al bucket nuevo, así que esa es la vigente
+            pass
+
+        try:
+            await raw.delete_item(
+                item=task_id, partition_key=source_key,
+                etag=doc["_etag"], match_condition=MatchConditions.IfNotModified,
+            )
+            return True
+        except exceptions.CosmosResourceNotFoundError:
+            return True
+        except exceptions.CosmosAccessConditionFailedError:
+            logger.info("Tarea %s cambió durante la mudanza; se vuelve a copiar", task_id)
+    raise RuntimeError("Task %s kept changing while being moved" % task_id)
+
+
+async def _rebucket_store(raw, user_id: str, buckets: int) -> int:
+    semaphore = asyncio.Semaphore(REKEY_CONCURRENCY)
+
+    async def bounded(task_id, source):
+        async with semaphore:
+            target = sharding.bucket_of(task_id, buckets)
+            return await move_task(raw, user_id, task_id, source, target)
+
+    moved = 0
+    for _ in range(REKEY_MAX_PASSES):
+        # Primero se juntan los ids y después se mueve: escribir durante el
+        # paginado movería los offsets de los backends locales
+        pending = await _misplaced(raw, user_id, buckets)
+        if not pending:
+            return moved
+        moved += sum(await asyncio.gather(*(bounded(task_id, source) for task_id, source in pending)))
+    if await _misplaced(raw, user_id, buckets):
+        raise RuntimeError("Tasks of %s still misplaced after %d passes" % (user_id, REKEY_MAX_PASSES))
+    return moved
+
+
+async def rebucket(user_id: str, buckets: int, wait: bool = True) -> dict:
+    """Cambia los buckets de ``user_id`` en tareas y archivo. Devuelve {"moved", "buckets"}."""
+    if not sharding.HIERARCHICAL:
+        raise RuntimeError("rebucket requires TASKS_PARTITION_KEY=hierarchical")
+    _, tasks_store = await storage.get_stores()
+    archive_store = await storage.get_archive_store()
+    shard_map = storage.shard_map
+
+    entry = await shard_map.get(user_id, fresh=True)
+    current, previous = entry.get("buckets", 1), entry.get("previousBuckets")
+    if previous and current != buckets:
+        raise RuntimeError(
+            "Rebucket of %s to %d buckets still in progress; finish it first" % (user_id, current)
+        )
+    if current == buckets and not previous:
+        return {"moved": 0, "buckets": buckets}
+
+    await shard_map.set(user_id, buckets, previous=previous or current)
+    if wait:
+        logger.info("Esperando %ss a que las instancias vean el mapa nuevo", sharding.SHARD_MAP_TTL_SECONDS)
+        await asyncio.sleep(sharding.SHARD_MAP_TTL_SECONDS)
+
+    moved = 0
+    for store in (tasks_store, archive_store):
+        moved += await _rebucket_store(store.raw, user_id, buckets)
+    await shard_map.set(user_id, buckets)
+    logger.info("Usuario %s en %d buckets (%d tareas movidas)", user_id, buckets, moved)
+    return {"moved": moved, "buckets": buckets}
+
+
+def _read_changes(source, continuation):
+    """Una página del change feed del origen (cliente síncrono). Devuelve (docs, continuation)."""
+    feed = source.query_items_change_feed(
+        is_start_from_beginning=continuation is None,
+        continuation=continuation,
+        max_item_count=REKEY_PAGE_SIZE,
+    )
+    documents = list(next(feed.by_page(), []))
+    return documents, source.client_connection.last_response_headers.get("etag") or continuation
+
+
+def migrated_copy(doc: dict) -> dict:
+    body = strip_system_properties(doc)
+    body.pop(sharding.BUCKET_FIELD, None)
+    body[MIGRATED_FIELD] = doc["_ts"]
+    return body
+
+
+async def copy_document(target_store, doc: dict) -> bool:
+    """Escribe ``doc`` del origen en el destino si es más nuevo. True si escribió."""
+    body = migrated_copy(doc)
+    try:
+        current = await target_store.read_item(item=body["id"], partition_key=body["userId"])
+    except exceptions.CosmosResourceNotFoundError:
+        current = None
+
+    try:
+        if current is None:
+            await target_store.create_item(body)
+            return True
+        migrated = current.get(MIGRATED_FIELD)
+        if migrated is None or migrated >= body[MIGRATED_FIELD]:
+            # Escrita por la app en el destino, o ya copiada en esta versión
+            return False
+        await target_store.upsert_item(
+            body, etag=current["_etag"], match_condition=MatchConditions.IfNotModified
+        )
+        return True
+    except (exceptions.CosmosResourceExistsError, exceptions.CosmosAccessConditionFailedError):
+        # La app escribió la tarea en el destino entre la lectura y la copia
+        return False
+
+
+def _load_state(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("continuation")
+
+
+def _save_state(path, continuation):
+    if not path:
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"continuation": continuation}, f)
+    os.replace(tmp, path)
+
+
+async def copy_container(source_name: str, target: str, state_path=None,
+                         follow: bool = False, poll_seconds: float = 5.0) -> dict:
+    """Copia el contenedor ``source_name`` en el store ``target`` (``tasks`` o ``archive``)."""
+    if storage.STORAGE_BACKEND != "cosmos":
+        raise RuntimeError("copy requires STORAGE_BACKEND=cosmos")
+    if target == "archive":
+        target_store = await storage.get_archive_store()
+    else:
+        _, target_store = await storage.get_stores()
+    database, _, _ = await asyncio.to_thread(db.get_containers)
+    source = database.get_container_client(source_name)
+
+    semaphore = asyncio.Semaphore(REKEY_CONCURRENCY)
+
+    async def bounded(doc):
+        async with semaphore:
+            return await copy_document(target_store, doc)
+
+    result = {"read": 0, "copied": 0}
+    continuation = _load_state(state_path)
+    while True:
+        documents, continuation = await asyncio.to_thread(_read_changes, source, continuation)
+        if documents:
+            copied = await asyncio.gather(*(bounded(doc) for doc in documents))
+            result["read"] += len(documents)
+            result["copied"] += sum(copied)
+            # Se guarda después de escribir: un corte repite la página, nunca la salta
+            _save_state(state_path, continuation)
+            logger.info("Copia %s -> %s: %s", source_name, target, result)
+            continue
+        _save_state(state_path, continuation)
+        if not follow:
+            return result
+        await asyncio.sleep(poll_seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-particionado de tareas")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rebucket_cmd = commands.add_parser("rebucket", help="cambia los buckets de un usuario")
+    rebucket_cmd.add_argument("--user", required=True)
+    rebucket_cmd.add_argument("--buckets", type=int, required=True)
+    rebucket_cmd.add_argument(
+        "--no-wait", action="store_true",
+        help="no espera a que venza el cache del mapa (sólo con una instancia o sin tráfico)",
+    )
+
+    copy_cmd = commands.add_parser("copy", help="copia un contenedor al de partition key nueva")
+    copy_cmd.add_argument("--source", required=True, help="nombre del contenedor de origen")
+    copy_cmd.add_argument("--target", choices=["tasks", "archive"], required=True)
+    copy_cmd.add_argument("--state", help="archivo donde guardar el continuation del feed")
+    copy_cmd.add_argument("--follow", action="store_true", help="sigue copiando los cambios")
+    copy_cmd.add_argument("--poll-seconds", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    try:
+        if args.command == "rebucket":
+            result = db.run(rebucket(args.user, args.buckets, wait=not args.no_wait))
+        else:
+            result = db.run(copy_container(
+                args.source, args.target, args.state, args.follow, args.poll_seconds
+            ))
+    except KeyboardInterrupt:
+        return 0
+    except Exception:
+        logger.exception("No fue posible completar el re-particionado")
+        return 1
+    logger.info("Resultado: %s", result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+"""
+Tolerancia a fallas de Cosmos DB: circuit breaker compartido y reintentos
+por operación con jitter.
+
+- ``CircuitBreaker``: tras ``COSMOS_BREAKER_FAILURES`` fallas seguidas de
+  disponibilidad (5xx, 408, errores de conexión) se abre y los requests
+  fallan al instante con ``CircuitOpenError`` (los handlers responden 503 con
+  ``Retry-After``). Mientras está abierto un único hilo de fondo prueba
+  Cosmos cada ``COSMOS_BREAKER_OPEN_SECONDS``; cuando responde, se cierra.
+- ``GuardedContainer``: envuelve un contenedor async y reintenta cada
+  operación con backoff exponencial con jitter. Los 429 esperan lo que indica
+  ``x-ms-retry-after-ms``; nunca se duerme más de ``COSMOS_OP_MAX_DELAY_SECONDS``
+  por intento.
+"""
+import asyncio
+import inspect
+import logging
+import os
+import random
+import threading
+import time
+
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+from azure.cosmos import exceptions
+
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURES = int(os.getenv("COSMOS_BREAKER_FAILURES", "5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("COSMOS_BREAKER_OPEN_SECONDS", "15"))
+OP_MAX_RETRIES = int(os.getenv("COSMOS_OP_MAX_RETRIES", "3"))
+OP_BASE_DELAY_SECONDS = float(os.getenv("COSMOS_OP_BASE_DELAY_SECONDS", "0.1"))
+OP_MAX_DELAY_SECONDS = float(os.getenv("COSMOS_OP_MAX_DELAY_SECONDS", "2"))
+
+RETRY_AFTER_MS_HEADER = "x-ms-retry-after-ms"
+# Códigos que indican que Cosmos no está disponible (cuentan para el breaker)
+OUTAGE_STATUS_CODES = {408, 500, 502, 503, 504}
+# Operaciones que se pueden repetir sin riesgo ante un 408/503 (las escrituras
+# sólo se reintentan ante 429/449, que garantizan que no se aplicaron)
+IDEMPOTENT_OPERATIONS = {"read_item", "read", "query_items", "read_all_items"}
+CONNECTION_ERRORS = (ServiceRequestError, ServiceResponseError, asyncio.TimeoutError, OSError)
+
+
+class CircuitOpenError(RuntimeError):
+    """Cosmos se considera caído; reintentar después de ``retry_after`` segundos."""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Cosmos DB circuit is open")
+        self.retry_after = retry_after
+
+
+def retry_after_headers(err) -> dict:
+    """Headers para un 503: ``Retry-After`` si el error viene del breaker."""
+    if isinstance(err, CircuitOpenError):
+        return {"Retry-After": str(max(1, int(round(err.retry_after))))}
+    return {}
+
+
+def is_outage(err) -> bool:
+    if isinstance(err, exceptions.CosmosHttpResponseError):
+        return err.status_code in OUTAGE_STATUS_CODES
+    return isinstance(err, CONNECTION_ERRORS)
+
+
+class CircuitBreaker:
+    """
+    Breaker compartido por todos los requests del worker (thread-safe).
+    ``probe`` es una función síncrona que lanza excepción si Cosmos no responde.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURES,
+                 open_seconds: float = BREAKER_OPEN_SECONDS, probe=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.probe = probe
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def check(self):
+        """Lanza CircuitOpenError si el circuito está abierto."""
+        opened_at = self._opened_at
+        if opened_at is None:
+            return
+        elapsed = time.monotonic() - opened_at
+        if self.probe is None and elapsed >= self.open_seconds:
+            # Sin sonda: deja pasar un request de prueba por ventana (half-open)
+            with self._lock:
+                if self._opened_at == opened_at:
+                    self._opened_at = time.monotonic()
+                    return
+        raise CircuitOpenError(max(1.0, self.open_seconds - elapsed))
+
+    def record_success(self):
+        if self._failures or self._opened_at is not None:
+            with self._lock:
+                self._failures = 0
+                if self._opened_at is not None:
+                    self._opened_at = None
+                    logger.info("Circuit breaker %s cerrado", self.name)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is not None or self._failures < self.failure_threshold:
+                return
+            self._opened_at = time.monotonic()
+            logger.error(
+                "Circuit breaker %s abierto tras %d fallas; requests fallan rápido por %.0fs",
+                self.name, self._failures, self.open_seconds,
+            )
+            if self.probe is not None and not self._probing:
+                self._probing = True
+                threading.Thread(
+                    target=self._probe_loop, name="breaker-probe-" + self.name, daemon=True
+                ).start()
+
+    def _probe_loop(self):
+        # Un solo hilo por breaker: los requests no reintentan mientras está abierto
+        try:
+            while self._opened_at is not None:
+                time.sleep(self.open_seconds)
+                try:
+                    self.probe()
+                except Exception as err:
+                    logger.warning("Sonda de %s falló: %s", self.name, err)
+                    with self._lock:
+                        if self._opened_at is not None:
+                            self._opened_at = time.monotonic()
+                    continue
+                self.record_success()
+        finally:
+            with self._lock:
+                self._probing = False
+
+    def reset(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+
+def retry_delay(err, attempt: int):
+    """
+    Segundos a esperar antes del reintento ``attempt`` (0, 1, ...), o None si
+    no conviene reintentar (p. ej. Cosmos pide esperar más que el máximo).
+    """
+    if isinstance(err, exceptions.CosmosHttpResponseError) and err.status_code == 429:
+        headers = getattr(err, "headers", None) or {}
+        try:
+            wait = float(headers.get(RETRY_AFTER_MS_HEADER)) / 1000.0
+        except (TypeError, ValueError):
+            wait = OP_BASE_DELAY_SECONDS * (2 ** attempt)
+        if wait > OP_MAX_DELAY_SECONDS:
+            return None
+        # Jitter chico para que los requests frenados juntos no vuelvan juntos
+        return wait + random.uniform(0, wait * 0.2 + 0.01)
+    # Full jitter: uniforme entre 0 y el backoff exponencial
+    return random.uniform(0, min(OP_MAX_DELAY_SECONDS, OP_BASE_DELAY_SECONDS * (2 ** attempt)))
+
+
+def _retryable(err, operation: str) -> bool:
+    if isinstance(err, exceptions.CosmosHttpResponseError):
+        if err.status_code in (429, 449):
+            return True
+        return operation in IDEMPOTENT_OPERATIONS and err.status_code in (408, 503)
+    return operation in IDEMPOTENT_OPERATIONS and isinstance(err, CONNECTION_ERRORS)
+
+
+def _record(breaker, err):
+    # Un 404/409/412 también prueba que Cosmos responde
+    if is_outage(err):
+        breaker.record_failure()
+    elif isinstance(err, exceptions.CosmosHttpResponseError):
+        breaker.record_success()
+
+
+class _GuardedIterator:
+    """Registra en el breaker el resultado de cada página/ítem de una consulta."""
+
+    def __init__(self, iterator, breaker):
+        self._iterator = iterator
+        self._breaker = breaker
+
+    @property
+    def continuation_token(self):
+        return self._iterator.continuation_token
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            item = await self._iterator.__anext__()
+        except StopAsyncIteration:
+            raise
+        except Exception as err:
+            _record(self._breaker, err)
+            raise
+        self._breaker.record_success()
+        return item
+
+
+class _GuardedPaged:
+    def __init__(self, paged, breaker):
+        self._paged = paged
+        self._breaker = breaker
+
+    def __aiter__(self):
+        return _GuardedIterator(self._paged.__aiter__(), self._breaker)
+
+    def by_page(self, continuation_token=None):
+        return _GuardedIterator(self._paged.by_page(continuation_token), self._breaker)
+
+
+class GuardedContainer:
+    """
+    Proxy de un contenedor async: corta con el breaker abierto, reintenta con
+    jitter y alimenta el breaker con el resultado de cada operación.
+    """
+
+    def __init__(self, container, breaker: CircuitBreaker):
+        self._container = container
+        self._breaker = breaker
+
+    @property
+    def id(self):
+        return self._container.id
+
+    def query_items(self, *args, **kwargs):
+        self._breaker.check()
+        return _GuardedPaged(self._container.query_items(*args, **kwargs), self._breaker)
+
+    def __getattr__(self, name):
+        attr = getattr(self._container, name)
+        if not inspect.iscoroutinefunction(attr):
+            return attr
+
+        async def _call(*args, **kwargs):
+            attempt = 0
+            while True:
+                self._breaker.check()
+                try:
+                    result = await attr(*args, **kwargs)
+                except Exception as err:
+                    delay = None
+                    if attempt < OP_MAX_RETRIES and _retryable(err, name):
+                        delay = retry_delay(err, attempt)
+                    if delay is None:
+                        _record(self._breaker, err)
+                        raise
+                    attempt += 1
+                    logger.info(
+                        "Reintento %d de %s en %.3fs (%s)",
+                        attempt, name, delay, getattr(err, "status_code", type(err).__name__),
+                    )
+                    await asyncio.sleep(delay)
+                    continue
+                self._breaker.record_success()
+                return result
+
+        return _call
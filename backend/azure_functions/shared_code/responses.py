@@ -0,0 +1,109 @@
+import gzip
+import json
+import logging
+import os
+
+import azure.functions as func
+
+from shared_code import metrics
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependencia opcional
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - dependencia opcional
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dependencia opcional
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPES = ("application/msgpack", "application/x-msgpack")
+
+# Cuerpos más chicos que esto no se comprimen (el overhead no compensa)
+COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "4"))
+
+
+def dumps(payload) -> bytes:
+    """Serializa a JSON con orjson si está instalado, si no con la stdlib."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode("utf-8")
+
+
+def _header_tokens(value):
+    """Tokens de un header tipo Accept, descartando los que tienen q=0."""
+    tokens = []
+    for part in (value or "").split(","):
+        pieces = [p.strip() for p in part.split(";")]
+        token = pieces[0].lower()
+        if not token:
+            continue
+        quality = 1.0
+        for param in pieces[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    pass
+        if quality > 0:
+            tokens.append(token)
+    return tokens
+
+
+def negotiate(req):
+    """Devuelve (mimetype, content_encoding) según Accept / Accept-Encoding."""
+    mimetype = JSON_MIMETYPE
+    if msgpack is not None:
+        accepted = _header_tokens(req.headers.get("Accept"))
+        if any(t in MSGPACK_MIMETYPES for t in accepted):
+            mimetype = MSGPACK_MIMETYPES[0]
+
+    encoding = None
+    accepted_encodings = _header_tokens(req.headers.get("Accept-Encoding"))
+    if brotli is not None and "br" in accepted_encodings:
+        encoding = "br"
+    elif "gzip" in accepted_encodings:
+        encoding = "gzip"
+    return mimetype, encoding
+
+
+def encode(req, payload):
+    """
+    Serializa y comprime ``payload`` según lo que acepta el cliente.
+    Devuelve (body, mimetype, headers) listos para un HttpResponse.
+    """
+    with metrics.phase("serialize"):
+        mimetype, encoding = negotiate(req)
+        if mimetype == JSON_MIMETYPE:
+            body = dumps(payload)
+        else:
+            body = msgpack.packb(payload, use_bin_type=True)
+
+        headers = {"Vary": "Accept, Accept-Encoding"}
+        if encoding and len(body) >= COMPRESSION_MIN_BYTES:
+            if encoding == "br":
+                body = brotli.compress(body, quality=BROTLI_QUALITY)
+            else:
+                # mtime=0 para que el mismo contenido dé los mismos bytes (ETag estable)
+                body = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+            headers["Content-Encoding"] = encoding
+    return body, mimetype, headers
+
+
+def render(req, payload, status_code: int = 200, headers=None) -> func.HttpResponse:
+    """HttpResponse con el payload negociado (JSON rápido / MessagePack, gzip / brotli)."""
+    body, mimetype, content_headers = encode(req, payload)
+    content_headers.update(headers or {})
+    return func.HttpResponse(
+        body, status_code=status_code, mimetype=mimetype, headers=content_headers
+    )
@@ -0,0 +1,196 @@
+"""
+Búsqueda de tareas por título con un índice invertido en memoria, por usuario.
+
+- Tokenización: minúsculas, sin acentos (``canción`` -> ``cancion``), palabras
+  alfanuméricas. Cada término de la consulta matchea por prefijo y todos
+  tienen que aparecer (AND).
+- El índice de un usuario se construye la primera vez que busca (una
+  consulta de sus tareas vivas) y los handlers de escritura lo actualizan en
+  el momento (``add_task`` / ``remove_task``).
+- Las escrituras atendidas por otras instancias llegan como delta: pasados
+  TASKS_SEARCH_REFRESH_SECONDS se piden sólo los cambios desde el último
+  ``_ts`` visto (la misma consulta que ``GET /tasks?since=``), lápidas incluidas.
+
+Los términos se guardan ordenados: un prefijo se resuelve con bisect, así que
+el costo de una búsqueda depende de los términos y resultados que toca, no de
+la cantidad de tareas.
+"""
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from shared_code import queries, tombstones
+
+logger = logging.getLogger(__name__)
+
+SEARCH_MAX_USERS = int(os.getenv("TASKS_SEARCH_MAX_USERS", "500"))
+# El índice es por instancia: cada cuánto se piden los cambios hechos por otras
+SEARCH_REFRESH_SECONDS = float(os.getenv("TASKS_SEARCH_REFRESH_SECONDS", "30"))
+MAX_QUERY_TERMS = 8
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text) -> list:
+    """Términos normalizados de ``text`` (sin repetir, en orden de aparición)."""
+    if not text:
+        return []
+    decomposed = unicodedata.normalize("NFKD", str(text).casefold())
+    plain = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return list(dict.fromkeys(_WORD.findall(plain)))
+
+
+class _UserIndex:
+    def __init__(self):
+        self.tasks = {}  # id -> tarea (tal como se devuelve)
+        self.postings = {}  # término -> set(ids)
+        self.terms = []  # términos ordenados (para prefijos)
+        self.cursor = 0  # mayor _ts visto desde el store
+        self.refreshed_at = 0.0
+
+    def add(self, task):
+        self.remove(task["id"])
+        self.tasks[task["id"]] = task
+        for term in tokenize(task.get("title")):
+            ids = self.postings.get(term)
+            if ids is None:
+                ids = self.postings[term] = set()
+                bisect.insort(self.terms, term)
+            ids.add(task["id"])
+
+    def remove(self, task_id):
+        task = self.tasks.pop(task_id, None)
+        if task is None:
+            return
+        for term in tokenize(task.get("title")):
+            ids = self.postings.get(term)
+            if ids is None:
+                continue
+            ids.discard(task_id)
+            if not ids:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+
+    def apply(self, docs):
+        """Aplica documentos del store (tareas o lápidas) y avanza el cursor."""
+        for doc in docs:
+            if tombstones.is_tombstone(doc):
+                self.remove(doc["id"])
+            else:
+                self.add(_searchable(doc))
+            self.cursor = max(self.cursor, doc.get("_ts") or 0)
+
+    def _prefix_postings(self, prefix):
+        """Listas de ids de los términos que empiezan con ``prefix``."""
+        postings = []
+        start = bisect.bisect_left(self.terms, prefix)
+        for term in self.terms[start:]:
+            if not term.startswith(prefix):
+                break
+            postings.append(self.postings[term])
+        return postings
+
+    def search(self, terms, limit):
+        candidates = sorted(
+            (self._prefix_postings(term) for term in terms),
+            key=lambda postings: sum(len(ids) for ids in postings),
+        )
+        # Se arranca por el término más selectivo y los demás sólo filtran:
+        # un término común ("tarea") no cuesta lo que mide su lista
+        matches = set().union(*candidates[0])
+        for postings in candidates[1:]:
+            if not matches:
+                break
+            matches = {i for i in matches if any(i in ids for ids in postings)}
+        tasks = [self.tasks[task_id] for task_id in matches]
+        tasks.sort(key=lambda t: (t.get("title") or "").casefold())
+        return tasks[:limit]
+
+
+def _searchable(doc):
+    return {k: doc[k] for k in ("id", "title", "status", "userId", "_etag") if k in doc}
+
+
+class TitleIndex:
+    """Índices por usuario, LRU acotado a ``max_users``."""
+
+    def __init__(self, max_users=SEARCH_MAX_USERS, refresh_seconds=SEARCH_REFRESH_SECONDS):
+        self.max_users = max_users
+        self.refresh_seconds = refresh_seconds
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, user_id):
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                self._users.move_to_end(user_id)
+            return index
+
+    def _put(self, user_id, index):
+        with self._lock:
+            self._users[user_id] = index
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    async def _build(self, tasks_store, user_id):
+        index = _UserIndex()
+        spec = queries.build_tasks_query(user_id, fields=["id", "title", "status", "userId", "_ts", "_etag"])
+        page = await tasks_store.query(user_id, **spec)
+        index.apply(page.items)
+        index.refreshed_at = time.monotonic()
+        self._put(user_id, index)
+        logger.info("Índice de búsqueda construido para %s (%d tareas)", user_id, len(index.tasks))
+        return index
+
+    async def _refresh(self, tasks_store, user_id, index):
+        if index.cursor and index.cursor < tombstones.oldest_valid_cursor():
+            # Las lápidas de antes del cursor pueden haber vencido: reconstruir
+            return await self._build(tasks_store, user_id)
+        page = await tasks_store.query(user_id, **queries.build_sync_query(user_id, index.cursor))
+        with self._lock:
+            index.apply(page.items)
+            index.refreshed_at = time.monotonic()
+        return index
+
+    async def search(self, tasks_store, user_id, text, limit):
+        terms = tokenize(text)[:MAX_QUERY_TERMS]
+        if not terms:
+            return []
+        index = self._get(user_id)
+        if index is None:
+            index = await self._build(tasks_store, user_id)
+        elif time.monotonic() - index.refreshed_at >= self.refresh_seconds:
+            index = await self._refresh(tasks_store, user_id, index)
+        with self._lock:
+            return [dict(task) for task in index.search(terms, limit)]
+
+    def add_task(self, user_id, task):
+        """Tarea creada/actualizada en esta instancia (sólo si el índice ya existe)."""
+        index = self._get(user_id)
+        if index is not None:
+            with self._lock:
+                index.add(_searchable(task))
+
+    def remove_task(self, user_id, task_id):
+        index = self._get(user_id)
+        if index is not None:
+            with self._lock:
+                index.remove(task_id)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+title_index = TitleIndex()
@@ -0,0 +1,29 @@
+# Propiedades de sistema que Cosmos agrega a cada documento
+SYSTEM_PROPERTIES = ("_rid", "_self", "_etag", "_attachments", "_ts")
+# Campos de tareas que sólo usa el backend (partition key jerárquica, ver
+# shared_code.sharding y shared_code.rekey)
+INTERNAL_FIELDS = ("bucket", "migratedTs")
+# Las tareas conservan ``_etag``: es el valor que el cliente manda en If-Match
+TASK_HIDDEN_FIELDS = tuple(p for p in SYSTEM_PROPERTIES if p != "_etag") + INTERNAL_FIELDS
+
+
+def strip_system_properties(doc: dict) -> dict:
+    """Copia del documento sin las propiedades de sistema de Cosmos."""
+    return {k: v for k, v in doc.items() if k not in SYSTEM_PROPERTIES}
+
+
+def shape_task(doc: dict, fields=None) -> dict:
+    """
+    Da forma a una tarea para la respuesta HTTP.
+    Con ``fields`` se devuelven sólo esos campos (ya proyectados en la query);
+    si no, se eliminan las propiedades de sistema (salvo ``_etag``) y los
+    campos internos.
+    """
+    if fields:
+        return {k: doc[k] for k in fields if k in doc}
+    return {k: v for k, v in doc.items() if k not in TASK_HIDDEN_FIELDS}
+
+
+def etag_header(doc: dict) -> dict:
+    """Header ``ETag`` de una respuesta de un solo documento."""
+    return {"ETag": doc["_etag"]} if doc.get("_etag") else {}
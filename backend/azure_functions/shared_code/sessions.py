@@ -0,0 +1,205 @@
+"""
+Tokens de acceso y sesiones con refresh token rotativo.
+
+``user_login`` devuelve un access token corto (JWT_ACCESS_TTL_SECONDS) y un
+refresh token largo (JWT_REFRESH_TTL_SECONDS). ``POST /user/refresh`` cambia el
+refresh token por un par nuevo sin bcrypt ni consultas: verifica la firma
+HS256 y hace un point read del documento de usuario.
+
+Las sesiones viven en el propio documento de usuario (``refreshTokens``, una
+entrada por dispositivo con el sha256 del ``jti`` vigente, nunca el token):
+
+- Rotación: cada refresh reemplaza el ``jti`` de la sesión; el anterior deja
+  de servir. Las escrituras van con ETag, así dos refresh simultáneos no se
+  pisan.
+- Reuso: presentar un ``jti`` ya rotado revoca la sesión completa (alguien
+  más tiene una copia), salvo dentro de REFRESH_REUSE_GRACE_SECONDS, que cubre
+  a dos pestañas refrescando a la vez.
+- Revocación: ``DELETE /user/refresh`` (logout) borra la sesión.
+"""
+import datetime
+import hashlib
+import logging
+import os
+import secrets
+import time
+
+import jwt
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+from jwt import InvalidTokenError
+
+from shared_code import users
+from shared_code.utils import get_jwt_secret
+
+logger = logging.getLogger(__name__)
+
+ACCESS_TOKEN_TTL_SECONDS = int(os.getenv("JWT_ACCESS_TTL_SECONDS", "3600"))
+REFRESH_TOKEN_TTL_SECONDS = int(os.getenv("JWT_REFRESH_TTL_SECONDS", str(30 * 24 * 3600)))
+# Sesiones (dispositivos) por usuario; al pasarse se descarta la más vieja
+MAX_SESSIONS = int(os.getenv("JWT_MAX_SESSIONS", "10"))
+REFRESH_REUSE_GRACE_SECONDS = int(os.getenv("JWT_REFRESH_REUSE_GRACE_SECONDS", "30"))
+
+SESSIONS_FIELD = "refreshTokens"
+REFRESH_TOKEN_TYPE = "refresh"
+# Reintentos ante 412 (otra escritura cambió el documento entre lectura y patch)
+_MAX_WRITE_ATTEMPTS = 3
+
+
+class SessionError(Exception):
+    """Refresh token inválido, vencido o revocado (se responde 401)."""
+
+
+class SessionConflictError(SessionError):
+    """El refresh token acaba de rotarse desde otro request (se responde 409)."""
+
+
+def _hash(jti: str) -> str:
+    return hashlib.sha256(jti.encode("utf-8")).hexdigest()
+
+
+def _encode(payload: dict) -> str:
+    token = jwt.encode(payload, get_jwt_secret(), algorithm="HS256")
+    if isinstance(token, bytes):
+        token = token.decode("utf-8")
+    return token
+
+
+def issue_access_token(sub: str, email: str) -> str:
+    return _encode({
+        "sub": sub,
+        "email": email,
+        "exp": datetime.datetime.utcnow() + datetime.timedelta(seconds=ACCESS_TOKEN_TTL_SECONDS),
+    })
+
+
+def _issue_refresh_token(sub: str, email: str, sid: str, jti: str, expires_at: int) -> str:
+    return _encode({
+        "typ": REFRESH_TOKEN_TYPE,
+        "sub": sub,
+        "email": email,
+        "sid": sid,
+        "jti": jti,
+        "exp": expires_at,
+    })
+
+
+def decode_refresh_token(token: str) -> dict:
+    """Verifica firma y vencimiento. Lanza SessionError si no es un refresh token válido."""
+    try:
+        claims = jwt.decode(
+            token or "",
+            get_jwt_secret(),
+            algorithms=["HS256"],
+            options={"require": ["exp", "sub", "email", "sid", "jti"]},
+        )
+    except InvalidTokenError as err:
+        raise SessionError(str(err))
+    if claims.get("typ") != REFRESH_TOKEN_TYPE:
+        raise SessionError("not a refresh token")
+    return claims
+
+
+def token_response(access_token: str, refresh_token=None) -> dict:
+    """Cuerpo de respuesta de login/refresh (``token`` se mantiene por compatibilidad)."""
+    body = {"token": access_token, "expiresIn": ACCESS_TOKEN_TTL_SECONDS}
+    if refresh_token:
+        body["refreshToken"] = refresh_token
+    return body
+
+
+async def _update_sessions(users_store, user_doc: dict, mutate):
+    """
+    Aplica ``mutate(sesiones) -> (sesiones, resultado)`` sobre el documento con
+    ETag y devuelve el resultado; ante un 412 relee y vuelve a intentar.
+    """
+    for attempt in range(_MAX_WRITE_ATTEMPTS):
+        now = int(time.time())
+        current = [s for s in user_doc.get(SESSIONS_FIELD) or [] if s.get("exp", 0) > now]
+        sessions, result = mutate(current, now)
+        try:
+            await users_store.patch_item(
+                item=user_doc["id"],
+                partition_key=user_doc["email"],
+                patch_operations=[{"op": "set", "path": "/" + SESSIONS_FIELD, "value": sessions}],
+                etag=user_doc.get("_etag"),
+                match_condition=MatchConditions.IfNotModified,
+            )
+            return result
+        except exceptions.CosmosAccessConditionFailedError:
+            if attempt + 1 == _MAX_WRITE_ATTEMPTS:
+                raise
+            user_doc = await users_store.read_item(item=user_doc["id"], partition_key=user_doc["email"])
+
+
+async def create_session(users_store, user_doc: dict) -> str:
+    """Abre una sesión nueva para ``user_doc`` y devuelve su refresh token."""
+    sid, jti = secrets.token_urlsafe(12), secrets.token_urlsafe(24)
+
+    def mutate(sessions, now):
+        entry = {"sid": sid, "hash": _hash(jti), "exp": now + REFRESH_TOKEN_TTL_SECONDS, "createdAt": now}
+        keep = max(0, MAX_SESSIONS - 1)
+        sessions = sorted(sessions, key=lambda s: s.get("createdAt", 0))
+        sessions = sessions[-keep:] if keep else []
+        return sessions + [entry], entry["exp"]
+
+    expires_at = await _update_sessions(users_store, user_doc, mutate)
+    return _issue_refresh_token(users.account_id(user_doc), user_doc["email"], sid, jti, expires_at)
+
+
+async def rotate(users_store, refresh_token: str):
+    """
+    Canjea un refresh token por (access token, refresh token nuevo).
+    Lanza SessionError si el token no sirve y SessionConflictError si se
+    acaba de rotar desde otro request.
+    """
+    claims = decode_refresh_token(refresh_token)
+    try:
+        user_doc = await users.read_account(users_store, claims["email"], claims["sub"])
+    except exceptions.CosmosResourceNotFoundError:
+        raise SessionError("user not found")
+    if users.account_id(user_doc) != claims["sub"]:
+        raise SessionError("subject mismatch")
+
+    presented = _hash(claims["jti"])
+    new_jti = secrets.token_urlsafe(24)
+
+    def mutate(sessions, now):
+        session = next((s for s in sessions if s["sid"] == claims["sid"]), None)
+        if session is None:
+            raise SessionError("session revoked or expired")
+        if session["hash"] != presented:
+            recently_rotated = now - session.get("rotatedAt", 0) <= REFRESH_REUSE_GRACE_SECONDS
+            if session.get("previousHash") == presented and recently_rotated:
+                raise SessionConflictError("refresh token already rotated")
+            # Token viejo reutilizado fuera de la ventana: se revoca la sesión
+            return [s for s in sessions if s is not session], None
+        rotated = dict(session, hash=_hash(new_jti), previousHash=presented, rotatedAt=now)
+        return [rotated if s is session else s for s in sessions], rotated
+
+    session = await _update_sessions(users_store, user_doc, mutate)
+    if session is None:
+        logger.warning(
+            "Reuso de refresh token para %s (sesión %s): sesión revocada", claims["email"], claims["sid"]
+        )
+        raise SessionError("refresh token reuse detected")
+
+    access_token = issue_access_token(claims["sub"], claims["email"])
+    new_refresh = _issue_refresh_token(claims["sub"], claims["email"], claims["sid"], new_jti, session["exp"])
+    return access_token, new_refresh
+
+
+async def revoke(users_store, refresh_token: str) -> bool:
+    """Cierra la sesión del refresh token. Devuelve False si ya no existía."""
+    claims = decode_refresh_token(refresh_token)
+    try:
+        user_doc = await users.read_account(users_store, claims["email"], claims["sub"])
+    except exceptions.CosmosResourceNotFoundError:
+        return False
+
+    def mutate(sessions, now):
+        remaining = [s for s in sessions if s["sid"] != claims["sid"]]
+        return remaining, len(remaining) != len(sessions)
+
+    return await _update_sessions(users_store, user_doc, mutate)
+
@@ -0,0 +1,323 @@
+"""
+Partition key jerárquica de tareas: ``/userId`` + ``/bucket``.
+
+Con ``/userId`` solo, todas las tareas de un usuario viven en una partición
+lógica: tope de 20 GB y de RU/s de una partición física, y todas sus
+escrituras caen en el mismo lugar. Con TASKS_PARTITION_KEY=hierarchical los
+contenedores de tareas y de archivo usan ``["/userId", "/bucket"]``
+(MultiHash) y cada tarea va al bucket ``bucket_of(id, buckets)``:
+
+- Un usuario normal tiene 1 bucket (``bucket`` = 0) y sigue en una sola
+  partición lógica. Cosmos mantiene juntas las claves con el mismo userId
+  hasta que no entran en una partición física, así que no paga nada extra.
+- A un usuario grande se le suben los buckets (``python -m shared_code.rekey
+  rebucket``). Cada bucket es una partición lógica propia, y las consultas por
+  userId son consultas por prefijo de la clave que Cosmos enruta sólo a las
+  particiones físicas de ese usuario.
+
+La cantidad de buckets de cada usuario vive en el contenedor de resúmenes
+(documento ``SHARD_MAP_ID`` en la partición del usuario) y cada instancia la
+cachea SHARD_MAP_TTL_SECONDS. Mientras se rebalancea, el mapa guarda también
+``previousBuckets`` y cada tarea puede estar en su bucket nuevo o en el
+viejo: las operaciones puntuales prueban los dos.
+
+:class:`ShardedStore` envuelve el store del contenedor con la interfaz de
+siempre (``partition_key`` = userId), así que los handlers no cambian. Única
+diferencia visible: un batch de un usuario con varios buckets se ejecuta como
+un transactional batch por bucket, atómico dentro de cada uno (si uno falla,
+las respuestas del error muestran qué buckets ya se escribieron).
+"""
+import copy
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from azure.cosmos import exceptions
+
+from shared_code.serializers import strip_system_properties
+
+logger = logging.getLogger(__name__)
+
+PARTITION_KEY_MODE = os.getenv("TASKS_PARTITION_KEY", "userId").strip().lower()
+HIERARCHICAL = PARTITION_KEY_MODE == "hierarchical"
+
+USER_FIELD = "userId"
+BUCKET_FIELD = "bucket"
+# Definición de la partition key de tareas y archivo según el modo
+PARTITION_FIELDS = [USER_FIELD, BUCKET_FIELD] if HIERARCHICAL else USER_FIELD
+PARTITION_PATHS = ["/" + USER_FIELD, "/" + BUCKET_FIELD] if HIERARCHICAL else "/" + USER_FIELD
+
+MAX_BUCKETS = int(os.getenv("TASKS_MAX_BUCKETS", "64"))
+SHARD_MAP_TTL_SECONDS = float(os.getenv("TASKS_SHARD_MAP_TTL_SECONDS", "60"))
+SHARD_MAP_MAX_USERS = int(os.getenv("TASKS_SHARD_MAP_MAX_USERS", "10000"))
+SHARD_MAP_ID = "taskBuckets"
+
+
+def bucket_of(task_id: str, buckets: int) -> int:
+    """Bucket estable de una tarea (no depende del proceso, a diferencia de hash())."""
+    if buckets <= 1:
+        return 0
+    digest = hashlib.sha1(task_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") % buckets
+
+
+def full_key(user_id: str, bucket: int) -> list:
+    return [user_id, bucket]
+
+
+class ShardMap:
+    """Buckets por usuario, leídos del store de resúmenes y cacheados por instancia."""
+
+    def __init__(self, get_store, ttl=SHARD_MAP_TTL_SECONDS, max_users=SHARD_MAP_MAX_USERS):
+        self._get_store = get_store
+        self.ttl = ttl
+        self.max_users = max_users
+        self._entries = OrderedDict()  # user_id -> (expires, entry)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _default(user_id):
+        return {"id": SHARD_MAP_ID, USER_FIELD: user_id, "buckets": 1}
+
+    async def get(self, user_id: str, fresh: bool = False) -> dict:
+        now = time.monotonic()
+        if not fresh:
+            with self._lock:
+                cached = self._entries.get(user_id)
+                if cached is not None and cached[0] > now:
+                    self._entries.move_to_end(user_id)
+                    return cached[1]
+
+        store = await self._get_store()
+        try:
+            entry = await store.read_item(item=SHARD_MAP_ID, partition_key=user_id)
+        except exceptions.CosmosResourceNotFoundError:
+            entry = self._default(user_id)
+        self._remember(user_id, entry)
+        return entry
+
+    async def set(self, user_id: str, buckets: int, previous: int = None) -> dict:
+        if not 1 <= buckets <= MAX_BUCKETS:
+            raise ValueError("buckets must be between 1 and %d" % MAX_BUCKETS)
+        entry = dict(self._default(user_id), buckets=buckets, updatedAt=int(time.time()))
+        if previous and previous != buckets:
+            entry["previousBuckets"] = previous
+        store = await self._get_store()
+        await store.upsert_item(entry)
+        self._remember(user_id, entry)
+        return entry
+
+    async def delete(self, user_id: str):
+        store = await self._get_store()
+        try:
+            await store.delete_item(item=SHARD_MAP_ID, partition_key=user_id)
+        except exceptions.CosmosResourceNotFoundError:
+            pass
+        self.invalidate(user_id)
+
+    def _remember(self, user_id, entry):
+        if self.max_users <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, entry)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+
+def _operation_id(kind, args):
+    """Id de la tarea que toca una operación de batch."""
+    if kind in ("create", "upsert"):
+        return args[0]["id"]
+    return args[0]
+
+
+def _with_bucket(body: dict, bucket: int) -> dict:
+    body = dict(body)
+    body[BUCKET_FIELD] = bucket
+    return body
+
+
+class ShardedStore:
+    """
+    Store de tareas sobre un contenedor con partition key ``[userId, bucket]``.
+    Recibe y devuelve lo mismo que los stores con ``/userId``: ``partition_key``
+    es el userId y el bucket se resuelve acá.
+    """
+
+    def __init__(self, store, shard_map: ShardMap):
+        self.raw = store
+        self.shard_map = shard_map
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    async def _buckets(self, user_id: str, task_id: str):
+        """(bucket actual, bucket anterior o None) donde puede estar la tarea."""
+        entry = await self.shard_map.get(user_id)
+        primary = bucket_of(task_id, entry.get("buckets", 1))
+        previous = entry.get("previousBuckets")
+        old = bucket_of(task_id, previous) if previous else None
+        return primary, (old if old != primary else None)
+
+    async def _on_bucket(self, user_id: str, task_id: str, operation):
+        """Aplica ``operation(bucket)`` donde esté la tarea (bucket nuevo, y si no, el viejo)."""
+        primary, old = await self._buckets(user_id, task_id)
+        try:
+            return await operation(primary)
+        except exceptions.CosmosResourceNotFoundError:
+            if old is None:
+                raise
+        try:
+            return await operation(old)
+        except exceptions.CosmosResourceNotFoundError:
+            # La mudanza pudo terminar entre los dos intentos
+            return await operation(primary)
+
+    async def locate(self, user_id: str, task_id: str) -> int:
+        """Bucket donde está la tarea, o donde se crearía si no existe."""
+        primary, old = await self._buckets(user_id, task_id)
+        if old is None:
+            return primary
+        for bucket in (primary, old):
+            try:
+                await self.raw.read_item(item=task_id, partition_key=full_key(user_id, bucket))
+                return bucket
+            except exceptions.CosmosResourceNotFoundError:
+                pass
+        return primary
+
+    async def read_item(self, item, partition_key, **kwargs):
+        return await self._on_bucket(
+            partition_key, item,
+            lambda bucket: self.raw.read_item(
+                item=item, partition_key=full_key(partition_key, bucket), **kwargs
+            ),
+        )
+
+    async def create_item(self, body, **kwargs):
+        user_id = body[USER_FIELD]
+        bucket = await self.locate(user_id, body["id"])
+        return await self.raw.create_item(_with_bucket(body, bucket), **kwargs)
+
+    async def upsert_item(self, body, **kwargs):
+        user_id = body[USER_FIELD]
+        bucket = await self.locate(user_id, body["id"])
+        return await self.raw.upsert_item(_with_bucket(body, bucket), **kwargs)
+
+    async def replace_item(self, item, body, **kwargs):
+        return await self._on_bucket(
+            body[USER_FIELD], item,
+            lambda bucket: self.raw.replace_item(
+                item=item, body=_with_bucket(body, bucket), **kwargs
+            ),
+        )
+
+    async def patch_item(self, item, partition_key, patch_operations, **kwargs):
+        return await self._on_bucket(
+            partition_key, item,
+            lambda bucket: self.raw.patch_item(
+                item=item, partition_key=full_key(partition_key, bucket),
+                patch_operations=patch_operations, **kwargs
+            ),
+        )
+
+    async def delete_item(self, item, partition_key, **kwargs):
+        return await self._on_bucket(
+            partition_key, item,
+            lambda bucket: self.raw.delete_item(
+                item=item, partition_key=full_key(partition_key, bucket), **kwargs
+            ),
+        )
+
+    async def query(self, partition_key, **kwargs):
+        """Consulta por prefijo ``[userId]``: abarca todos los buckets del usuario."""
+        prefix = None if partition_key is None else [partition_key]
+        page = await self.raw.query(prefix, **kwargs)
+        if partition_key is None:
+            return page
+        entry = await self.shard_map.get(partition_key)
+        if not entry.get("previousBuckets"):
+            return page
+        # Durante una mudanza una tarea puede verse un instante en los dos buckets:
+        # queda la versión más reciente (sin id en la proyección no hay cómo saberlo)
+        items, positions = [], {}
+        for item in page.items:
+            task_id = item.get("id")
+            if task_id is None:
+                items.append(item)
+            elif task_id not in positions:
+                positions[task_id] = len(items)
+                items.append(item)
+            elif item.get("_ts", 0) >= items[positions[task_id]].get("_ts", 0):
+                items[positions[task_id]] = item
+        return page._replace(items=items)
+
+    async def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        """
+        Un transactional batch por bucket, en orden; los resultados vuelven en el
+        orden original. Si falla un bucket, los anteriores ya quedaron escritos:
+        el error lleva sus respuestas reales y 424 sólo en el bucket que falló
+        y en los que no llegaron a ejecutarse.
+        """
+        groups = OrderedDict()
+        for index, (kind, args, *rest) in enumerate(batch_operations):
+            bucket = await self.locate(partition_key, _operation_id(kind, args))
+            if kind in ("create", "upsert"):
+                args = (_with_bucket(args[0], bucket),) + tuple(args[1:])
+            elif kind == "replace":
+                args = (args[0], _with_bucket(args[1], bucket)) + tuple(args[2:])
+            groups.setdefault(bucket, []).append((index, (kind, args, *rest)))
+
+        results = [None] * len(batch_operations)
+        for bucket, operations in groups.items():
+            try:
+                group_results = await self.raw.execute_item_batch(
+                    batch_operations=[operation for _, operation in operations],
+                    partition_key=full_key(partition_key, bucket),
+                    **kwargs
+                )
+            except exceptions.CosmosBatchOperationError as err:
+                responses = [
+                    result if result is not None else {"statusCode": 424} for result in results
+                ]
+                for position, (index, _) in enumerate(operations):
+                    if position < len(err.operation_responses or ()):
+                        responses[index] = err.operation_responses[position]
+                raise exceptions.CosmosBatchOperationError(
+                    error_index=operations[err.error_index][0],
+                    headers=err.headers,
+                    status_code=err.status_code,
+                    message=err.message,
+                    operation_responses=responses,
+                )
+            for (index, _), result in zip(operations, group_results):
+                results[index] = result
+        return results
+
+    async def delete_all_items_by_partition_key(self, partition_key, **kwargs):
+        """Borrado por partition key de cada bucket del usuario (los actuales y los anteriores)."""
+        delete_partition = getattr(self.raw, "delete_all_items_by_partition_key", None)
+        if delete_partition is None:
+            raise exceptions.CosmosHttpResponseError(
+                status_code=501, message="Partition key delete not supported by this store"
+            )
+        entry = await self.shard_map.get(partition_key, fresh=True)
+        buckets = max(entry.get("buckets", 1), entry.get("previousBuckets") or 0)
+        for bucket in range(buckets):
+            await delete_partition(full_key(partition_key, bucket), **kwargs)
+
+
+def copy_for_bucket(doc: dict, bucket: int) -> dict:
+    """Copia de una tarea sin propiedades de sistema, lista para escribirla en ``bucket``."""
+    return _with_bucket(copy.deepcopy(strip_system_properties(doc)), bucket)
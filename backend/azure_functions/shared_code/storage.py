@@ -0,0 +1,720 @@
+"""
+Capa de almacenamiento de documentos particionados (usuarios y tareas).
+
+Cada contenedor se expone como un "store" con la misma interfaz que usan los
+handlers, independiente del backend:
+
+- Operaciones puntuales con la firma de los contenedores de azure.cosmos.aio:
+  ``read_item``, ``create_item``, ``upsert_item``, ``delete_item``,
+  ``patch_item`` y ``execute_item_batch`` (mismas excepciones de
+  ``azure.cosmos.exceptions``).
+- ``query(partition_key, where=..., order_by=..., fields=..., limit=...,
+  continuation=...)``: consulta dentro de una partición con filtros
+  estructurados, devuelve un ``Page``. Con ``partition_key=None`` recorre
+  todas las particiones (sólo procesos de mantenimiento, p. ej. el archivado).
+
+STORAGE_BACKEND elige la implementación:
+
+- ``cosmos`` (por defecto): Cosmos DB vía shared_code.db.
+- ``memory``: diccionarios en memoria del proceso (benchmarks de CPU).
+- ``sqlite``: un archivo SQLite (STORAGE_SQLITE_PATH), para pruebas offline.
+"""
+import copy
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+from azure.cosmos import exceptions
+
+from shared_code import db, indexing, metrics, sharding
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "cosmos").strip().lower()
+SQLITE_PATH = os.getenv("STORAGE_SQLITE_PATH", "todoapp.sqlite3")
+
+# Definición lógica de los contenedores (partition key y unique keys)
+# partition_key: campo, o lista de campos si es jerárquica (ver shared_code.sharding)
+# default_ttl: None = sin TTL; -1 = TTL por documento (campo ``ttl``)
+USERS_DEFINITION = {"id": db.USER_CONTAINER, "partition_key": "email", "unique_keys": ["email"]}
+TASKS_DEFINITION = {
+    "id": db.TASK_CONTAINER, "partition_key": sharding.PARTITION_FIELDS, "unique_keys": [],
+    "default_ttl": -1,
+}
+STATS_DEFINITION = {"id": db.STATS_CONTAINER, "partition_key": "userId", "unique_keys": []}
+ARCHIVE_DEFINITION = {
+    "id": db.ARCHIVE_CONTAINER, "partition_key": sharding.PARTITION_FIELDS, "unique_keys": [],
+}
+
+Page = namedtuple("Page", ["items", "continuation_token"])
+
+# Operadores soportados en ``where``: (campo, operador, valor)
+# ``undefined`` ignora el valor: el campo no existe en el documento
+OPERATORS = {"=", "!=", "<", "<=", ">", ">=", "istartswith", "undefined"}
+
+
+def _not_found(item_id):
+    return exceptions.CosmosResourceNotFoundError(
+        status_code=404, message="Entity with the specified id does not exist: %s" % item_id
+    )
+
+
+def _conflict(item_id):
+    return exceptions.CosmosResourceExistsError(
+        status_code=409, message="Entity with the specified id already exists: %s" % item_id
+    )
+
+
+def _precondition_failed(item_id):
+    return exceptions.CosmosAccessConditionFailedError(
+        status_code=412, message="Precondition failed for %s" % item_id
+    )
+
+
+def _bad_request(message):
+    return exceptions.CosmosHttpResponseError(status_code=400, message=message)
+
+
+def _check_where(where):
+    for _, op, _ in where or ():
+        if op not in OPERATORS:
+            raise ValueError("Unsupported operator: %s" % op)
+
+
+# --- Cosmos ---------------------------------------------------------------
+
+
+def build_sql(where=None, order_by=None, fields=None,
+              composite_indexes=indexing.TASKS_COMPOSITE_INDEXES):
+    """
+    Traduce los filtros estructurados a SQL de Cosmos. Devuelve (query, parameters).
+    El ORDER BY se alinea con ``composite_indexes`` (ver shared_code.indexing);
+    con una lista vacía queda el ORDER BY de un solo campo.
+    """
+    _check_where(where)
+    clauses = []
+    params = []
+    for index, (field, op, value) in enumerate(where or ()):
+        name = "@p%d" % index
+        if op == "undefined":
+            clauses.append("NOT IS_DEFINED(c.%s)" % field)
+            continue
+        if op == "istartswith":
+            # Tercer argumento = comparación case-insensitive
+            clauses.append("STARTSWITH(c.%s, %s, true)" % (field, name))
+        else:
+            clauses.append("c.%s %s %s" % (field, op, name))
+        params.append({"name": name, "value": value})
+
+    projection = ", ".join("c.%s" % f for f in fields) if fields else "*"
+    query = "SELECT %s FROM c" % projection
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    if order_by:
+        terms = indexing.composite_order_by(where, order_by, composite_indexes)
+        query += " ORDER BY " + ", ".join("c.%s %s" % term for term in terms)
+    return query, params
+
+
+class CosmosStore:
+    """Store sobre un contenedor de Cosmos (aio o SyncContainerAdapter)."""
+
+    def __init__(self, container):
+        self._container = container
+
+    def __getattr__(self, name):
+        # read_item, create_item, upsert_item, delete_item, patch_item, execute_item_batch...
+        return getattr(self._container, name)
+
+    async def query(self, partition_key, where=None, order_by=None, fields=None,
+                    limit=None, continuation=None):
+        query, params = build_sql(where, order_by, fields)
+        if limit is None and continuation is None:
+            items = await db.collect(
+                self._container.query_items(
+                    query=query, parameters=params, partition_key=partition_key
+                )
+            )
+            return Page(items, None)
+
+        pager = self._container.query_items(
+            query=query,
+            parameters=params,
+            partition_key=partition_key,
+            max_item_count=limit,
+        ).by_page(continuation)
+        try:
+            items = await db.collect(await pager.__anext__())
+        except StopAsyncIteration:
+            items = []
+        return Page(items, pager.continuation_token)
+
+
+# --- Backends locales -----------------------------------------------------
+
+
+def _matches(doc, where):
+    for field, op, value in where or ():
+        current = doc.get(field)
+        if op == "undefined":
+            if field in doc:
+                return False
+            continue
+        if op == "istartswith":
+            if not isinstance(current, str) or not current.lower().startswith(str(value).lower()):
+                return False
+            continue
+        if current is None:
+            return False
+        try:
+            if op == "=" and not current == value:
+                return False
+            if op == "!=" and not current != value:
+                return False
+            if op == "<" and not current < value:
+                return False
+            if op == "<=" and not current <= value:
+                return False
+            if op == ">" and not current > value:
+                return False
+            if op == ">=" and not current >= value:
+                return False
+        except TypeError:
+            return False
+    return True
+
+
+def _sort_key(field):
+    # Cosmos ordena los indefinidos primero; aquí igual (None antes que cualquier valor)
+    return lambda doc: (doc.get(field) is not None, doc.get(field))
+
+
+def _project(doc, fields):
+    if not fields:
+        return doc
+    return {f: doc[f] for f in fields if f in doc}
+
+
+def _apply_patch(doc, patch_operations):
+    for operation in patch_operations:
+        op = operation["op"]
+        parts = [p for p in operation["path"].split("/") if p]
+        target = doc
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        key = parts[-1]
+        if op in ("set", "add", "replace"):
+            if op == "replace" and key not in target:
+                raise _bad_request("Path %s does not exist" % operation["path"])
+            target[key] = operation["value"]
+        elif op == "remove":
+            if key not in target:
+                raise _bad_request("Path %s does not exist" % operation["path"])
+            del target[key]
+        elif op == "incr":
+            target[key] = target.get(key, 0) + operation["value"]
+        else:
+            raise _bad_request("Unsupported patch operation: %s" % op)
+
+
+_PREDICATE_CONDITION = re.compile(r"^(NOT\s+)?IS_DEFINED\(c\.(\w+)\)$", re.IGNORECASE)
+_PREDICATE_EQUALS = re.compile(r"^c\.(\w+)\s*=\s*(?:'([^']*)'|(-?\d+))$")
+
+
+def _check_predicate(doc, filter_predicate):
+    """
+    Evalúa el ``filter_predicate`` de un patch. Sólo se emula lo que usa la
+    app: ``FROM c WHERE [NOT] IS_DEFINED(c.campo) [AND c.campo = 'texto' | número ...]``.
+    """
+    if not filter_predicate:
+        return
+    match = re.match(r"^\s*FROM\s+c\s+WHERE\s+(.+?)\s*$", filter_predicate, re.IGNORECASE)
+    if not match:
+        raise ValueError("Unsupported filter_predicate: %s" % filter_predicate)
+    for condition in re.split(r"\s+AND\s+", match.group(1), flags=re.IGNORECASE):
+        equals = _PREDICATE_EQUALS.match(condition.strip())
+        if equals:
+            field, text, number = equals.groups()
+            if doc.get(field) != (text if number is None else int(number)):
+                raise _precondition_failed(doc["id"])
+            continue
+        parsed = _PREDICATE_CONDITION.match(condition.strip())
+        if not parsed:
+            raise ValueError("Unsupported filter_predicate: %s" % filter_predicate)
+        negated, field = parsed.groups()
+        if (field in doc) == bool(negated):
+            raise _precondition_failed(doc["id"])
+
+
+def _paginate(docs, limit, continuation):
+    try:
+        offset = int(continuation) if continuation else 0
+    except ValueError:
+        raise _bad_request("Invalid continuation token")
+    if limit is None:
+        return Page(docs[offset:], None)
+    end = offset + limit
+    return Page(docs[offset:end], str(end) if end < len(docs) else None)
+
+
+class _LocalStore:
+    """
+    Base de los backends locales: implementa la semántica de Cosmos (etag, _ts,
+    TTL, unique keys, patch y batch transaccional) sobre ``_load``/``_save``/``_remove``.
+    Las subclases sólo persisten documentos; todo se serializa con un lock.
+    Los documentos devueltos por ``_load*`` no se modifican: lo que sale hacia
+    el caller es siempre una copia.
+    """
+
+    def __init__(self, definition):
+        self.id = definition["id"]
+        self.partition_key = definition["partition_key"]
+        # Lista de campos = partition key jerárquica (ver shared_code.sharding)
+        self.hierarchical = not isinstance(self.partition_key, str)
+        self.unique_keys = definition["unique_keys"]
+        self.default_ttl = definition.get("default_ttl")
+        self._lock = threading.RLock()
+
+    # Persistencia (subclases)
+    def _load(self, pk, item_id):
+        raise NotImplementedError
+
+    def _load_partition(self, pk, prefix=False):
+        raise NotImplementedError
+
+    def _save(self, pk, doc):
+        raise NotImplementedError
+
+    def _remove(self, pk, item_id):
+        raise NotImplementedError
+
+    def _transaction(self):
+        raise NotImplementedError
+
+    # Semántica común
+    def _key(self, pk):
+        """
+        Valor de partition key -> clave de almacenamiento. Las jerárquicas se
+        guardan como JSON; un prefijo (menos valores que campos) devuelve el
+        comienzo común de las claves que abarca.
+        """
+        if not self.hierarchical or pk is None:
+            return pk
+        values = list(pk) if isinstance(pk, (list, tuple)) else [pk]
+        encoded = json.dumps(values, separators=(",", ":"))
+        if len(values) < len(self.partition_key):
+            return encoded[:-1] + ","
+        return encoded
+
+    def _is_prefix(self, pk):
+        if not self.hierarchical or pk is None:
+            return False
+        values = pk if isinstance(pk, (list, tuple)) else [pk]
+        return len(values) < len(self.partition_key)
+
+    def _pk_of(self, doc):
+        if self.hierarchical:
+            return self._key([doc.get(field) for field in self.partition_key])
+        return doc.get(self.partition_key)
+
+    def _stamp(self, doc):
+        doc["_etag"] = '"%s"' % uuid.uuid4()
+        doc["_ts"] = int(time.time())
+        return doc
+
+    def _expired(self, doc):
+        """TTL como en Cosmos: el documento vencido deja de existir para lecturas."""
+        if self.default_ttl is None:
+            return False
+        ttl = doc.get("ttl", self.default_ttl)
+        if ttl is None or ttl == -1:
+            return False
+        return doc["_ts"] + ttl <= time.time()
+
+    def _load_live(self, pk, item_id):
+        doc = self._load(pk, item_id)
+        return None if doc is None or self._expired(doc) else doc
+
+    def _live_partition(self, pk, prefix=False):
+        return [d for d in self._load_partition(pk, prefix) if not self._expired(d)]
+
+    def _check_unique(self, pk, doc):
+        for key in self.unique_keys:
+            for other in self._live_partition(pk):
+                if other["id"] != doc["id"] and other.get(key) == doc.get(key):
+                    raise _conflict(doc["id"])
+
+    def _check_etag(self, current, etag, match_condition):
+        if etag and match_condition is not None and current.get("_etag") != etag:
+            raise _precondition_failed(current["id"])
+
+    def _read(self, item_id, pk):
+        doc = self._load_live(pk, item_id)
+        if doc is None:
+            raise _not_found(item_id)
+        return doc
+
+    def _create(self, body):
+        doc = self._stamp(copy.deepcopy(body))
+        pk = self._pk_of(doc)
+        if self._load_live(pk, doc["id"]) is not None:
+            raise _conflict(doc["id"])
+        self._check_unique(pk, doc)
+        self._save(pk, doc)
+        return doc
+
+    def _upsert(self, body, etag=None, match_condition=None):
+        doc = self._stamp(copy.deepcopy(body))
+        pk = self._pk_of(doc)
+        current = self._load_live(pk, doc["id"])
+        if current is not None:
+            self._check_etag(current, etag, match_condition)
+        self._check_unique(pk, doc)
+        self._save(pk, doc)
+        return doc
+
+    def _replace(self, item_id, body, etag=None, match_condition=None):
+        pk = self._pk_of(body)
+        current = self._read(item_id, pk)
+        self._check_etag(current, etag, match_condition)
+        return self._upsert(body)
+
+    def _patch(self, item_id, pk, patch_operations, etag=None, match_condition=None,
+               filter_predicate=None):
+        doc = copy.deepcopy(self._read(item_id, pk))
+        self._check_etag(doc, etag, match_condition)
+        _check_predicate(doc, filter_predicate)
+        _apply_patch(doc, patch_operations)
+        self._stamp(doc)
+        self._save(pk, doc)
+        return doc
+
+    def _delete(self, item_id, pk, etag=None, match_condition=None):
+        current = self._read(item_id, pk)
+        self._check_etag(current, etag, match_condition)
+        self._remove(pk, item_id)
+
+    def _query(self, pk, where, order_by, fields, limit, continuation, prefix=False):
+        _check_where(where)
+        docs = [d for d in self._live_partition(pk, prefix) if _matches(d, where)]
+        if order_by:
+            field, direction = order_by
+            docs.sort(key=_sort_key(field), reverse=direction == "DESC")
+        page = _paginate(docs, limit, continuation)
+        return Page([dict(_project(d, fields)) for d in page.items], page.continuation_token)
+
+    # Interfaz pública (async, misma firma que azure.cosmos.aio)
+    async def read_item(self, item, partition_key, **kwargs):
+        with self._lock:
+            return copy.deepcopy(self._read(item, self._key(partition_key)))
+
+    async def create_item(self, body, **kwargs):
+        with self._lock, self._transaction():
+            return copy.deepcopy(self._create(body))
+
+    async def upsert_item(self, body, etag=None, match_condition=None, **kwargs):
+        with self._lock, self._transaction():
+            return copy.deepcopy(self._upsert(body, etag, match_condition))
+
+    async def replace_item(self, item, body, etag=None, match_condition=None, **kwargs):
+        with self._lock, self._transaction():
+            return copy.deepcopy(self._replace(item, body, etag, match_condition))
+
+    async def patch_item(self, item, partition_key, patch_operations,
+                         etag=None, match_condition=None, filter_predicate=None, **kwargs):
+        with self._lock, self._transaction():
+            return copy.deepcopy(
+                self._patch(
+                    item, self._key(partition_key), patch_operations, etag, match_condition,
+                    filter_predicate,
+                )
+            )
+
+    async def delete_item(self, item, partition_key, etag=None, match_condition=None, **kwargs):
+        with self._lock, self._transaction():
+            self._delete(item, self._key(partition_key), etag, match_condition)
+
+    async def query(self, partition_key, where=None, order_by=None, fields=None,
+                    limit=None, continuation=None, **kwargs):
+        with self._lock:
+            return self._query(
+                self._key(partition_key), where, order_by, fields, limit, continuation,
+                prefix=self._is_prefix(partition_key),
+            )
+
+    async def execute_item_batch(self, batch_operations, partition_key, **kwargs):
+        """Batch transaccional: si una operación falla no se aplica ninguna."""
+        with self._lock:
+            results = []
+            try:
+                with self._transaction():
+                    pk = self._key(partition_key)
+                    for kind, args, *rest in batch_operations:
+                        options = rest[0] if rest else {}
+                        results.append(self._batch_op(kind, args, options, pk))
+            except exceptions.CosmosHttpResponseError as err:
+                failed = len(results)
+                responses = [{"statusCode": 424} for _ in batch_operations]
+                responses[failed] = {"statusCode": err.status_code}
+                raise exceptions.CosmosBatchOperationError(
+                    error_index=failed,
+                    headers={},
+                    status_code=err.status_code,
+                    message="Batch operation %s failed: %s" % (failed, err.message),
+                    operation_responses=responses,
+                )
+            return copy.deepcopy(results)
+
+    def _batch_op(self, kind, args, options, pk):
+        if kind == "create":
+            return {"statusCode": 201, "resourceBody": self._create(args[0])}
+        if kind == "upsert":
+            return {"statusCode": 200, "resourceBody": self._upsert(args[0])}
+        if kind == "replace":
+            return {"statusCode": 200, "resourceBody": self._replace(args[0], args[1], **options)}
+        if kind == "patch":
+            return {"statusCode": 200, "resourceBody": self._patch(args[0], pk, args[1], **options)}
+        if kind == "read":
+            return {"statusCode": 200, "resourceBody": self._read(args[0], pk)}
+        if kind == "delete":
+            self._delete(args[0], pk)
+            return {"statusCode": 204}
+        raise _bad_request("Unsupported batch operation: %s" % kind)
+
+
+class _NullTransaction:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class MemoryStore(_LocalStore):
+    """Documentos en un dict por partición; vive lo que vive el proceso."""
+
+    def __init__(self, definition):
+        super().__init__(definition)
+        self._partitions = {}
+        self._journal = None
+
+    def _load(self, pk, item_id):
+        return self._partitions.get(pk, {}).get(item_id)
+
+    def _load_partition(self, pk, prefix=False):
+        if pk is None or prefix:
+            return [
+                doc for key, docs in self._partitions.items()
+                if pk is None or key.startswith(pk)
+                for doc in docs.values()
+            ]
+        return list(self._partitions.get(pk, {}).values())
+
+    def _save(self, pk, doc):
+        self._remember(pk)
+        self._partitions.setdefault(pk, {})[doc["id"]] = copy.deepcopy(doc)
+
+    def _remove(self, pk, item_id):
+        self._remember(pk)
+        self._partitions.get(pk, {}).pop(item_id, None)
+
+    def _remember(self, pk):
+        # Copia de la partición antes del primer cambio, para poder deshacer
+        if self._journal is not None and pk not in self._journal:
+            self._journal[pk] = dict(self._partitions.get(pk, {}))
+
+    def _transaction(self):
+        store = self
+
+        class _Transaction:
+            def __enter__(self):
+                store._journal = {}
+                return self
+
+            def __exit__(self, exc_type, *exc):
+                journal, store._journal = store._journal, None
+                if exc_type is not None:
+                    for pk, docs in journal.items():
+                        store._partitions[pk] = docs
+                return False
+
+        if self._journal is not None:
+            return _NullTransaction()
+        return _Transaction()
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+
+
+class SqliteStore(_LocalStore):
+    """Una tabla por contenedor; el documento se guarda como JSON."""
+
+    def __init__(self, definition, connection):
+        super().__init__(definition)
+        self._conn = connection
+        self._table = "docs_" + "".join(ch if ch.isalnum() else "_" for ch in self.id)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS %s (pk TEXT NOT NULL, id TEXT NOT NULL, "
+            "body TEXT NOT NULL, PRIMARY KEY (pk, id))" % self._table
+        )
+        self._conn.commit()
+        self._in_transaction = False
+
+    def _load(self, pk, item_id):
+        row = self._conn.execute(
+            "SELECT body FROM %s WHERE pk=? AND id=?" % self._table, (pk, item_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _load_partition(self, pk, prefix=False):
+        if pk is None:
+            rows = self._conn.execute("SELECT body FROM %s" % self._table).fetchall()
+        elif prefix:
+            rows = self._conn.execute(
+                "SELECT body FROM %s WHERE substr(pk, 1, ?) = ?" % self._table, (len(pk), pk)
+            ).fetchall()
+        else:
+            rows = self._conn.execute(
+                "SELECT body FROM %s WHERE pk=?" % self._table, (pk,)
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def _save(self, pk, doc):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO %s (pk, id, body) VALUES (?, ?, ?)" % self._table,
+            (pk, doc["id"], json.dumps(doc)),
+        )
+
+    def _remove(self, pk, item_id):
+        self._conn.execute("DELETE FROM %s WHERE pk=? AND id=?" % self._table, (pk, item_id))
+
+    def _transaction(self):
+        store = self
+
+        class _Transaction:
+            def __enter__(self):
+                store._in_transaction = True
+                return self
+
+            def __exit__(self, exc_type, *exc):
+                store._in_transaction = False
+                if exc_type is None:
+                    store._conn.commit()
+                else:
+                    store._conn.rollback()
+                return False
+
+        if self._in_transaction:
+            return _NullTransaction()
+        return _Transaction()
+
+
+# --- Selección de backend -------------------------------------------------
+
+_stores = None
+_stats_store = None
+_archive_store = None
+_stores_lock = threading.Lock()
+
+
+_LOCAL_DEFINITIONS = (USERS_DEFINITION, TASKS_DEFINITION, STATS_DEFINITION, ARCHIVE_DEFINITION)
+
+
+def _build_local_stores():
+    if STORAGE_BACKEND == "memory":
+        stores = [MemoryStore(d) for d in _LOCAL_DEFINITIONS]
+    elif STORAGE_BACKEND == "sqlite":
+        connection = sqlite3.connect(SQLITE_PATH, check_same_thread=False)
+        stores = [SqliteStore(d, connection) for d in _LOCAL_DEFINITIONS]
+    else:
+        raise RuntimeError("Unknown STORAGE_BACKEND: %s" % STORAGE_BACKEND)
+    logger.info("Usando almacenamiento local: %s", STORAGE_BACKEND)
+    return tuple(metrics.InstrumentedContainer(s, phase_name="storage") for s in stores)
+
+
+def _ensure_local_stores():
+    global _stores, _stats_store, _archive_store
+    with _stores_lock:
+        if _stores is None:
+            users, tasks, stats, archive = _build_local_stores()
+            if sharding.HIERARCHICAL:
+                tasks = sharding.ShardedStore(tasks, shard_map)
+                archive = sharding.ShardedStore(archive, shard_map)
+            _stores, _stats_store, _archive_store = (users, tasks), stats, archive
+
+
+async def get_stores():
+    """
+    Devuelve (users_store, tasks_store) del backend configurado.
+    Con Cosmos caído (breaker abierto) lanza resilience.CircuitOpenError.
+    """
+    global _stores
+    if STORAGE_BACKEND == "cosmos":
+        db.breaker.check()
+    if _stores is not None:
+        return _stores
+
+    if STORAGE_BACKEND == "cosmos":
+        _, users, tasks = await db.get_containers_async()
+        tasks_store = CosmosStore(tasks)
+        if sharding.HIERARCHICAL:
+            tasks_store = sharding.ShardedStore(tasks_store, shard_map)
+        _stores = (CosmosStore(users), tasks_store)
+        return _stores
+
+    _ensure_local_stores()
+    return _stores
+
+
+async def get_stats_store():
+    """Store de los resúmenes de tareas por usuario (ver shared_code.task_stats)."""
+    global _stats_store
+    if STORAGE_BACKEND == "cosmos":
+        db.breaker.check()
+    if _stats_store is not None:
+        return _stats_store
+
+    if STORAGE_BACKEND == "cosmos":
+        _stats_store = CosmosStore(await db.get_container_async(db.STATS_CONTAINER))
+        return _stats_store
+
+    _ensure_local_stores()
+    return _stats_store
+
+
+# Buckets por usuario de los contenedores jerárquicos (documentos en taskStats)
+shard_map = sharding.ShardMap(get_stats_store)
+
+
+async def get_archive_store():
+    """Store de las tareas archivadas (ver shared_code.archive)."""
+    global _archive_store
+    if STORAGE_BACKEND == "cosmos":
+        db.breaker.check()
+    if _archive_store is not None:
+        return _archive_store
+
+    if STORAGE_BACKEND == "cosmos":
+        archive_store = CosmosStore(await db.get_container_async(db.ARCHIVE_CONTAINER))
+        if sharding.HIERARCHICAL:
+            archive_store = sharding.ShardedStore(archive_store, shard_map)
+        _archive_store = archive_store
+        return _archive_store
+
+    _ensure_local_stores()
+    return _archive_store
+
+
+def reset_stores():
+    """Descarta los stores creados (útil en benchmarks al cambiar de backend)."""
+    global _stores, _stats_store, _archive_store
+    with _stores_lock:
+        _stores = _stats_store = _archive_store = None
+    shard_map.invalidate()
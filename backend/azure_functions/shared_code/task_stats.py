@@ -0,0 +1,305 @@
+"""
+Resumen precalculado de tareas por usuario (conteo por status y última
+modificación), guardado en STATS_CONTAINER con id = userId.
+
+Lo mantiene la función ``tasks_stats_feed`` a partir del change feed del
+contenedor de tareas y ``GET /tasks/stats`` lo sirve con un point read.
+
+El change feed entrega la última versión de cada documento, no el cambio:
+para saber qué restar, la partición del usuario en STATS_CONTAINER guarda
+también un documento de estado por tarea viva (``task:<id>`` con su status,
+``_ts`` y ``_etag``). Cada lote lee sólo los estados de las tareas que
+cambiaron y aplica la diferencia en un transactional batch (estados + patch
+del resumen condicionado a su ``_etag``): el costo de una escritura no
+depende de cuántas tareas tenga el usuario, y un lote repetido no cuenta dos
+veces (la versión ya aplicada se saltea).
+
+Los borrados son lógicos (ver shared_code.tombstones): la lápida llega por el
+change feed como cualquier otra modificación, resta la tarea y borra su estado.
+
+:func:`rebuild_user` recalcula todo desde las tareas (O(tareas)): se usa
+cuando el usuario todavía no tiene resumen y como reparación manual.
+
+Procesador local (emulador o cuenta real, sin el host de Functions)::
+
+    cd backend/azure_functions
+    python -m shared_code.task_stats            # sigue el change feed
+    python -m shared_code.task_stats --once     # procesa lo pendiente y sale
+    python -m shared_code.task_stats --rebuild <userId>
+"""
+import argparse
+import asyncio
+import logging
+import sys
+import time
+
+from azure.cosmos import exceptions
+
+from shared_code import db, queries, storage, tombstones
+
+logger = logging.getLogger(__name__)
+
+# Formato del resumen; uno sin esta versión se reconstruye (no tiene estados)
+SUMMARY_VERSION = 2
+STATE_PREFIX = "task:"
+# Operaciones por transactional batch (límite de Cosmos DB); una es el resumen
+STATS_BATCH_SIZE = 100
+# Reintentos cuando otro proceso cambió el resumen entre la lectura y el batch
+APPLY_ATTEMPTS = 5
+
+
+def build_summary(user_id: str, tasks) -> dict:
+    """Resumen a partir de las tareas del usuario (sólo usa ``status`` y ``_ts``)."""
+    counts = {status: 0 for status in sorted(queries.TASK_STATUSES)}
+    last_modified = None
+    total = 0
+    for task in tasks:
+        total += 1
+        status = task.get("status")
+        counts[status] = counts.get(status, 0) + 1
+        ts = task.get("_ts")
+        if ts is not None and (last_modified is None or ts > last_modified):
+            last_modified = ts
+    return {
+        "id": user_id,
+        "userId": user_id,
+        "total": total,
+        "counts": counts,
+        "lastModified": last_modified,
+        "computedAt": int(time.time()),
+        "version": SUMMARY_VERSION,
+    }
+
+
+def public_view(summary: dict) -> dict:
+    return {key: summary.get(key) for key in ("total", "counts", "lastModified", "computedAt")}
+
+
+def _state_id(task_id: str) -> str:
+    return STATE_PREFIX + task_id
+
+
+def task_state(user_id: str, task: dict) -> dict:
+    return {
+        "id": _state_id(task["id"]),
+        "userId": user_id,
+        "status": task.get("status"),
+        "taskTs": task.get("_ts"),
+        "taskEtag": task.get("_etag"),
+    }
+
+
+async def _query_all(store, user_id, **kwargs):
+    items, continuation = [], None
+    while True:
+        page = await store.query(user_id, limit=1000, continuation=continuation, **kwargs)
+        items.extend(page.items)
+        continuation = page.continuation_token
+        if not continuation:
+            return items
+
+
+async def rebuild_user(user_id: str, tasks_store=None, stats_store=None, persist_empty=True) -> dict:
+    """
+    Recalcula el resumen y los estados de ``user_id`` desde sus tareas
+    (O(tareas); reparación). Devuelve el resumen. Con ``persist_empty=False``
+    un usuario sin tareas no se guarda (p. ej. cambios tardíos de una cuenta
+    ya borrada).
+    """
+    if tasks_store is None:
+        _, tasks_store = await storage.get_stores()
+    if stats_store is None:
+        stats_store = await storage.get_stats_store()
+    tasks = await _query_all(
+        tasks_store, user_id, where=[tombstones.LIVE_FILTER], fields=["id", "status", "_ts", "_etag"]
+    )
+    summary = build_summary(user_id, tasks)
+    if not tasks and not persist_empty:
+        return summary
+
+    wanted = {_state_id(task["id"]): task_state(user_id, task) for task in tasks}
+    existing = {
+        doc["id"] for doc in await _query_all(stats_store, user_id, fields=["id"])
+        if doc["id"].startswith(STATE_PREFIX)
+    }
+    operations = [("upsert", (state,)) for state in wanted.values()]
+    operations += [("delete", (state_id,)) for state_id in existing - set(wanted)]
+    for start in range(0, len(operations), STATS_BATCH_SIZE):
+        await stats_store.execute_item_batch(
+            batch_operations=operations[start:start + STATS_BATCH_SIZE], partition_key=user_id
+        )
+    await stats_store.upsert_item(summary)
+    logger.info("Resumen de %s reconstruido (%d tareas)", user_id, len(tasks))
+    return summary
+
+
+# Nombre previo: benchmarks y herramientas lo usan para forzar el recálculo
+refresh_user = rebuild_user
+
+
+def _latest_versions(documents) -> dict:
+    """Última versión de cada tarea del lote (una tarea puede venir repetida)."""
+    latest = {}
+    for doc in documents:
+        current = latest.get(doc["id"])
+        if current is None or (doc.get("_lsn", 0), doc.get("_ts", 0)) >= (
+            current.get("_lsn", 0), current.get("_ts", 0)
+        ):
+            latest[doc["id"]] = doc
+    return latest
+
+
+def _already_applied(state, doc) -> bool:
+    if state is None:
+        return False
+    if state.get("taskEtag") is not None and state.get("taskEtag") == doc.get("_etag"):
+        return True
+    return (doc.get("_ts") or 0) < (state.get("taskTs") or 0)
+
+
+async def _read_state(stats_store, user_id, task_id):
+    try:
+        return await stats_store.read_item(item=_state_id(task_id), partition_key=user_id)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+
+
+async def _apply_chunk(stats_store, user_id, summary, docs) -> bool:
+    """
+    Aplica un grupo de tareas cambiadas sobre ``summary`` (que se actualiza en
+    el lugar). False si el resumen cambió desde que se leyó (hay que releerlo).
+    """
+    states = await asyncio.gather(*(_read_state(stats_store, user_id, doc["id"]) for doc in docs))
+    counts = dict(summary.get("counts") or {})
+    total = summary.get("total") or 0
+    last_modified = summary.get("lastModified")
+    operations = []
+    for doc, state in zip(docs, states):
+        if _already_applied(state, doc):
+            continue
+        old = state.get("status") if state is not None else None
+        live = not tombstones.is_tombstone(doc)
+        if old is not None:
+            counts[old] = counts.get(old, 0) - 1
+            total -= 1
+        if live:
+            counts[doc.get("status")] = counts.get(doc.get("status"), 0) + 1
+            total += 1
+            operations.append(("upsert", (task_state(user_id, doc),)))
+        elif state is not None:
+            operations.append(("delete", (state["id"],)))
+        ts = doc.get("_ts")
+        if ts is not None and (last_modified is None or ts > last_modified):
+            last_modified = ts
+    if not operations:
+        return True
+
+    changes = {"total": total, "counts": counts, "lastModified": last_modified,
+               "computedAt": int(time.time())}
+    operations.append((
+        "patch",
+        (user_id, [{"op": "set", "path": "/" + key, "value": value} for key, value in changes.items()]),
+        {"filter_predicate": "FROM c WHERE c._etag = '%s'" % summary["_etag"]},
+    ))
+    try:
+        responses = await stats_store.execute_item_batch(
+            batch_operations=operations, partition_key=user_id
+        )
+    except exceptions.CosmosBatchOperationError as err:
+        if err.error_index == len(operations) - 1 and err.status_code in (404, 412):
+            return False
+        raise
+    summary.update(responses[-1]["resourceBody"])
+    return True
+
+
+async def _apply_user(user_id, documents, tasks_store, stats_store):
+    latest = list(_latest_versions(documents).values())
+    for _ in range(APPLY_ATTEMPTS):
+        try:
+            summary = await stats_store.read_item(item=user_id, partition_key=user_id)
+        except exceptions.CosmosResourceNotFoundError:
+            summary = None
+        if summary is None or summary.get("version") != SUMMARY_VERSION:
+            # Sin resumen (o de antes de los estados): se arma completo, ya incluye el lote
+            await rebuild_user(user_id, tasks_store, stats_store, persist_empty=summary is not None)
+            return
+        size = STATS_BATCH_SIZE - 1
+        for start in range(0, len(latest), size):
+            if not await _apply_chunk(stats_store, user_id, summary, latest[start:start + size]):
+                break
+        else:
+            return
+    raise RuntimeError("Task summary of %s kept changing while applying changes" % user_id)
+
+
+async def apply_changes(documents) -> int:
+    """Procesa un lote del change feed. Devuelve cuántos usuarios se actualizaron."""
+    by_user = {}
+    for doc in documents:
+        if doc.get("userId") and doc.get("id"):
+            by_user.setdefault(doc["userId"], []).append(doc)
+    if not by_user:
+        return 0
+    _, tasks_store = await storage.get_stores()
+    stats_store = await storage.get_stats_store()
+    for user_id in sorted(by_user):
+        await _apply_user(user_id, by_user[user_id], tasks_store, stats_store)
+    logger.info("Resúmenes de tareas actualizados para %d usuarios", len(by_user))
+    return len(by_user)
+
+
+async def get_summary(user_id: str) -> dict:
+    """Point read del resumen; si no existe todavía se calcula en el momento."""
+    stats_store = await storage.get_stats_store()
+    try:
+        return await stats_store.read_item(item=user_id, partition_key=user_id)
+    except exceptions.CosmosResourceNotFoundError:
+        logger.info("Resumen inexistente para %s; se calcula en el momento", user_id)
+        return await rebuild_user(user_id, stats_store=stats_store)
+
+
+def _read_changes(tasks, continuation):
+    """Lee lo pendiente del change feed (cliente síncrono). Devuelve (docs, continuation)."""
+    feed = tasks.query_items_change_feed(
+        is_start_from_beginning=continuation is None,
+        continuation=continuation,
+    )
+    documents = list(feed)
+    return documents, tasks.client_connection.last_response_headers.get("etag")
+
+
+async def _follow_change_feed(once: bool, poll_seconds: float):
+    _, _, tasks = await asyncio.to_thread(db.get_containers)
+    continuation = None
+    while True:
+        documents, continuation = await asyncio.to_thread(_read_changes, tasks, continuation)
+        if documents:
+            await apply_changes(documents)
+        if once:
+            return
+        await asyncio.sleep(poll_seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Procesador local del change feed de tareas")
+    parser.add_argument("--once", action="store_true", help="procesa lo pendiente y sale")
+    parser.add_argument("--poll-seconds", type=float, default=5.0)
+    parser.add_argument("--rebuild", metavar="USER_ID", help="recalcula desde cero el resumen de un usuario")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    try:
+        if args.rebuild:
+            db.run(rebuild_user(args.rebuild))
+        else:
+            db.run(_follow_change_feed(args.once, args.poll_seconds))
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        logger.exception("Error procesando el change feed de tareas")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
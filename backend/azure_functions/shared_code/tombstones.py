@@ -0,0 +1,36 @@
+"""
+Borrado lógico de tareas.
+
+``DELETE /tasks/{id}`` no elimina el documento: lo marca con ``deletedAt`` y
+un ``ttl`` propio, así el borrado queda visible para la sincronización
+incremental (``GET /tasks?since=``) y para el change feed. Cosmos elimina la
+lápida sola al vencer el TTL (el contenedor de tareas tiene TTL habilitado
+sin valor por defecto, ``default_ttl=-1``).
+"""
+import os
+import time
+
+TOMBSTONE_FIELD = "deletedAt"
+# Un cliente con un cursor más viejo que esto tiene que resincronizar completo
+TOMBSTONE_TTL_SECONDS = int(os.getenv("TASKS_TOMBSTONE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Filtro de store.query y predicado de patch para quedarse sólo con tareas vivas
+LIVE_FILTER = (TOMBSTONE_FIELD, "undefined", None)
+LIVE_PREDICATE = "FROM c WHERE NOT IS_DEFINED(c.%s)" % TOMBSTONE_FIELD
+
+
+def is_tombstone(doc: dict) -> bool:
+    return TOMBSTONE_FIELD in doc
+
+
+def tombstone_operations(now: int = None) -> list:
+    """Operaciones de patch que convierten una tarea en lápida."""
+    return [
+        {"op": "set", "path": "/" + TOMBSTONE_FIELD, "value": int(now or time.time())},
+        {"op": "set", "path": "/ttl", "value": TOMBSTONE_TTL_SECONDS},
+    ]
+
+
+def oldest_valid_cursor(now: float = None) -> int:
+    """Cursores anteriores a este pueden haber perdido lápidas ya expiradas."""
+    return int((now or time.time()) - TOMBSTONE_TTL_SECONDS)
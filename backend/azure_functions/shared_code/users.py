@@ -0,0 +1,70 @@
+import hashlib
+import logging
+import os
+
+from azure.cosmos import exceptions
+
+logger = logging.getLogger(__name__)
+
+# Búsqueda de usuarios legacy (sin id determinístico). Con "false" un email
+# inexistente cuesta sólo el point read: apagarla cuando
+# ``python -m shared_code.migrate_user_ids`` terminó sin fallas.
+LEGACY_LOOKUP = os.getenv("USERS_LEGACY_LOOKUP", "true").lower() == "true"
+
+
+def normalize_email(email) -> str:
+    return (email or "").strip().lower()
+
+
+def user_doc_id(email: str) -> str:
+    """
+    Id determinístico del documento de usuario a partir del email normalizado.
+    Permite leer el usuario con un point read (id + partition key /email).
+    """
+    digest = hashlib.sha256(normalize_email(email).encode("utf-8")).hexdigest()
+    return "user-" + digest
+
+
+def account_id(user_doc: dict) -> str:
+    """
+    Id estable de la cuenta (``sub`` del JWT y ``userId`` de las tareas).
+    Los documentos legacy no tienen ``userId``: su id de documento es el de la cuenta.
+    """
+    return user_doc.get("userId") or user_doc["id"]
+
+
+async def read_account(users_store, email: str, account: str) -> dict:
+    """
+    Point read del usuario de la cuenta ``account`` (el ``sub`` del JWT). Con
+    LEGACY_LOOKUP cae al documento legacy, cuyo id es el de la cuenta.
+    Lanza CosmosResourceNotFoundError si no existe.
+    """
+    try:
+        return await users_store.read_item(item=user_doc_id(email), partition_key=email)
+    except exceptions.CosmosResourceNotFoundError:
+        if not LEGACY_LOOKUP:
+            raise
+    return await users_store.read_item(item=account, partition_key=email)
+
+
+async def find_user_by_email(users_store, email: str):
+    """
+    Point read por id determinístico. Si no existe y LEGACY_LOOKUP está
+    activo, cae a la consulta legacy para usuarios aún no migrados (ver
+    shared_code.migrate_user_ids).
+    """
+    email = normalize_email(email)
+    try:
+        return await users_store.read_item(item=user_doc_id(email), partition_key=email)
+    except exceptions.CosmosResourceNotFoundError:
+        if not LEGACY_LOOKUP:
+            return None
+
+    page = await users_store.query(
+        email, where=[("email", "=", email)]  # 👈 mono-partición por /email
+    )
+    items = page.items
+    if items:
+        logger.info("Usuario legacy (sin id determinístico) encontrado: %s", email)
+        return items[0]
+    return None
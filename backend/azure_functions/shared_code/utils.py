@@ -1,12 +1,27 @@
+import hashlib
 import logging
 import os
+import time
 from functools import lru_cache
 
 import jwt
 from jwt import ExpiredSignatureError, InvalidTokenError
 
+from shared_code import metrics
+from shared_code.cache import TTLCache
+
 logger = logging.getLogger(__name__)
 
+# Caché de tokens ya verificados (clave = sha256 del token, nunca el token en claro).
+# Una entrada vence a más tardar en el ``exp`` del propio token.
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("JWT_CACHE_MAX_ENTRIES", "10000"))
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("JWT_CACHE_TTL_SECONDS", "300"))
+TOKEN_NEGATIVE_CACHE_MAX_ENTRIES = int(os.getenv("JWT_NEGATIVE_CACHE_MAX_ENTRIES", "1000"))
+TOKEN_NEGATIVE_CACHE_TTL_SECONDS = float(os.getenv("JWT_NEGATIVE_CACHE_TTL_SECONDS", "30"))
+
+_verified_tokens = TTLCache(TOKEN_CACHE_MAX_ENTRIES)
+_rejected_tokens = TTLCache(TOKEN_NEGATIVE_CACHE_MAX_ENTRIES)
+
 
 @lru_cache()
 def get_jwt_secret() -> str:
@@ -23,13 +38,32 @@ def get_jwt_secret() -> str:
     return secret
 
 
+def token_cache_stats() -> dict:
+    """Contadores de la caché de tokens (para medir el ahorro de CPU)."""
+    return {"verified": _verified_tokens.stats(), "rejected": _rejected_tokens.stats()}
+
+
 def get_user_from_token(req):
+    with metrics.phase("auth"):
+        return _get_user_from_token(req)
+
+
+def _get_user_from_token(req):
     auth = req.headers.get("Authorization")
     if not auth or not auth.startswith("Bearer "):
         logger.debug("Solicitud sin token Bearer")
         return None
 
     token = auth.split(" ")[1]
+    digest = hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    cached = _verified_tokens.get(digest)
+    if cached is not None:
+        return dict(cached)
+    if _rejected_tokens.get(digest) is not None:
+        logger.debug("Token rechazado (caché negativa)")
+        return None
+
     try:
         payload = jwt.decode(
             token,
@@ -37,16 +71,31 @@ def get_user_from_token(req):
             algorithms=["HS256"],
             options={"require": ["exp", "sub"]},
         )
-        return payload
     except RuntimeError:
         # get_jwt_secret ya dejó registro; propagamos para que el caller trate el error como 500
         raise
     except ExpiredSignatureError:
         logger.info("Token expirado")
+        _remember_rejected(digest)
         return None
     except InvalidTokenError:
         logger.warning("Token inválido")
+        _remember_rejected(digest)
         return None
     except Exception as exc:
         logger.exception("Error inesperado al decodificar token: %s", exc)
         return None
+
+    if payload.get("typ") is not None:
+        # Los refresh tokens (typ=refresh) sólo sirven en /user/refresh
+        logger.warning("Token de tipo %s usado como access token", payload.get("typ"))
+        _remember_rejected(digest)
+        return None
+
+    expires_at = min(float(payload["exp"]), time.time() + TOKEN_CACHE_TTL_SECONDS)
+    _verified_tokens.put(digest, payload, expires_at)
+    return dict(payload)
+
+
+def _remember_rejected(digest: str):
+    _rejected_tokens.put(digest, True, time.time() + TOKEN_NEGATIVE_CACHE_TTL_SECONDS)
@@ -0,0 +1,24 @@
+import logging
+
+import azure.functions as func
+
+from shared_code import archive
+from shared_code.cache import task_list_cache
+from shared_code.search import title_index
+
+logger = logging.getLogger(__name__)
+
+
+async def main(timer: func.TimerRequest) -> None:
+    if timer.past_due:
+        logger.info("Archivado atrasado: se corre ahora")
+    # Si falla se relanza: la corrida queda registrada como fallida y la
+    # siguiente retoma lo pendiente (cada paso es idempotente)
+    try:
+        result = await archive.archive_due_tasks()
+    except Exception:
+        logger.exception("Error archivando tareas completadas")
+        raise
+    for user_id in result["users"]:
+        task_list_cache.invalidate(user_id)
+        title_index.invalidate(user_id)
@@ -0,0 +1,214 @@
+import json
+import logging
+import uuid
+
+import azure.functions as func
+from azure.cosmos import exceptions
+
+from shared_code import accounts, metrics, ratelimit, resilience, responses, storage, tombstones
+from shared_code.cache import task_list_cache
+from shared_code.search import title_index
+from shared_code.queries import NEW_TASK_STATUSES, TASK_STATUSES
+from shared_code.serializers import shape_task
+from shared_code.utils import get_user_from_token
+
+logger = logging.getLogger(__name__)
+
+# Límite de operaciones por transactional batch en Cosmos DB
+BATCH_CHUNK_SIZE = 100
+MAX_OPERATIONS = 1000
+
+
+# Las operaciones sobre lápidas fallan con 412 (se informan como 404)
+_LIVE_ONLY = {"filter_predicate": tombstones.LIVE_PREDICATE}
+
+
+def _validate_operation(op: dict, user_id: str):
+    """
+    Valida una operación y la traduce a la tupla que espera execute_item_batch.
+    Devuelve (cosmos_op, task_id) o lanza ValueError con el motivo.
+    """
+    if not isinstance(op, dict):
+        raise ValueError("operation must be an object")
+
+    kind = op.get("op")
+    if kind not in ("create", "update", "delete"):
+        raise ValueError("op must be one of: create, delete, update")
+
+    if kind == "create":
+        title = (op.get("title") or "").strip()
+        if not title:
+            raise ValueError("title is required")
+        status = op.get("status", "pending")
+        if status not in NEW_TASK_STATUSES:
+            raise ValueError("Invalid status for new task")
+        task = {
+            "id": str(uuid.uuid4()),
+            "title": title,
+            "status": status,
+            "userId": user_id,
+        }
+        return ("create", (task,)), task["id"]
+
+    task_id = op.get("id")
+    if not task_id or not isinstance(task_id, str):
+        raise ValueError("id is required")
+
+    if kind == "update":
+        # Patch dentro del batch: sin read previo ni reescritura del documento
+        patch_ops = []
+        if "title" in op:
+            title = (op.get("title") or "").strip()
+            if not title:
+                raise ValueError("title cannot be empty")
+            patch_ops.append({"op": "set", "path": "/title", "value": title})
+        if "status" in op:
+            if op["status"] not in TASK_STATUSES:
+                raise ValueError("Invalid status")
+            patch_ops.append({"op": "set", "path": "/status", "value": op["status"]})
+        if not patch_ops:
+            raise ValueError("nothing to update")
+        return ("patch", (task_id, patch_ops), _LIVE_ONLY), task_id
+
+    # Borrado lógico, igual que DELETE /tasks/{id}
+    return ("patch", (task_id, tombstones.tombstone_operations()), _LIVE_ONLY), task_id
+
+
+async def _execute_chunk(tasks_store, user_id, chunk):
+    """Ejecuta un chunk como una transacción y devuelve un resultado por operación."""
+    batch = [cosmos_op for _, cosmos_op, _ in chunk]
+    try:
+        responses = await tasks_store.execute_item_batch(
+            batch_operations=batch, partition_key=user_id
+        )
+    except exceptions.CosmosBatchOperationError as err:
+        logger.info(
+            "Batch de tareas revertido para %s (operación %s falló)", user_id, err.error_index
+        )
+        responses = err.operation_responses or []
+    except Exception:
+        logger.exception("Error al ejecutar batch de tareas para %s", user_id)
+        responses = []
+
+    results = []
+    for pos, (index, cosmos_op, task_id) in enumerate(chunk):
+        response = responses[pos] if pos < len(responses) else {}
+        status_code = response.get("statusCode", 500)
+        if status_code == 412:
+            # Los batches no llevan ETag: el 412 viene del predicado (tarea ya borrada)
+            status_code = 404
+        body = response.get("resourceBody")
+        if status_code < 400 and body is not None and tombstones.is_tombstone(body):
+            status_code, body = 204, None
+        result = {"index": index, "id": task_id, "statusCode": status_code}
+        if status_code < 400 and body is not None:
+            result["task"] = shape_task(body)
+        results.append(result)
+    return results
+
+
+@metrics.instrumented("tasks_batch")
+@ratelimit.limited("api")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        user = get_user_from_token(req)
+    except RuntimeError as err:
+        logger.error("Error de configuración JWT: %s", err)
+        return func.HttpResponse(
+            json.dumps({"error": "Authentication service misconfigured"}),
+            status_code=500,
+            mimetype="application/json",
+        )
+
+    if not user:
+        logger.warning("Intento no autorizado de batch de tareas")
+        return func.HttpResponse(
+            json.dumps({"error": "Unauthorized"}),
+            status_code=401,
+            mimetype="application/json",
+        )
+
+    try:
+        with metrics.phase("parse"):
+            body = req.get_json()
+    except ValueError:
+        logger.warning("JSON inválido en batch de tareas")
+        return func.HttpResponse(
+            json.dumps({"error": "Invalid JSON in request body"}),
+            status_code=400,
+            mimetype="application/json",
+        )
+
+    operations = body.get("operations") if isinstance(body, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return func.HttpResponse(
+            json.dumps({"error": "operations must be a non-empty list"}),
+            status_code=400,
+            mimetype="application/json",
+        )
+
+    if len(operations) > MAX_OPERATIONS:
+        return func.HttpResponse(
+            json.dumps({"error": "Too many operations", "max": MAX_OPERATIONS}),
+            status_code=400,
+            mimetype="application/json",
+        )
+
+    # Se valida todo antes de escribir: un batch inválido no ejecuta nada
+    prepared = []
+    errors = []
+    for index, op in enumerate(operations):
+        try:
+            cosmos_op, task_id = _validate_operation(op, user["sub"])
+        except ValueError as err:
+            errors.append({"index": index, "error": str(err)})
+            continue
+        prepared.append((index, cosmos_op, task_id))
+
+    if errors:
+        logger.info("Batch de tareas inválido para %s (%s errores)", user["sub"], len(errors))
+        return func.HttpResponse(
+            json.dumps({"error": "Invalid operations", "details": errors}),
+            status_code=400,
+            mimetype="application/json",
+        )
+
+    try:
+        users_store, tasks_store = await storage.get_stores()
+        active = await accounts.is_active(users_store, user)
+    except Exception as e:
+        logger.exception("No se pudo conectar a Cosmos DB en batch de tareas")
+        return func.HttpResponse(
+            json.dumps({"error": "Could not connect to database"}),
+            status_code=503,
+            mimetype="application/json",
+            headers=resilience.retry_after_headers(e),
+        )
+
+    if not active:
+        # Token todavía firmado de una cuenta dada de baja (o con la baja en curso)
+        logger.warning("Batch de tareas rechazado: la cuenta %s ya no existe", user["sub"])
+        return func.HttpResponse(
+            json.dumps({"error": "Unauthorized"}),
+            status_code=401,
+            mimetype="application/json",
+        )
+
+    # Cada chunk es atómico dentro de la partición /userId del usuario
+    results = []
+    for start in range(0, len(prepared), BATCH_CHUNK_SIZE):
+        chunk = prepared[start:start + BATCH_CHUNK_SIZE]
+        results.extend(await _execute_chunk(tasks_store, user["sub"], chunk))
+
+    task_list_cache.invalidate(user["sub"])
+    for result in results:
+        if "task" in result:
+            title_index.add_task(user["sub"], result["task"])
+        elif result["statusCode"] == 204:
+            title_index.remove_task(user["sub"], result["id"])
+    failed = sum(1 for r in results if r["statusCode"] >= 400)
+    logger.info(
+        "Batch de %s operaciones para %s (%s fallidas)", len(results), user["sub"], failed
+    )
+
+    return responses.render(req, {"results": results, "failed": failed})
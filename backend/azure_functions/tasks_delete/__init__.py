@@ -3,13 +3,17 @@ import logging
 
 import azure.functions as func
 
-from shared_code import db
+from shared_code import accounts, metrics, ratelimit, resilience, responses, storage, tombstones
+from shared_code.cache import task_list_cache
+from shared_code.search import title_index
 from shared_code.utils import get_user_from_token
 
 logger = logging.getLogger(__name__)
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+@metrics.instrumented("tasks_delete")
+@ratelimit.limited("api")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
         user = get_user_from_token(req)
     except RuntimeError as err:
@@ -29,13 +33,24 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         )
 
     try:
-        _, _, tasks_container = db.get_containers()
+        users_store, tasks_store = await storage.get_stores()
+        active = await accounts.is_active(users_store, user)
     except Exception as e:
         logger.exception("No se pudo conectar a Cosmos DB al eliminar tarea")
         return func.HttpResponse(
             json.dumps({"error": "Could not connect to database"}),
             status_code=503,
             mimetype="application/json",
+            headers=resilience.retry_after_headers(e),
+        )
+
+    if not active:
+        # Token todavía firmado de una cuenta dada de baja (o con la baja en curso)
+        logger.warning("Eliminación de tarea rechazada: la cuenta %s ya no existe", user["sub"])
+        return func.HttpResponse(
+            json.dumps({"error": "Unauthorized"}),
+            status_code=401,
+            mimetype="application/json",
         )
 
     task_id = req.route_params.get("id")
@@ -47,9 +62,20 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
+    # Borrado lógico: la lápida (deletedAt + ttl) llega a ?since= y al change feed.
+    # El predicado hace que borrar una lápida responda 404 como un borrado real.
     try:
-        tasks_container.delete_item(item=task_id, partition_key=user["sub"])
+        await tasks_store.patch_item(
+            item=task_id,
+            partition_key=user["sub"],
+            patch_operations=tombstones.tombstone_operations(),
+            filter_predicate=tombstones.LIVE_PREDICATE,
+        )
         logger.info("Tarea %s eliminada para usuario %s", task_id, user["sub"])
+        task_list_cache.invalidate(user["sub"])
+        title_index.remove_task(user["sub"], task_id)
+    except resilience.CircuitOpenError:
+        raise
     except Exception:
         logger.warning(
             "No se pudo eliminar la tarea %s para usuario %s", task_id, user["sub"],
@@ -61,6 +87,4 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
-    return func.HttpResponse(
-        json.dumps({"message": "deleted"}), mimetype="application/json"
-    )
+    return responses.render(req, {"message": "deleted"})
@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+
+import azure.functions as func
+from azure.cosmos import exceptions
+
+from shared_code import metrics, ndjson, queries, ratelimit, resilience, responses, storage
+from shared_code.serializers import shape_task
+from shared_code.utils import get_user_from_token
+
+logger = logging.getLogger(__name__)
+
+# Tareas pedidas a Cosmos por página
+EXPORT_PAGE_SIZE = int(os.getenv("TASKS_EXPORT_PAGE_SIZE", "1000"))
+# Tope por respuesta: acota memoria y duración; el resto sigue con X-Continuation-Token
+EXPORT_MAX_ITEMS = int(os.getenv("TASKS_EXPORT_MAX_ITEMS", "20000"))
+CONTINUATION_HEADER = "X-Continuation-Token"
+
+
+@metrics.instrumented("tasks_export")
+@ratelimit.limited("api")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        user = get_user_from_token(req)
+    except RuntimeError as err:
+        logger.error("Error de configuración JWT: %s", err)
+        return func.HttpResponse(
+            json.dumps({"error": "Authentication service misconfigured"}),
+            status_code=500,
+            mimetype="application/json",
+        )
+
+    if not user:
+        logger.warning("Acceso no autorizado al export de tareas")
+        return func.HttpResponse(
+            json.dumps({"error": "Unauthorized"}),
+            status_code=401,
+            mimetype="application/json",
+        )
+
+    try:
+        _, tasks_store = await storage.get_stores()
+    except Exception as e:
+        logger.exception("No se pudo conectar a Cosmos DB en el export de tareas")
+        return func.HttpResponse(
+            json.dumps({"error": "Could not connect to database"}),
+            status_code=503,
+            mimetype="application/json",
+            headers=resilience.retry_after_headers(e),
+        )
+
+    # Sin ORDER BY: la consulta más barata y con continuation estable
+    spec = queries.build_tasks_query(user["sub"])
+    continuation = req.params.get("continuationToken") or None
+    _, encoding = responses.negotiate(req)
+    writer = ndjson.NdjsonWriter(encoding)
+
+    # Página por página: en memoria sólo la página actual y la salida comprimida
+    try:
+        while True:
+            page = await tasks_store.query(
+                user["sub"], limit=EXPORT_PAGE_SIZE, continuation=continuation, **spec
+            )
+            with metrics.phase("serialize"):
+                for item in page.items:
+                    writer.write(shape_task(item))
+            continuation = page.continuation_token
+            if not continuation or writer.lines >= EXPORT_MAX_ITEMS:
+                break
+    except resilience.CircuitOpenError as err:
+        logger.warning("Cosmos no disponible (breaker abierto) en export de %s", user["sub"])
+        return func.HttpResponse(
+            json.dumps({"error": "Could not connect to database"}),
+            status_code=503,
+            mimetype="application/json",
+            headers=resilience.retry_after_headers(err),
+        )
+    except exceptions.CosmosHttpResponseError as err:
+        if err.status_code == 400 and req.params.get("continuationToken"):
+            return func.HttpResponse(
+                json.dumps({"error": "Invalid continuationToken"}),
+                status_code=400,
+                mimetype="application/json",
+            )
+        logger.exception("Error al exportar tareas de %s", user["sub"])
+        return func.HttpResponse(
+            json.dumps({"error": "Could not export tasks"}),
+            status_code=500,
+            mimetype="application/json",
+        )
+
+    logger.info(
+        "Export de %s tareas para %s (hay más: %s)", writer.lines, user["sub"], bool(continuation)
+    )
+    headers = {"Vary": "Accept-Encoding", "Cache-Control": "private, no-store"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    if continuation:
+        headers[CONTINUATION_HEADER] = continuation
+    return func.HttpResponse(
+        writer.getvalue(), status_code=200, mimetype=ndjson.NDJSON_MIMETYPE, headers=headers
+    )
@@ -2,14 +2,50 @@ import json
 import logging
 
 import azure.functions as func
+from azure.cosmos import exceptions
 
-from shared_code import db
+from shared_code import metrics, queries, ratelimit, resilience, responses, storage, tombstones
+from shared_code.cache import etag_matches, request_variant, task_list_cache
+from shared_code.serializers import shape_task
 from shared_code.utils import get_user_from_token
 
 logger = logging.getLogger(__name__)
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+def _list_response(body: bytes, meta: dict, etag: str) -> func.HttpResponse:
+    headers = dict(meta["headers"])
+    headers.update({"ETag": etag, "Cache-Control": "private, no-cache"})
+    return func.HttpResponse(body, mimetype=meta["mimetype"], headers=headers)
+
+
+def _not_modified(etag: str) -> func.HttpResponse:
+    return func.HttpResponse(
+        status_code=304,
+        headers={"ETag": etag, "Cache-Control": "private, no-cache"},
+    )
+
+
+def _sync_payload(items, since: int, continuation_token):
+    """Respuesta de ``?since=``: cambios, ids borrados y el cursor para la próxima vez."""
+    changed, deleted = [], []
+    cursor = since
+    for item in items:
+        cursor = max(cursor, item.get("_ts", 0))
+        if tombstones.is_tombstone(item):
+            deleted.append(item["id"])
+        else:
+            changed.append(shape_task(item))
+    return {
+        "items": changed,
+        "deleted": deleted,
+        "cursor": str(cursor),
+        "continuationToken": continuation_token,
+    }
+
+
+@metrics.instrumented("tasks_get")
+@ratelimit.limited("api")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
         user = get_user_from_token(req)
     except RuntimeError as err:
@@ -28,25 +64,123 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
+    # Caché por usuario: si el cliente ya tiene la versión vigente no se toca Cosmos
+    # La variante incluye la negociación: cada formato/compresión tiene su ETag
+    variant = "%s|%s;%s" % ((request_variant(req),) + responses.negotiate(req))
+    if_none_match = req.headers.get("If-None-Match")
+    cached = task_list_cache.get(user["sub"], variant)
+    if cached is not None:
+        etag, body, meta = cached
+        if etag_matches(if_none_match, etag):
+            logger.debug("tasks_get 304 desde caché para %s", user.get("sub"))
+            return _not_modified(etag)
+        logger.debug("tasks_get servido desde caché para %s", user.get("sub"))
+        return _list_response(body, meta, etag)
+
+    # Antes de consultar: si una escritura invalida en el medio, el listado no se guarda
+    generation = task_list_cache.generation(user["sub"])
+
+    archived = (req.params.get("archived") or "").lower() in ("1", "true")
     try:
-        _, _, tasks_container = db.get_containers()
+        if archived:
+            # Opt-in: tareas completadas que el timer tasks_archive movió al archivo
+            tasks_store = await storage.get_archive_store()
+        else:
+            _, tasks_store = await storage.get_stores()
     except Exception as e:
         logger.exception("No se pudo obtener contenedor de tareas para %s", user.get("sub"))
         return func.HttpResponse(
             json.dumps({"error": "Could not connect to database"}),
             status_code=503,
             mimetype="application/json",
+            headers=resilience.retry_after_headers(e),
+        )
+
+    try:
+        limit = queries.parse_limit(req.params.get("limit"))
+        since = queries.parse_since(req.params.get("since"), tombstones.oldest_valid_cursor())
+        if since is not None and archived:
+            raise queries.QueryParamError("since cannot be combined with archived")
+        if since is not None:
+            # Sincronización incremental: todo lo modificado (incluidas lápidas) desde el cursor
+            if any(req.params.get(p) for p in ("status", "title", "orderBy", "fields")):
+                raise queries.QueryParamError(
+                    "since cannot be combined with status, title, orderBy or fields"
+                )
+            fields = None
+            spec = queries.build_sync_query(user["sub"], since)
+        else:
+            fields = queries.parse_fields(req.params.get("fields"))
+            spec = queries.build_tasks_query(
+                user["sub"],
+                status=req.params.get("status"),
+                title_prefix=(req.params.get("title") or "").strip() or None,
+                order_by=queries.parse_order_by(req.params.get("orderBy")),
+                fields=fields,
+                archived=archived,
+            )
+    except queries.CursorExpiredError as err:
+        logger.info("Cursor de sincronización vencido para %s", user.get("sub"))
+        return func.HttpResponse(
+            json.dumps({"error": str(err)}),
+            status_code=410,
+            mimetype="application/json",
+        )
+    except queries.QueryParamError as err:
+        logger.info("Parámetros de consulta inválidos en tasks_get: %s", err)
+        return func.HttpResponse(
+            json.dumps({"error": str(err)}),
+            status_code=400,
+            mimetype="application/json",
         )
 
-    query = "SELECT * FROM c WHERE c.userId=@uid"
-    params = [{"name": "@uid", "value": user["sub"]}]
-    items = list(
-        tasks_container.query_items(
-            query=query,
-            parameters=params,
-            partition_key=user["sub"],  # 👈 mono-partición
+    continuation = req.params.get("continuationToken") or None
+    if continuation and limit is None:
+        limit = queries.DEFAULT_PAGE_SIZE
+
+    if limit is None:
+        # Sin paginar: respuesta legacy (lista completa)
+        page = await tasks_store.query(user["sub"], **spec)  # 👈 mono-partición
+        items = page.items
+        logger.debug("Se recuperaron %s tareas para %s", len(items), user.get("sub"))
+        if since is not None:
+            payload = _sync_payload(items, since, None)
+        else:
+            payload = [shape_task(item, fields) for item in items]
+    else:
+        # Paginado: una sola página por petición, el coste queda acotado por limit
+        try:
+            page = await tasks_store.query(
+                user["sub"], limit=limit, continuation=continuation, **spec
+            )
+        except exceptions.CosmosHttpResponseError as err:
+            if continuation and err.status_code == 400:
+                logger.info("continuationToken inválido para %s", user.get("sub"))
+                return func.HttpResponse(
+                    json.dumps({"error": "Invalid continuationToken"}),
+                    status_code=400,
+                    mimetype="application/json",
+                )
+            raise
+
+        items, next_token = page
+        logger.debug(
+            "Página de %s tareas para %s (hay más: %s)",
+            len(items),
+            user.get("sub"),
+            bool(next_token),
         )
-    )
+        if since is not None:
+            payload = _sync_payload(items, since, next_token)
+        else:
+            payload = {
+                "items": [shape_task(item, fields) for item in items],
+                "continuationToken": next_token,
+            }
 
-    logger.debug("Se recuperaron %s tareas para %s", len(items), user.get("sub"))
-    return func.HttpResponse(json.dumps(items), mimetype="application/json")
+    body, mimetype, headers = responses.encode(req, payload)
+    meta = {"mimetype": mimetype, "headers": headers}
+    etag = task_list_cache.put(user["sub"], variant, body, meta, generation)
+    if etag_matches(if_none_match, etag):
+        return _not_modified(etag)
+    return _list_response(body, meta, etag)
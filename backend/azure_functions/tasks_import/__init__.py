@@ -0,0 +1,195 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import uuid
+
+import azure.functions as func
+from azure.cosmos import exceptions
+
+from shared_code import accounts, metrics, ndjson, ratelimit, resilience, responses, storage
+from shared_code.cache import task_list_cache
+from shared_code.queries import TASK_STATUSES
+from shared_code.search import title_index
+from shared_code.utils import get_user_from_token
+
+logger = logging.getLogger(__name__)
+
+# Operaciones por transactional batch (límite de Cosmos DB)
+IMPORT_BATCH_SIZE = 100
+# Batches en vuelo a la vez: acota memoria y RU por request
+IMPORT_CONCURRENCY = int(os.getenv("TASKS_IMPORT_CONCURRENCY", "4"))
+# Líneas por request; cuentas más grandes se importan en varios requests
+IMPORT_MAX_LINES = int(os.getenv("TASKS_IMPORT_MAX_LINES", "20000"))
+# Tope del cuerpo descomprimido: se controla mientras se descomprime
+IMPORT_MAX_BYTES = int(os.getenv("TASKS_IMPORT_MAX_BYTES", str(20 * 1024 * 1024)))
+MAX_REPORTED_ERRORS = 100
+
+# Caracteres que Cosmos no admite en un id
+_INVALID_ID = re.compile(r"[/\\?#]")
+
+
+def _parse_line(raw: bytes, user_id: str) -> dict:
+    """Valida una línea NDJSON y devuelve la tarea a escribir (o ValueError)."""
+    try:
+        doc = json.loads(raw)
+    except ValueError:
+        raise ValueError("invalid JSON")
+    if not isinstance(doc, dict):
+        raise ValueError("line must be a JSON object")
+
+    title = doc.get("title")
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("title is required")
+    status = doc.get("status", "pending")
+    if status not in TASK_STATUSES:
+        raise ValueError("Invalid status")
+
+    # Con id el import es idempotente (upsert): reintentar un archivo no duplica
+    task_id = doc.get("id") or str(uuid.uuid4())
+    if not isinstance(task_id, str) or len(task_id) > 255 or _INVALID_ID.search(task_id):
+        raise ValueError("Invalid id")
+    return {"id": task_id, "title": title.strip(), "status": status, "userId": user_id}
+
+
+async def _write_batch(tasks_store, user_id: str, batch):
+    """Escribe un batch (atómico en la partición). Devuelve [(línea, error)] de lo que falló."""
+    operations = [("upsert", (task,)) for _, task in batch]
+    try:
+        await tasks_store.execute_item_batch(batch_operations=operations, partition_key=user_id)
+        return []
+    except exceptions.CosmosBatchOperationError as err:
+        failed_line = batch[err.error_index][0] if err.error_index < len(batch) else None
+        logger.info("Batch de import revertido para %s (línea %s)", user_id, failed_line)
+        responses = err.operation_responses or []
+        # Con partition key jerárquica el batch se parte por bucket y los
+        # anteriores al que falló quedan escritos (ver shared_code.sharding)
+        return [
+            (line, "status %s" % err.status_code if line == failed_line else "batch rolled back")
+            for position, (line, _) in enumerate(batch)
+            if position >= len(responses) or responses[position].get("statusCode", 424) >= 400
+        ]
+    except Exception as err:
+        logger.warning("Error al escribir batch de import para %s", user_id, exc_info=True)
+        message = "database unavailable" if isinstance(err, resilience.CircuitOpenError) else "write failed"
+        return [(line, message) for line, _ in batch]
+
+
+@metrics.instrumented("tasks_import")
+@ratelimit.limited("api")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        user = get_user_from_token(req)
+    except RuntimeError as err:
+        logger.error("Error de configuración JWT: %s", err)
+        return func.HttpResponse(
+            json.dumps({"error": "Authentication service misconfigured"}),
+            status_code=500,
+            mimetype="application/json",
+        )
+
+    if not user:
+        logger.warning("Intento no autorizado de import de tareas")
+        return func.HttpResponse(
+            json.dumps({"error": "Unauthorized"}),
+            status_code=401,
+            mimetype="application/json",
+        )
+
+    try:
+        body = ndjson.decode_body(
+            req.get_body(), req.headers.get("Content-Encoding"), max_bytes=IMPORT_MAX_BYTES
+        )
+    except ndjson.BodyTooLarge:
+        return func.HttpResponse(
+            json.dumps({"error": "Body too large", "maxBytes": IMPORT_MAX_BYTES}),
+            status_code=413,
+            mimetype="application/json",
+        )
+    except (OSError, EOFError):
+        return func.HttpResponse(
+            json.dumps({"error": "Invalid gzip body"}),
+            status_code=400,
+            mimetype="application/json",
+        )
+
+    # Conteo sin parsear: se rechaza antes de escribir nada. El salto final
+    # (habitual en NDJSON) no abre otra línea
+    lines = body.count(b"\n") + (0 if not body or body.endswith(b"\n") else 1)
+    if lines > IMPORT_MAX_LINES:
+        return func.HttpResponse(
+            json.dumps({"error": "Too many lines", "max": IMPORT_MAX_LINES}),
+            status_code=413,
+            mimetype="application/json",
+        )
+
+    try:
+        users_store, tasks_store = await storage.get_stores()
+        active = await accounts.is_active(users_store, user)
+    except Exception as e:
+        logger.exception("No se pudo conectar a Cosmos DB en import de tareas")
+        return func.HttpResponse(
+            json.dumps({"error": "Could not connect to database"}),
+            status_code=503,
+            mimetype="application/json",
+            headers=resilience.retry_after_headers(e),
+        )
+
+    if not active:
+        # Token todavía firmado de una cuenta dada de baja (o con la baja en curso)
+        logger.warning("Import de tareas rechazado: la cuenta %s ya no existe", user["sub"])
+        return func.HttpResponse(
+            json.dumps({"error": "Unauthorized"}),
+            status_code=401,
+            mimetype="application/json",
+        )
+
+    user_id = user["sub"]
+    errors = []  # (línea, motivo) de validación
+    write_errors = []  # (línea, motivo) de batches que no se escribieron
+    written = 0
+    in_flight = set()
+    batch = []
+
+    async def wait_for_slot(limit):
+        nonlocal in_flight
+        while len(in_flight) > limit:
+            done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                write_errors.extend(task.result())
+
+    # Se parsea línea por línea y cada batch sale apenas se llena
+    for line_number, raw in ndjson.iter_lines(body):
+        try:
+            with metrics.phase("parse"):
+                batch.append((line_number, _parse_line(raw, user_id)))
+        except ValueError as err:
+            errors.append((line_number, str(err)))
+            continue
+        if len(batch) == IMPORT_BATCH_SIZE:
+            await wait_for_slot(IMPORT_CONCURRENCY - 1)
+            in_flight.add(asyncio.ensure_future(_write_batch(tasks_store, user_id, batch)))
+            written += len(batch)
+            batch = []
+    if batch:
+        in_flight.add(asyncio.ensure_future(_write_batch(tasks_store, user_id, batch)))
+        written += len(batch)
+    await wait_for_slot(0)
+
+    imported = written - len(write_errors)
+    if imported:
+        task_list_cache.invalidate(user_id)
+        # Cambios masivos: el índice de búsqueda se reconstruye en la próxima búsqueda
+        title_index.invalidate(user_id)
+
+    errors = sorted(errors + write_errors)
+    logger.info("Import para %s: %s importadas, %s con error", user_id, imported, len(errors))
+    return responses.render(
+        req,
+        {
+            "imported": imported,
+            "failed": len(errors),
+            "errors": [{"line": line, "error": error} for line, error in errors[:MAX_REPORTED_ERRORS]],
+        },
+    )
@@ -4,13 +4,18 @@ import uuid
 
 import azure.functions as func
 
-from shared_code import db
+from shared_code import accounts, metrics, ratelimit, resilience, responses, storage
+from shared_code.cache import task_list_cache
+from shared_code.search import title_index
+from shared_code.serializers import etag_header, shape_task
 from shared_code.utils import get_user_from_token
 
 logger = logging.getLogger(__name__)
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+@metrics.instrumented("tasks_post")
+@ratelimit.limited("api")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
         user = get_user_from_token(req)
     except RuntimeError as err:
@@ -30,17 +35,29 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         )
 
     try:
-        _, _, tasks_container = db.get_containers()
+        users_store, tasks_store = await storage.get_stores()
+        active = await accounts.is_active(users_store, user)
     except Exception as e:
         logger.exception("No se pudo conectar a Cosmos DB al crear tarea")
         return func.HttpResponse(
             json.dumps({"error": "Could not connect to database"}),
             status_code=503,
             mimetype="application/json",
+            headers=resilience.retry_after_headers(e),
+        )
+
+    if not active:
+        # Token todavía firmado de una cuenta dada de baja (o con la baja en curso)
+        logger.warning("Creación de tarea rechazada: la cuenta %s ya no existe", user["sub"])
+        return func.HttpResponse(
+            json.dumps({"error": "Unauthorized"}),
+            status_code=401,
+            mimetype="application/json",
         )
 
     try:
-        body = req.get_json()
+        with metrics.phase("parse"):
+            body = req.get_json()
     except ValueError:
         logger.warning("JSON inválido al crear tarea")
         return func.HttpResponse(
@@ -81,8 +98,12 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     }
 
     try:
-        tasks_container.create_item(task)
+        task = await tasks_store.create_item(task)
         logger.info("Tarea %s creada para usuario %s", task["id"], user["sub"])
+        task_list_cache.invalidate(user["sub"])
+        title_index.add_task(user["sub"], task)
+    except resilience.CircuitOpenError:
+        raise
     except Exception:
         logger.exception("Error al crear la tarea para %s", user["sub"])
         return func.HttpResponse(
@@ -91,6 +112,4 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
-    return func.HttpResponse(
-        json.dumps(task), status_code=201, mimetype="application/json"
-    )
+    return responses.render(req, shape_task(task), status_code=201, headers=etag_header(task))
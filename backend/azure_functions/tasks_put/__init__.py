@@ -2,14 +2,88 @@ import json
 import logging
 
 import azure.functions as func
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
 
-from shared_code import db
+from shared_code import accounts, metrics, ratelimit, resilience, responses, storage, tombstones
+from shared_code.cache import task_list_cache
+from shared_code.search import title_index
+from shared_code.serializers import etag_header, shape_task
 from shared_code.utils import get_user_from_token
 
 logger = logging.getLogger(__name__)
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+async def _patch_task(req, tasks_store, user, task_id, update_data):
+    """
+    Actualización parcial en una sola llamada (partial document update).
+    Si el cliente envía If-Match, sólo se aplica si el ETag sigue vigente.
+    """
+    if not update_data:
+        return func.HttpResponse(
+            json.dumps({"error": "Nothing to update", "allowed": ["status", "title"]}),
+            status_code=400,
+            mimetype="application/json",
+        )
+
+    patch_operations = [
+        {"op": "set", "path": "/" + key, "value": value}
+        for key, value in update_data.items()
+    ]
+    kwargs = {}
+    if_match = req.headers.get("If-Match")
+    if if_match and if_match != "*":
+        kwargs = {"etag": if_match, "match_condition": MatchConditions.IfNotModified}
+
+    try:
+        task = await tasks_store.patch_item(
+            item=task_id,
+            partition_key=user["sub"],
+            patch_operations=patch_operations,
+            filter_predicate=tombstones.LIVE_PREDICATE,
+            **kwargs,
+        )
+    except exceptions.CosmosResourceNotFoundError:
+        logger.warning("Tarea no encontrada %s para usuario %s", task_id, user["sub"])
+        return func.HttpResponse(
+            json.dumps({"error": "Task not found"}),
+            status_code=404,
+            mimetype="application/json",
+        )
+    except exceptions.CosmosAccessConditionFailedError:
+        if not kwargs:
+            # Sin If-Match el único precondition es el predicado: la tarea está borrada
+            logger.warning("Tarea borrada %s para usuario %s", task_id, user["sub"])
+            return func.HttpResponse(
+                json.dumps({"error": "Task not found"}),
+                status_code=404,
+                mimetype="application/json",
+            )
+        logger.info("Conflicto de ETag al actualizar tarea %s", task_id)
+        return func.HttpResponse(
+            json.dumps({"error": "Task was modified by another request"}),
+            status_code=412,
+            mimetype="application/json",
+        )
+    except resilience.CircuitOpenError:
+        raise
+    except Exception:
+        logger.exception("Error al actualizar parcialmente tarea %s", task_id)
+        return func.HttpResponse(
+            json.dumps({"error": "Could not update task"}),
+            status_code=500,
+            mimetype="application/json",
+        )
+
+    logger.info("Tarea %s actualizada (patch) para usuario %s", task_id, user["sub"])
+    task_list_cache.invalidate(user["sub"])
+    title_index.add_task(user["sub"], task)
+    return responses.render(req, shape_task(task), headers=etag_header(task))
+
+
+@metrics.instrumented("tasks_put")
+@ratelimit.limited("api")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
         user = get_user_from_token(req)
     except RuntimeError as err:
@@ -29,13 +103,24 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         )
 
     try:
-        _, _, tasks_container = db.get_containers()
+        users_store, tasks_store = await storage.get_stores()
+        active = await accounts.is_active(users_store, user)
     except Exception as e:
         logger.exception("No se pudo conectar a Cosmos DB al actualizar tarea")
         return func.HttpResponse(
             json.dumps({"error": "Could not connect to database"}),
             status_code=503,
             mimetype="application/json",
+            headers=resilience.retry_after_headers(e),
+        )
+
+    if not active:
+        # Token todavía firmado de una cuenta dada de baja (o con la baja en curso)
+        logger.warning("Actualización de tarea rechazada: la cuenta %s ya no existe", user["sub"])
+        return func.HttpResponse(
+            json.dumps({"error": "Unauthorized"}),
+            status_code=401,
+            mimetype="application/json",
         )
 
     task_id = req.route_params.get("id")
@@ -48,7 +133,8 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         )
 
     try:
-        body = req.get_json()
+        with metrics.phase("parse"):
+            body = req.get_json()
     except ValueError:
         logger.warning("JSON inválido al actualizar tarea %s", task_id)
         return func.HttpResponse(
@@ -57,16 +143,6 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
-    try:
-        task = tasks_container.read_item(item=task_id, partition_key=user["sub"])
-    except Exception:
-        logger.warning("Tarea no encontrada %s para usuario %s", task_id, user["sub"])
-        return func.HttpResponse(
-            json.dumps({"error": "Task not found"}),
-            status_code=404,
-            mimetype="application/json",
-        )
-
     allowed_fields = {"title", "status"}
     update_data = {}
     for key, value in body.items():
@@ -99,6 +175,23 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
+    if req.method == "PATCH":
+        return await _patch_task(req, tasks_store, user, task_id, update_data)
+
+    try:
+        task = await tasks_store.read_item(item=task_id, partition_key=user["sub"])
+        if tombstones.is_tombstone(task):
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message="tombstone")
+    except resilience.CircuitOpenError:
+        raise
+    except Exception:
+        logger.warning("Tarea no encontrada %s para usuario %s", task_id, user["sub"])
+        return func.HttpResponse(
+            json.dumps({"error": "Task not found"}),
+            status_code=404,
+            mimetype="application/json",
+        )
+
     # Aplica cambios permitidos
     for k, v in update_data.items():
         task[k] = v
@@ -108,8 +201,22 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     task["userId"] = user["sub"]
 
     try:
-        tasks_container.upsert_item(task)
+        # Con el ETag leído: un borrado concurrente no se "resucita" con el upsert
+        task = await tasks_store.upsert_item(
+            task, etag=task.get("_etag"), match_condition=MatchConditions.IfNotModified
+        )
         logger.info("Tarea %s actualizada para usuario %s", task_id, user["sub"])
+        task_list_cache.invalidate(user["sub"])
+        title_index.add_task(user["sub"], task)
+    except exceptions.CosmosAccessConditionFailedError:
+        logger.info("Conflicto de ETag al reemplazar tarea %s", task_id)
+        return func.HttpResponse(
+            json.dumps({"error": "Task was modified by another request"}),
+            status_code=412,
+            mimetype="application/json",
+        )
+    except resilience.CircuitOpenError:
+        raise
     except Exception:
         logger.exception("Error al actualizar tarea %s", task_id)
         return func.HttpResponse(
@@ -118,4 +225,4 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
-    return func.HttpResponse(json.dumps(task), mimetype="application/json")
+    return responses.render(req, shape_task(task), headers=etag_header(task))
@@ -0,0 +1,99 @@
+import json
+import logging
+
+import azure.functions as func
+
+from shared_code import metrics, queries, ratelimit, resilience, responses, storage
+from shared_code.search import title_index
+from shared_code.serializers import shape_task
+from shared_code.utils import get_user_from_token
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEARCH_LIMIT = 50
+MAX_QUERY_LENGTH = 200
+
+
+@metrics.instrumented("tasks_search")
+@ratelimit.limited("api")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        user = get_user_from_token(req)
+    except RuntimeError as err:
+        logger.error("Error de configuración JWT: %s", err)
+        return func.HttpResponse(
+            json.dumps({"error": "Authentication service misconfigured"}),
+            status_code=500,
+            mimetype="application/json",
+        )
+
+    if not user:
+        logger.warning("Acceso no autorizado a la búsqueda de tareas")
+        return func.HttpResponse(
+            json.dumps({"error": "Unauthorized"}),
+            status_code=401,
+            mimetype="application/json",
+        )
+
+    text = (req.params.get("q") or "").strip()
+    if not text:
+        return func.HttpResponse(
+            json.dumps({"error": "q is required"}),
+            status_code=400,
+            mimetype="application/json",
+        )
+    if len(text) > MAX_QUERY_LENGTH:
+        return func.HttpResponse(
+            json.dumps({"error": "q is too long", "max": MAX_QUERY_LENGTH}),
+            status_code=400,
+            mimetype="application/json",
+        )
+
+    try:
+        limit = queries.parse_limit(req.params.get("limit")) or DEFAULT_SEARCH_LIMIT
+    except queries.QueryParamError as err:
+        return func.HttpResponse(
+            json.dumps({"error": str(err)}),
+            status_code=400,
+            mimetype="application/json",
+        )
+
+    try:
+        _, tasks_store = await storage.get_stores()
+    except Exception as e:
+        logger.exception("No se pudo conectar a Cosmos DB en la búsqueda de tareas")
+        return func.HttpResponse(
+            json.dumps({"error": "Could not connect to database"}),
+            status_code=503,
+            mimetype="application/json",
+            headers=resilience.retry_after_headers(e),
+        )
+
+    # Índice invertido por usuario: sólo la primera búsqueda recorre sus tareas
+    try:
+        with metrics.phase("search"):
+            tasks = await title_index.search(tasks_store, user["sub"], text, limit)
+    except resilience.CircuitOpenError as err:
+        logger.warning("Cosmos no disponible (breaker abierto) en búsqueda de %s", user["sub"])
+        return func.HttpResponse(
+            json.dumps({"error": "Could not connect to database"}),
+            status_code=503,
+            mimetype="application/json",
+            headers=resilience.retry_after_headers(err),
+        )
+    except resilience.CircuitOpenError:
+        raise
+    except Exception:
+        logger.exception("Error al buscar tareas de %s", user["sub"])
+        return func.HttpResponse(
+            json.dumps({"error": "Could not search tasks"}),
+            status_code=500,
+            mimetype="application/json",
+        )
+
+    logger.info("Búsqueda de %s: %d resultados", user["sub"], len(tasks))
+    return responses.render(
+        req,
+        {"items": [shape_task(t) for t in tasks]},
+        headers={"Cache-Control": "private, no-cache"},
+    )
@@ -0,0 +1,56 @@
+import json
+import logging
+
+import azure.functions as func
+
+from shared_code import metrics, ratelimit, resilience, responses, task_stats
+from shared_code.utils import get_user_from_token
+
+logger = logging.getLogger(__name__)
+
+
+@metrics.instrumented("tasks_stats")
+@ratelimit.limited("api")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        user = get_user_from_token(req)
+    except RuntimeError as err:
+        logger.error("Error de configuración JWT: %s", err)
+        return func.HttpResponse(
+            json.dumps({"error": "Authentication service misconfigured"}),
+            status_code=500,
+            mimetype="application/json",
+        )
+
+    if not user:
+        logger.warning("Acceso no autorizado al resumen de tareas")
+        return func.HttpResponse(
+            json.dumps({"error": "Unauthorized"}),
+            status_code=401,
+            mimetype="application/json",
+        )
+
+    # Point read del resumen que mantiene tasks_stats_feed (O(1) en cantidad de tareas)
+    try:
+        summary = await task_stats.get_summary(user["sub"])
+    except resilience.CircuitOpenError as err:
+        logger.warning("Cosmos no disponible (breaker abierto) para resumen de %s", user["sub"])
+        return func.HttpResponse(
+            json.dumps({"error": "Could not connect to database"}),
+            status_code=503,
+            mimetype="application/json",
+            headers=resilience.retry_after_headers(err),
+        )
+    except Exception:
+        logger.exception("No se pudo obtener el resumen de tareas de %s", user["sub"])
+        return func.HttpResponse(
+            json.dumps({"error": "Could not fetch task stats"}),
+            status_code=500,
+            mimetype="application/json",
+        )
+
+    return responses.render(
+        req,
+        task_stats.public_view(summary),
+        headers={"Cache-Control": "private, no-cache"},
+    )
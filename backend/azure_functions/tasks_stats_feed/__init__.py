@@ -0,0 +1,17 @@
+import logging
+
+import azure.functions as func
+
+from shared_code import task_stats
+
+logger = logging.getLogger(__name__)
+
+
+async def main(documents: func.DocumentList) -> None:
+    # Si falla se relanza para que el host reintente el lote (política "retry")
+    changed = [doc.to_dict() for doc in documents]
+    try:
+        await task_stats.apply_changes(changed)
+    except Exception:
+        logger.exception("Error actualizando resúmenes de tareas (%d cambios)", len(changed))
+        raise
@@ -0,0 +1,141 @@
+"""
+Los dos backends locales (memoria y SQLite) tienen que responder igual que
+Cosmos en lo que usan los handlers: cada prueba corre contra los dos.
+"""
+import asyncio
+import sqlite3
+import time
+
+import pytest
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+from shared_code import storage
+
+DEFINITION = {
+    "id": "tasks", "partition_key": "userId", "unique_keys": ["title"], "default_ttl": -1,
+}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request):
+    if request.param == "memory":
+        return storage.MemoryStore(DEFINITION)
+    connection = sqlite3.connect(":memory:")
+    request.addfinalizer(connection.close)
+    return storage.SqliteStore(DEFINITION, connection)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def task(task_id, title=None, **extra):
+    return {"id": task_id, "userId": "u1", "title": title or "Tarea " + task_id, **extra}
+
+
+def test_upsert_with_stale_etag_fails_with_412(store):
+    created = run(store.create_item(task("t1")))
+    updated = run(store.upsert_item(
+        task("t1", "Nueva"), etag=created["_etag"], match_condition=MatchConditions.IfNotModified,
+    ))
+    assert updated["_etag"] != created["_etag"]
+
+    with pytest.raises(exceptions.CosmosAccessConditionFailedError) as err:
+        run(store.upsert_item(
+            task("t1", "Otra"), etag=created["_etag"], match_condition=MatchConditions.IfNotModified,
+        ))
+    assert err.value.status_code == 412
+    assert run(store.read_item("t1", partition_key="u1"))["title"] == "Nueva"
+
+
+def test_delete_with_stale_etag_fails_with_412(store):
+    created = run(store.create_item(task("t1")))
+    run(store.patch_item("t1", "u1", [{"op": "set", "path": "/done", "value": True}]))
+
+    with pytest.raises(exceptions.CosmosAccessConditionFailedError):
+        run(store.delete_item(
+            "t1", partition_key="u1",
+            etag=created["_etag"], match_condition=MatchConditions.IfNotModified,
+        ))
+    assert run(store.read_item("t1", partition_key="u1"))["done"] is True
+
+
+def test_unique_key_conflict_is_409(store):
+    run(store.create_item(task("t1", "Repetida")))
+
+    with pytest.raises(exceptions.CosmosResourceExistsError) as err:
+        run(store.create_item(task("t2", "Repetida")))
+    assert err.value.status_code == 409
+    # La unique key es por partición
+    run(store.create_item({"id": "t2", "userId": "u2", "title": "Repetida"}))
+
+
+def test_duplicate_id_is_409(store):
+    run(store.create_item(task("t1")))
+    with pytest.raises(exceptions.CosmosResourceExistsError):
+        run(store.create_item(task("t1", "Otro título")))
+
+
+def test_failed_batch_rolls_back_and_reports_error_index(store):
+    run(store.create_item(task("t0")))
+    operations = [
+        ("create", (task("t1"),)),
+        ("patch", ("t0", [{"op": "set", "path": "/done", "value": True}])),
+        ("create", (task("t0"),)),
+        ("create", (task("t3"),)),
+    ]
+
+    with pytest.raises(exceptions.CosmosBatchOperationError) as err:
+        run(store.execute_item_batch(operations, partition_key="u1"))
+    assert err.value.error_index == 2
+    assert [r["statusCode"] for r in err.value.operation_responses] == [424, 424, 409, 424]
+
+    page = run(store.query("u1"))
+    assert [item["id"] for item in page.items] == ["t0"]
+    assert "done" not in page.items[0]
+
+
+def test_successful_batch_applies_everything(store):
+    operations = [("create", (task("t1"),)), ("upsert", (task("t2"),))]
+    results = run(store.execute_item_batch(operations, partition_key="u1"))
+    assert [r["statusCode"] for r in results] == [201, 200]
+    assert len(run(store.query("u1")).items) == 2
+
+
+def test_expired_documents_disappear(store, monkeypatch):
+    run(store.create_item(task("t1", ttl=10)))
+    run(store.create_item(task("t2")))
+    now = time.time()
+
+    monkeypatch.setattr(storage.time, "time", lambda: now + 11)
+    with pytest.raises(exceptions.CosmosResourceNotFoundError):
+        run(store.read_item("t1", partition_key="u1"))
+    assert [item["id"] for item in run(store.query("u1")).items] == ["t2"]
+    # Vencido también libera el id y la unique key
+    run(store.create_item(task("t1", "Tarea t1")))
+
+
+def test_undefined_filter(store):
+    run(store.create_item(task("t1", deletedAt=123)))
+    run(store.create_item(task("t2")))
+
+    page = run(store.query("u1", where=[("deletedAt", "undefined", None)]))
+    assert [item["id"] for item in page.items] == ["t2"]
+
+
+def test_istartswith_filter_ignores_case(store):
+    run(store.create_item(task("t1", "Comprar pan")))
+    run(store.create_item(task("t2", "comprar leche")))
+    run(store.create_item(task("t3", "Llamar")))
+    run(store.create_item(task("t4", tags=["comprar"])))
+
+    page = run(store.query(
+        "u1", where=[("title", "istartswith", "COMPRAR")], order_by=("title", "ASC"),
+    ))
+    assert [item["id"] for item in page.items] == ["t1", "t2"]
+
+
+def test_unsupported_operator_is_rejected(store):
+    with pytest.raises(ValueError):
+        run(store.query("u1", where=[("title", "like", "x")]))
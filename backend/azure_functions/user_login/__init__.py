@@ -1,41 +1,47 @@
-import datetime
 import json
 import logging
 
 import azure.functions as func
-import bcrypt
-import jwt
 
-from shared_code import db
-from shared_code.utils import get_jwt_secret
+from shared_code import accounts, metrics, passwords, ratelimit, resilience, responses, sessions, storage, users
 
 logger = logging.getLogger(__name__)
 
 
-def _verify_password(plain_password: str, stored_hash: str) -> bool:
-    # Compatibilidad: si lo almacenado parece bcrypt, verifica bcrypt; si no, compara texto (legacy).
+async def _upgrade_password_hash(users_store, user_data: dict, plain_password: str):
+    """Rehashea con el coste actual (o desde texto plano legacy). Best effort."""
     try:
-        if stored_hash and stored_hash.startswith("$2"):
-            return bcrypt.checkpw(plain_password.encode("utf-8"), stored_hash.encode("utf-8"))
-        # Legacy fallback (no recomendado, sólo para transición)
-        return plain_password == stored_hash
+        new_hash = await passwords.hash_password(plain_password)
+        await users_store.patch_item(
+            item=user_data["id"],
+            partition_key=user_data["email"],
+            patch_operations=[{"op": "set", "path": "/password", "value": new_hash}],
+        )
+        logger.info("Hash de contraseña actualizado para %s", user_data["email"])
     except Exception:
-        return False
+        logger.warning(
+            "No se pudo actualizar el hash de contraseña de %s", user_data["email"],
+            exc_info=True,
+        )
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+@metrics.instrumented("user_login")
+@ratelimit.limited("login")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
-        _, users_container, _ = db.get_containers()
+        users_store, _ = await storage.get_stores()
     except Exception as e:
         logger.exception("No se pudo conectar a Cosmos DB durante login")
         return func.HttpResponse(
             json.dumps({"error": "Could not connect to database"}),
             status_code=503,
             mimetype="application/json",
+            headers=resilience.retry_after_headers(e),
         )
 
     try:
-        body = req.get_json()
+        with metrics.phase("parse"):
+            body = req.get_json()
     except ValueError:
         logger.warning("Payload inválido en login")
         return func.HttpResponse(
@@ -44,7 +50,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
-    email = (body.get("email") or "").strip().lower()
+    email = users.normalize_email(body.get("email"))
     password = body.get("password")
 
     if not email or not password:
@@ -55,17 +61,24 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
-    query = "SELECT * FROM c WHERE c.email=@e"
-    params = [{"name": "@e", "value": email}]
-    items = list(
-        users_container.query_items(
-            query=query,
-            parameters=params,
-            partition_key=email,  # 👈 mono-partición por /email
+    user_data = await users.find_user_by_email(users_store, email)
+    if accounts.is_pending_deletion(user_data):
+        # Baja en curso: la cuenta ya no existe para el login
+        user_data = None
+
+    stored_hash = user_data.get("password", "") if user_data else ""
+    try:
+        valid = user_data is not None and await passwords.verify_password(password or "", stored_hash)
+    except passwords.HashingBusyError:
+        logger.warning("Pool de bcrypt saturado durante login de %s", email)
+        return func.HttpResponse(
+            json.dumps({"error": "Service busy, retry later"}),
+            status_code=503,
+            mimetype="application/json",
+            headers={"Retry-After": "1"},
         )
-    )
 
-    if not items or not _verify_password(password or "", items[0].get("password", "")):
+    if not valid:
         logger.info("Login fallido para %s", email)
         return func.HttpResponse(
             json.dumps({"error": "Credenciales inválidas"}),
@@ -73,14 +86,10 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
-    user_data = items[0]
-    payload = {
-        "sub": user_data["id"],
-        "email": email,
-        "exp": datetime.datetime.utcnow() + datetime.timedelta(hours=1),
-    }
+    if passwords.needs_rehash(stored_hash):
+        await _upgrade_password_hash(users_store, user_data, password)
     try:
-        secret = get_jwt_secret()
+        token = sessions.issue_access_token(users.account_id(user_data), email)
     except RuntimeError as err:
         logger.error("Configuración de JWT inválida: %s", err)
         return func.HttpResponse(
@@ -89,10 +98,13 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
-    token = jwt.encode(payload, secret, algorithm="HS256")
-    if isinstance(token, bytes):
-        token = token.decode("utf-8")
+    # Sin refresh token el cliente vuelve a hacer login al vencer el access token
+    refresh_token = None
+    try:
+        refresh_token = await sessions.create_session(users_store, user_data)
+    except Exception:
+        logger.warning("No se pudo abrir la sesión de refresh para %s", email, exc_info=True)
 
     logger.info("Login exitoso para %s", email)
 
-    return func.HttpResponse(json.dumps({"token": token}), mimetype="application/json")
+    return responses.render(req, sessions.token_response(token, refresh_token))
@@ -2,21 +2,27 @@ import json
 import logging
 
 import azure.functions as func
+from azure.cosmos import exceptions
 
-from shared_code import db
+from shared_code import accounts, metrics, ratelimit, resilience, responses, sessions, storage, users
+from shared_code.cache import task_list_cache
+from shared_code.search import title_index
+from shared_code.serializers import strip_system_properties
 from shared_code.utils import get_user_from_token
 
 logger = logging.getLogger(__name__)
 
 
 def _sanitize_user(u: dict) -> dict:
-    u2 = dict(u)
-    if "password" in u2:
-        del u2["password"]
+    u2 = strip_system_properties(u)
+    for private in ("password", sessions.SESSIONS_FIELD):
+        u2.pop(private, None)
     return u2
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+@metrics.instrumented("user_profile")
+@ratelimit.limited("api")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
         user = get_user_from_token(req)
     except RuntimeError as err:
@@ -36,20 +42,29 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         )
 
     try:
-        _, users_container, _ = db.get_containers()
+        users_store, tasks_store = await storage.get_stores()
     except Exception as e:
         logger.exception("No se pudo conectar a Cosmos DB al manejar perfil")
         return func.HttpResponse(
             json.dumps({"error": "Could not connect to database"}),
             status_code=503,
             mimetype="application/json",
+            headers=resilience.retry_after_headers(e),
         )
 
     user_id = user["sub"]
 
-    # Lee el perfil actual
+    # Lee el perfil actual (point read por id determinístico; fallback legacy por sub)
     try:
-        existing = users_container.read_item(item=user_id, partition_key=user["email"])
+        existing = await users.read_account(users_store, user["email"], user_id)
+        if users.account_id(existing) != user_id:
+            # El email se volvió a registrar: el token es de la cuenta anterior
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message="account mismatch")
+        if accounts.is_pending_deletion(existing) and req.method != "DELETE":
+            # Baja aceptada (202) que todavía completa accounts_resume: sólo se puede retomar
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message="pending deletion")
+    except resilience.CircuitOpenError:
+        raise
     except Exception:
         logger.warning("Perfil no encontrado para %s", user_id, exc_info=True)
         return func.HttpResponse(
@@ -60,14 +75,45 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
     if req.method == "GET":
         logger.debug("Perfil consultado para %s", user_id)
-        return func.HttpResponse(
-            json.dumps({"user": _sanitize_user(existing)}),
-            mimetype="application/json",
-        )
+        return responses.render(req, {"user": _sanitize_user(existing)})
+
+    if req.method == "DELETE":
+        # Baja de la cuenta: si se corta a mitad, repetir el DELETE la retoma.
+        # No espera el cache de cuentas activas: eso lo termina accounts_resume
+        try:
+            stats_store = await storage.get_stats_store()
+            archive_store = await storage.get_archive_store()
+            result = await accounts.delete_account(
+                users_store, tasks_store, stats_store, archive_store, existing, wait=False
+            )
+        except resilience.CircuitOpenError as err:
+            return func.HttpResponse(
+                json.dumps({"error": "Could not connect to database"}),
+                status_code=503,
+                mimetype="application/json",
+                headers=resilience.retry_after_headers(err),
+            )
+        except Exception:
+            logger.exception("Error al eliminar la cuenta %s", user_id)
+            return func.HttpResponse(
+                json.dumps({"error": "Could not delete account, retry to resume"}),
+                status_code=500,
+                mimetype="application/json",
+            )
+        task_list_cache.invalidate(user_id)
+        title_index.invalidate(user_id)
+        if not result["completed"]:
+            logger.info("Baja aceptada para %s; se completa en segundo plano", user_id)
+            return responses.render(
+                req, {"message": "Baja en curso", "purgedTasks": result["purged"]}, status_code=202
+            )
+        logger.info("Cuenta eliminada para %s", user_id)
+        return responses.render(req, {"message": "Cuenta eliminada", "purgedTasks": result["purged"]})
 
     # PUT (update)
     try:
-        body = req.get_json()
+        with metrics.phase("parse"):
+            body = req.get_json()
     except ValueError:
         logger.warning("JSON inválido al actualizar perfil %s", user_id)
         return func.HttpResponse(
@@ -100,8 +146,16 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         existing["name"] = new_name
 
     try:
-        users_container.upsert_item(existing)
+        if "name" in body:
+            # Patch y no upsert: no pisa las sesiones que se rotan en paralelo
+            existing = await users_store.patch_item(
+                item=existing["id"],
+                partition_key=existing["email"],
+                patch_operations=[{"op": "set", "path": "/name", "value": existing["name"]}],
+            )
         logger.info("Perfil actualizado para %s", user_id)
+    except resilience.CircuitOpenError:
+        raise
     except Exception:
         logger.exception("Error al actualizar perfil %s", user_id)
         return func.HttpResponse(
@@ -110,7 +164,6 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
-    return func.HttpResponse(
-        json.dumps({"message": "Perfil actualizado", "user": _sanitize_user(existing)}),
-        mimetype="application/json",
+    return responses.render(
+        req, {"message": "Perfil actualizado", "user": _sanitize_user(existing)}
     )
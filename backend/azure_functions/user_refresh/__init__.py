@@ -0,0 +1,121 @@
+import json
+import logging
+
+import azure.functions as func
+
+from shared_code import metrics, ratelimit, resilience, responses, sessions, storage
+
+logger = logging.getLogger(__name__)
+
+
+def _unauthorized():
+    return func.HttpResponse(
+        json.dumps({"error": "Invalid refresh token"}),
+        status_code=401,
+        mimetype="application/json",
+    )
+
+
+def _unavailable(err):
+    logger.warning("Cosmos no disponible (breaker abierto) durante refresh")
+    return func.HttpResponse(
+        json.dumps({"error": "Could not connect to database"}),
+        status_code=503,
+        mimetype="application/json",
+        headers=resilience.retry_after_headers(err),
+    )
+
+
+@metrics.instrumented("user_refresh")
+@ratelimit.limited("api")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
+    try:
+        with metrics.phase("parse"):
+            body = req.get_json()
+    except ValueError:
+        logger.warning("Payload inválido en refresh")
+        return func.HttpResponse(
+            json.dumps({"error": "Invalid JSON in request body"}),
+            status_code=400,
+            mimetype="application/json",
+        )
+
+    refresh_token = body.get("refreshToken") if isinstance(body, dict) else None
+    if not refresh_token or not isinstance(refresh_token, str):
+        return func.HttpResponse(
+            json.dumps({"error": "refreshToken is required"}),
+            status_code=400,
+            mimetype="application/json",
+        )
+
+    try:
+        users_store, _ = await storage.get_stores()
+    except Exception as e:
+        logger.exception("No se pudo conectar a Cosmos DB durante refresh")
+        return func.HttpResponse(
+            json.dumps({"error": "Could not connect to database"}),
+            status_code=503,
+            mimetype="application/json",
+            headers=resilience.retry_after_headers(e),
+        )
+
+    # DELETE = logout: revoca sólo la sesión de este refresh token
+    if req.method == "DELETE":
+        try:
+            revoked = await sessions.revoke(users_store, refresh_token)
+        except sessions.SessionError:
+            return _unauthorized()
+        except resilience.CircuitOpenError as err:
+            return _unavailable(err)
+        except RuntimeError as err:
+            logger.error("Configuración de JWT inválida: %s", err)
+            return func.HttpResponse(
+                json.dumps({"error": "Authentication service misconfigured"}),
+                status_code=500,
+                mimetype="application/json",
+            )
+        except resilience.CircuitOpenError:
+            raise
+        except Exception:
+            logger.exception("Error al revocar sesión")
+            return func.HttpResponse(
+                json.dumps({"error": "Could not revoke session"}),
+                status_code=500,
+                mimetype="application/json",
+            )
+        logger.info("Sesión revocada (existía: %s)", revoked)
+        return responses.render(req, {"message": "session revoked"})
+
+    # Firma HS256 + point read del usuario: sin bcrypt ni consultas
+    try:
+        token, new_refresh_token = await sessions.rotate(users_store, refresh_token)
+    except sessions.SessionConflictError:
+        logger.info("Refresh concurrente de la misma sesión")
+        return func.HttpResponse(
+            json.dumps({"error": "Refresh token already rotated"}),
+            status_code=409,
+            mimetype="application/json",
+        )
+    except sessions.SessionError as err:
+        logger.info("Refresh rechazado: %s", err)
+        return _unauthorized()
+    except resilience.CircuitOpenError as err:
+        return _unavailable(err)
+    except RuntimeError as err:
+        logger.error("Configuración de JWT inválida: %s", err)
+        return func.HttpResponse(
+            json.dumps({"error": "Authentication service misconfigured"}),
+            status_code=500,
+            mimetype="application/json",
+        )
+    except resilience.CircuitOpenError:
+        raise
+    except Exception:
+        logger.exception("Error al rotar refresh token")
+        return func.HttpResponse(
+            json.dumps({"error": "Could not refresh session"}),
+            status_code=500,
+            mimetype="application/json",
+        )
+
+    return responses.render(req, sessions.token_response(token, new_refresh_token))
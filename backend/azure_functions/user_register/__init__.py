@@ -3,26 +3,30 @@ import logging
 import uuid
 
 import azure.functions as func
-import bcrypt
+from azure.cosmos import exceptions
 
-from shared_code import db
+from shared_code import metrics, passwords, ratelimit, resilience, responses, storage, users
 
 logger = logging.getLogger(__name__)
 
 
-def main(req: func.HttpRequest) -> func.HttpResponse:
+@metrics.instrumented("user_register")
+@ratelimit.limited("register")
+async def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
-        _, users_container, _ = db.get_containers()
+        users_store, _ = await storage.get_stores()
     except Exception as e:
         logger.exception("No se pudo conectar a Cosmos DB durante registro")
         return func.HttpResponse(
             json.dumps({"error": "Could not connect to database"}),
             status_code=503,
             mimetype="application/json",
+            headers=resilience.retry_after_headers(e),
         )
 
     try:
-        body = req.get_json()
+        with metrics.phase("parse"):
+            body = req.get_json()
     except ValueError:
         logger.warning("Payload inválido en registro")
         return func.HttpResponse(
@@ -31,7 +35,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
-    email = (body.get("email") or "").strip().lower()
+    email = users.normalize_email(body.get("email"))
     password = body.get("password") or ""
     name = (body.get("name") or "").strip()
 
@@ -51,35 +55,40 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
-    # Chequeo explícito de existencia (rápido porque /email es partition key)
-    existing = list(
-        users_container.query_items(
-            query="SELECT VALUE COUNT(1) FROM c WHERE c.email=@e",
-            parameters=[{"name": "@e", "value": email}],
-            partition_key=email,
-        )
-    )
-    if existing and existing[0] > 0:
-        logger.info("Intento de registro con email duplicado: %s", email)
+    # Hasheo seguro (fuera del event loop, en el pool acotado)
+    try:
+        hashed = await passwords.hash_password(password)
+    except passwords.HashingBusyError:
+        logger.warning("Pool de bcrypt saturado durante registro de %s", email)
         return func.HttpResponse(
-            json.dumps({"error": "El email ya existe"}),
-            status_code=409,
+            json.dumps({"error": "Service busy, retry later"}),
+            status_code=503,
             mimetype="application/json",
+            headers={"Retry-After": "1"},
         )
 
-    # Hasheo seguro
-    hashed = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-
+    # id determinístico por email: el login es un point read y un email
+    # duplicado choca en el create (409) sin consulta previa
     user = {
-        "id": str(uuid.uuid4()),
+        "id": users.user_doc_id(email),
+        "userId": str(uuid.uuid4()),
         "email": email,
         "password": hashed,  # almacenado como hash bcrypt
         "name": name,
     }
 
     try:
-        users_container.create_item(user)
+        await users_store.create_item(user)
         logger.info("Usuario creado correctamente: %s", email)
+    except exceptions.CosmosResourceExistsError:
+        logger.info("Intento de registro con email duplicado: %s", email)
+        return func.HttpResponse(
+            json.dumps({"error": "El email ya existe"}),
+            status_code=409,
+            mimetype="application/json",
+        )
+    except resilience.CircuitOpenError:
+        raise
     except Exception as e:
         logger.exception("Error al crear usuario %s", email)
         return func.HttpResponse(
@@ -88,8 +97,6 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
         )
 
-    return func.HttpResponse(
-        json.dumps({"message": "usuario creado", "id": user["id"]}),
-        status_code=201,
-        mimetype="application/json",
+    return responses.render(
+        req, {"message": "usuario creado", "id": user["userId"]}, status_code=201
     )
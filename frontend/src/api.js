@@ -36,27 +36,103 @@ api.interceptors.response.use(
     }
     return response;
   },
-  (error) => {
+  async (error) => {
     if (SHOW_HTTP_LOGS) {
       console.error("❌ Error:", error);
     }
-    if (error?.response?.status === 401) {
-      localStorage.removeItem("token");
-      window.location.href = "/";
+    const original = error?.config;
+    if (error?.response?.status === 401 && original && !original._skipRefresh) {
+      // Access token vencido: se renueva con el refresh token y se reintenta una vez
+      try {
+        await refreshSession();
+        original._skipRefresh = true;
+        return api(original);
+      } catch (refreshError) {
+        clearSession();
+        window.location.href = "/";
+      }
     }
     return Promise.reject(error);
   }
 );
 
+// --- Sesión ---
+export const saveSession = (data) => {
+  localStorage.setItem("token", data.token);
+  if (data.refreshToken) {
+    localStorage.setItem("refreshToken", data.refreshToken);
+  }
+};
+
+const clearSession = () => {
+  localStorage.removeItem("token");
+  localStorage.removeItem("refreshToken");
+};
+
+// Un solo refresh en vuelo: los requests que fallan juntos esperan el mismo
+let refreshing = null;
+const refreshSession = () => {
+  if (!refreshing) {
+    const refreshToken = localStorage.getItem("refreshToken");
+    refreshing = (refreshToken
+      ? api.post("/user/refresh", { refreshToken }, { _skipRefresh: true })
+      : Promise.reject(new Error("no refresh token"))
+    )
+      .then((res) => saveSession(res.data))
+      .catch((err) => {
+        // 409: otra pestaña acaba de rotar el token y ya guardó el nuevo
+        if (err?.response?.status === 409 && localStorage.getItem("refreshToken") !== refreshToken) {
+          return;
+        }
+        throw err;
+      })
+      .finally(() => {
+        refreshing = null;
+      });
+  }
+  return refreshing;
+};
+
 // --- Usuario ---
-export const login = (email, password) => api.post("/user/login", { email, password });
+export const login = (email, password) =>
+  api.post("/user/login", { email, password }, { _skipRefresh: true });
 export const register = (email, password, name) => api.post("/user/register", { email, password, name });
 export const getProfile = () => api.get("/user/profile");
 export const updateProfile = (user) => api.put("/user/profile", user);
-export const logout = () => localStorage.removeItem("token");
+// Baja de la cuenta: borra el usuario y todas sus tareas (repetir retoma una baja cortada)
+export const deleteAccount = () => api.delete("/user/profile").then((res) => {
+  clearSession();
+  return res;
+});
+export const logout = () => {
+  const refreshToken = localStorage.getItem("refreshToken");
+  clearSession();
+  if (refreshToken) {
+    // Revoca la sesión en el backend; si falla, el refresh token vence solo
+    api.delete("/user/refresh", { data: { refreshToken }, _skipRefresh: true }).catch(() => {});
+  }
+};
 
 // --- Tareas ---
-export const getTasks = () => api.get("/tasks");
+export const getTasks = (params) => api.get("/tasks", { params });
+// Sincronización incremental: cambios y borrados desde el cursor (0 = todo)
+export const syncTasks = (since) => api.get("/tasks", { params: { since } });
 export const createTask = (task) => api.post("/tasks", task);
 export const updateTask = (id, task) => api.put(`/tasks/${id}`, task);
+// etag: el _etag de la tarea (viene en cada tarea y en el header ETag); 412 si cambió
+export const patchTask = (id, changes, etag) =>
+  api.patch(`/tasks/${id}`, changes, etag ? { headers: { "If-Match": etag } } : undefined);
 export const deleteTask = (id) => api.delete(`/tasks/${id}`);
+export const batchTasks = (operations) => api.post("/tasks/batch", { operations });
+// Resumen del servidor (se actualiza de forma asíncrona): para vistas que no tienen la lista
+export const getTaskStats = () => api.get("/tasks/stats");
+// Tareas completadas que se archivaron (no aparecen en getTasks ni en syncTasks)
+export const getArchivedTasks = (params) => api.get("/tasks", { params: { ...params, archived: true } });
+// Búsqueda por palabras (o comienzos de palabra) del título
+export const searchTasks = (q, limit) => api.get("/tasks/search", { params: { q, limit } });
+// Export/import NDJSON (una tarea por línea). El export llega en tramos:
+// si la respuesta trae X-Continuation-Token, se pide el siguiente con ese token
+export const exportTasks = (continuationToken) =>
+  api.get("/tasks/export", { params: { continuationToken }, responseType: "text" });
+export const importTasks = (ndjson) =>
+  api.post("/tasks/import", ndjson, { headers: { "Content-Type": "application/x-ndjson" } });
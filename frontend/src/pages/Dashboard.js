@@ -1,6 +1,6 @@
-import { useEffect, useMemo, useState } from "react";
+import { useEffect, useMemo, useRef, useState } from "react";
 import { useNavigate } from "react-router-dom";
-import { getTasks, createTask, updateTask, deleteTask, logout } from "../api";
+import { syncTasks, createTask, patchTask, deleteTask, logout } from "../api";
 import TaskModal from "../components/TaskModal";
 
 const STATUS_LABELS = {
@@ -12,6 +12,7 @@ const STATUS_LABELS = {
 
 function Dashboard() {
 	const [tasks, setTasks] = useState([]);
+	const cursorRef = useRef(null);
 	const [modalOpen, setModalOpen] = useState(false);
 	const [editing, setEditing] = useState(null);
 	const navigate = useNavigate();
@@ -26,11 +27,28 @@ function Dashboard() {
 		// eslint-disable-next-line react-hooks/exhaustive-deps
 	}, []);
 
+	// Sólo pide lo que cambió desde la última sincronización
 	const loadTasks = async () => {
+		const since = cursorRef.current;
 		try {
-			const res = await getTasks();
-			setTasks(res.data || []);
+			const res = await syncTasks(since ?? 0);
+			const { items = [], deleted = [], cursor } = res.data || {};
+			setTasks((current) => {
+				if (since === null) {
+					return items;
+				}
+				const byId = new Map(current.map((task) => [task.id, task]));
+				deleted.forEach((id) => byId.delete(id));
+				items.forEach((task) => byId.set(task.id, task));
+				return Array.from(byId.values());
+			});
+			cursorRef.current = cursor;
 		} catch (err) {
+			if (err.response?.status === 410 && since !== null) {
+				// Cursor vencido: sincronización completa
+				cursorRef.current = null;
+				return loadTasks();
+			}
 			console.error(err);
 			alert("No se pudieron cargar las tareas");
 		}
@@ -39,7 +57,8 @@ function Dashboard() {
 	const handleSave = async (task) => {
 		try {
 			if (editing) {
-				await updateTask(editing.id, task);
+				// Con el _etag de la versión editada: no pisa cambios hechos desde otro lado
+				await patchTask(editing.id, task, editing._etag);
 			} else {
 				await createTask(task);
 			}
@@ -47,6 +66,13 @@ function Dashboard() {
 			setModalOpen(false);
 			loadTasks();
 		} catch (e) {
+			if (e.response?.status === 412) {
+				alert("La tarea cambió mientras la editabas; se recargó la última versión.");
+				setEditing(null);
+				setModalOpen(false);
+				loadTasks();
+				return;
+			}
 			alert("Error: " + (e.response?.data?.error || e.message));
 		}
 	};
@@ -61,6 +87,8 @@ function Dashboard() {
 		}
 	};
 
+	// La lista completa ya está sincronizada: se cuenta aquí y refleja al instante
+	// los cambios propios (/tasks/stats se actualiza después, desde el change feed)
 	const statusCounters = useMemo(() => {
 		return tasks.reduce(
 			(acc, task) => {
@@ -1,6 +1,6 @@
 import { useState } from "react";
 import { useNavigate } from "react-router-dom";
-import { login, register } from "../api";
+import { login, register, saveSession } from "../api";
 
 function Login() {
 	const [isRegister, setIsRegister] = useState(false);
@@ -16,7 +16,7 @@ function Login() {
 				setIsRegister(false);
 			} else {
 				const res = await login(form.email, form.password);
-				localStorage.setItem("token", res.data.token);
+				saveSession(res.data);
 				navigate("/dashboard");
 			}
 		} catch (err) {
@@ -1,6 +1,6 @@
 import { useEffect, useState } from "react";
 import { useNavigate } from "react-router-dom";
-import { getProfile, updateProfile, logout } from "../api";
+import { getProfile, updateProfile, deleteAccount, logout } from "../api";
 
 function Profile() {
 	const [form, setForm] = useState({ name: "", email: "" });
@@ -33,6 +33,16 @@ function Profile() {
 		navigate("/");
 	};
 
+	const handleDeleteAccount = async () => {
+		if (!window.confirm("¿Eliminar la cuenta y todas sus tareas? No se puede deshacer.")) return;
+		try {
+			await deleteAccount();
+			navigate("/");
+		} catch (e) {
+			alert("Error: " + (e.response?.data?.error || e.message));
+		}
+	};
+
 	return (
 		<div className='page profile-page'>
 			<div className='card profile-card'>
@@ -61,6 +71,9 @@ function Profile() {
 						<button className='btn danger outline' type='button' onClick={handleLogout}>
 							Cerrar Sesión
 						</button>
+						<button className='btn danger' type='button' onClick={handleDeleteAccount}>
+							Eliminar cuenta
+						</button>
 					</div>
 				</form>
 			</div>